@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""End to end benchmark of kmanager against a local fake PPA.
+
+Starts `fakeppa.FakePPA` in this process and runs the real command line
+(`kmanager.py --kernel-url <fake PPA> ...`) in a subprocess for each
+scenario, with its own cache and download directory:
+
+    python bench/bench_ops.py [-n 5] [--repeat 3] [--latency 0.05] [--bandwidth 20M] [--error-rate 0.01]
+
+Reported per scenario, for the median of --repeat runs: wall time, requests made and
+bytes received from the PPA, download throughput and the peak RSS of the
+kmanager process, plus the 'Error' lines printed over all runs. 'warm' scenarios run a second time over the cache of
+the first run, as repeated invocations do. `update` confirms the prompt
+and runs against a stub `sudo` so nothing is installed.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import fakeppa
+
+ROOT = Path(__file__).resolve().parent.parent
+KMANAGER = ROOT / 'kmanager.py'
+
+def scenarios(number, version):
+    """
+    Returns (name, kmanager arguments, warm) for every scenario.
+    """
+    return [
+        (f'list -n {number}', ['-l', '-n', str(number)], False),
+        (f'list -n {number} (warm)', ['-l', '-n', str(number)], True),
+        (f'get {version}', ['-g', version], False),
+        (f'get {version} (warm)', ['-g', version], True),
+        ('update', ['-u'], False),
+    ]
+
+def run(server, args, workdir, stub_bin):
+    """
+    Runs kmanager once with `args` and returns (seconds, peak RSS in KiB, output).
+    """
+    env = dict(os.environ, XDG_CACHE_HOME=str(workdir / 'cache'),
+               PATH=f'{stub_bin}{os.pathsep}{os.environ.get("PATH", "")}')
+    command = [sys.executable, str(KMANAGER), '--kernel-url', server.url,
+               '--download-dir', str(workdir / 'debs'), *args]
+    with tempfile.TemporaryFile() as output:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdin=subprocess.PIPE,
+                                   stdout=output, stderr=subprocess.STDOUT)
+        # Confirms the update prompt.
+        process.stdin.write(b'yes\n')
+        process.stdin.close()
+        # wait4 gives the resource usage of this child alone.
+        _, _, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - started
+        output.seek(0)
+        return elapsed, usage.ru_maxrss, output.read().decode(errors='replace')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark kmanager list, get and update against a fake PPA')
+    parser.add_argument('-n', '--number', type=int, default=5, help='kernels to list')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario, the median is reported')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the output of the last run of each scenario')
+    fakeppa.add_arguments(parser)
+    args = parser.parse_args()
+
+    server = fakeppa.from_arguments(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    version = server.versions[-1]
+    print(f'Fake PPA: {server.url} ({len(server.versions)} versions, .deb {args.deb_size / 1e6:.1f} MB, '
+          f'latency {args.latency * 1000:.0f} ms, errors {args.error_rate:.1%}, '
+          f'bandwidth {f"{args.bandwidth / 1e6:.1f} MB/s" if args.bandwidth else "unlimited"})\n')
+    print(f'{"scenario":<24} {"median s":>8} {"requests":>9} {"MB":>7} {"MB/s":>7} {"peak RSS":>10}  errors')
+
+    with tempfile.TemporaryDirectory(prefix='kmanager-bench-') as temp:
+        temp = Path(temp)
+        # A sudo that does nothing, so update stops at its dpkg dry run.
+        stub_bin = temp / 'bin'
+        stub_bin.mkdir()
+        (stub_bin / 'sudo').write_text('#!/bin/sh\nexit 0\n')
+        (stub_bin / 'sudo').chmod(0o755)
+
+        for name, kmanager_args, warm in scenarios(args.number, version):
+            results = []
+            for attempt in range(args.repeat):
+                workdir = temp / f'run-{attempt}'
+                if not warm:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                    workdir.mkdir()
+                server.reset_stats()
+                elapsed, rss, output = run(server, kmanager_args, workdir, stub_bin)
+                results.append((elapsed, server.requests, server.sent, rss, output))
+            errors = sum(line.startswith('Error') for result in results for line in result[4].splitlines())
+            elapsed, requests, sent, rss, output = sorted(results, key=lambda result: result[0])[len(results) // 2]
+            print(f'{name:<24} {elapsed:>8.2f} {requests:>9} {sent / 1e6:>7.1f} '
+                  f'{sent / 1e6 / elapsed:>7.1f} {rss / 1024:>6.1f} MiB  {errors}')
+            if args.verbose:
+                print('    ' + output.strip().replace('\n', '\n    '))
+
+    server.shutdown()
+    server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Micro-benchmark of the PPA directory listing parsers.
+
+Compares BeautifulSoup ('html.parser') with the streaming extractor
+(kmods.iter_hrefs), over the whole page and with a bounded window of the
+last N versions, on a recorded copy of the mainline index.
+
+    python bench/bench_parse.py --record               # save a copy of the live index
+    python bench/bench_parse.py [--index FILE] [-n 5]  # run the benchmark
+
+Without a recorded copy a synthetic listing of --entries versions is used.
+Each parser runs in its own process so that the peak RSS reported is its own.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fakeppa import synthetic_index
+
+DEFAULT_INDEX = Path(__file__).resolve().parent / 'data' / 'mainline-index.html'
+METHODS = ('bs4', 'stream', 'stream-window')
+
+def run_method(method, path, number):
+    """
+    Parses the page at `path` once with `method` and returns (seconds, hrefs found).
+    """
+    import kmods
+    started = time.perf_counter()
+    if method == 'bs4':
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(path.read_bytes(), 'html.parser')
+        found = [a['href'] for a in soup.find_all('a', href=True) if kmods.__is_version_href__(a['href'])]
+    else:
+        with open(path, 'rb') as f:
+            hrefs = filter(kmods.__is_version_href__, kmods.iter_hrefs(iter(lambda: f.read(64 * 1024), b'')))
+            found = list(deque(hrefs, maxlen=number)) if method == 'stream-window' else list(hrefs)
+    return time.perf_counter() - started, len(found)
+
+def child(method, path, number, repeat):
+    """
+    Runs one method in this process and prints 'best_seconds found peak_rss_kib'.
+    """
+    import kmods  # noqa: F401  (imports are not part of the measurement)
+    import bs4    # noqa: F401
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    best, found = min(run_method(method, path, number) for _ in range(repeat))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'{best} {found} {peak - baseline}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PPA index parsing')
+    parser.add_argument('--index', type=Path, default=DEFAULT_INDEX, help='recorded copy of the mainline index')
+    parser.add_argument('--record', action='store_true', help='download the live index to --index and exit')
+    parser.add_argument('--entries', type=int, default=4000, help='versions in the synthetic index')
+    parser.add_argument('-n', '--number', type=int, default=5, help='window size for stream-window')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per method, the best is reported')
+    parser.add_argument('--child', choices=METHODS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.index, args.number, args.repeat)
+        return
+
+    if args.record:
+        import kmods
+        args.index.parent.mkdir(parents=True, exist_ok=True)
+        args.index.write_bytes(kmods.Kops().__fetch__(kmods.Kops().kernel_url))
+        print(f'Recorded {args.index} ({args.index.stat().st_size} bytes)')
+        return
+
+    index = args.index
+    if not index.exists():
+        index = Path(os.environ.get('TMPDIR', '/tmp')) / f'kmanager-synthetic-{args.entries}.html'
+        index.write_bytes(synthetic_index(args.entries))
+        print(f'No recorded index at {args.index}, using a synthetic one ({args.entries} versions)')
+    print(f'Index: {index} ({index.stat().st_size / 1024:.0f} KiB)\n')
+    print(f'{"method":<14} {"best ms":>9} {"hrefs":>7} {"peak RSS":>10}')
+    for method in METHODS:
+        output = subprocess.run([sys.executable, __file__, '--child', method, '--index', str(index),
+                                 '-n', str(args.number), '--repeat', str(args.repeat)],
+                                check=True, capture_output=True, text=True).stdout.split()
+        best, found, rss = float(output[0]), int(output[1]), int(output[2])
+        print(f'{method:<14} {best * 1000:>9.1f} {found:>7} {rss / 1024:>7.1f} MiB')
+
+if __name__ == '__main__':
+    main()
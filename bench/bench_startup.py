@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Startup benchmark of kmanager.
+
+Measures the wall time of commands that never touch the network, where
+the fixed cost of interpreter start, imports and `Kops()` is everything:
+
+    python bench/bench_startup.py [--repeat 10] [--top 12]
+
+'cold' runs a copy of the kmanager modules without bytecode (so they are
+compiled from source every time, as on the first run after an install or
+upgrade), 'warm' runs the tree itself with its bytecode cached. Both are
+the best of --repeat runs.
+The slowest imports of `kmanager.py -v`, as reported by `-X importtime`,
+are listed afterwards.
+"""
+import argparse
+import compileall
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MODULES = ('kmanager.py', 'kmods.py', 'kformat.py', 'krelay.py')
+COMMANDS = {
+    'import kmods': ['-c', 'import kmods'],
+    'Kops()': ['-c', 'import kmods; kmods.Kops()'],
+    'kmanager -h': ['kmanager.py', '-h'],
+    'kmanager -v': ['kmanager.py', '-v'],
+}
+
+def run(args, root, extra=()):
+    """
+    Runs the interpreter once with `args` in `root` and returns (seconds, stderr).
+    """
+    env = dict(os.environ, PYTHONPATH=str(root))
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, *extra, *args], cwd=root, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    return time.perf_counter() - started, result.stderr
+
+def import_times(stderr):
+    """
+    Parses `-X importtime` output into (cumulative_us, self_us, module) tuples for top level imports.
+    """
+    found = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented below the module that triggered them.
+        if not name[1:].startswith(' '):
+            found.append((int(cumulative), int(own), name.strip()))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark kmanager startup')
+    parser.add_argument('--repeat', type=int, default=10, help='warm runs per command, the best is reported')
+    parser.add_argument('--top', type=int, default=12, help='number of slowest imports to list')
+    args = parser.parse_args()
+
+    print(f'{"command":<14} {"cold ms":>9} {"warm ms":>9}')
+    with tempfile.TemporaryDirectory(prefix='kmanager-cold-') as cold_root:
+        for module in MODULES:
+            shutil.copy(ROOT / module, cold_root)
+            compileall.compile_file(str(ROOT / module), quiet=1)
+        # The interpreter itself, as a baseline for the rest.
+        baseline = min(run(['-c', 'pass'], ROOT)[0] for _ in range(args.repeat))
+        print(f'{"python":<14} {"":>9} {baseline * 1000:>9.1f}')
+        for name, command in COMMANDS.items():
+            # -B keeps the copies from ever getting bytecode.
+            cold = min(run(command, cold_root, extra=('-B',))[0] for _ in range(args.repeat))
+            warm = min(run(command, ROOT)[0] for _ in range(args.repeat))
+            print(f'{name:<14} {cold * 1000:>9.1f} {warm * 1000:>9.1f}')
+
+    _, stderr = run(COMMANDS['kmanager -v'], ROOT, extra=('-X', 'importtime'))
+    print(f'\nSlowest imports of kmanager -v (warm):\n{"cumulative ms":>14} {"self ms":>9}  module')
+    for cumulative, own, module in sorted(import_times(stderr), reverse=True)[:args.top]:
+        print(f'{cumulative / 1000:>14.1f} {own / 1000:>9.1f}  {module}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+"""A local stand-in for the mainline kernel PPA, for benchmarks.
+
+Serves the same layout as https://kernel.ubuntu.com/~kernel-ppa/mainline/:
+an index of thousands of v*/ directories, per-architecture listings,
+status and CHECKSUMS files and .deb packages of a configurable size
+(real ar archives with a control.tar.gz, so their metadata can be read),
+with ETag/Last-Modified validators, HEAD and Range support. Latency,
+errors and a per-connection bandwidth limit can be injected.
+
+    python bench/fakeppa.py --entries 4000 --latency 0.05 --bandwidth 20M
+
+Point kmanager at it with --kernel-url http://127.0.0.1:8765/~kernel-ppa/mainline/
+"""
+import argparse
+import email.utils
+import gzip
+import hashlib
+import io
+import random
+import sys
+import tarfile
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kmods import parse_size
+
+PREFIX = '/~kernel-ppa/mainline/'
+ARCHES = ('amd64', 'arm64')
+BUILD = '202401010000'
+
+def versions(entries):
+    """
+    Returns `entries` PPA version names in release order, starting at 2.6-rc1.
+    """
+    names = []
+    major, minor = 2, 6
+    while len(names) < entries:
+        names += [f'{major}.{minor}-rc{rc}' for rc in range(1, 8)] + \
+                 [f'{major}.{minor}'] + [f'{major}.{minor}.{patch}' for patch in range(1, 12)]
+        major, minor = (major + 1, 0) if minor >= 19 else (major, minor + 1)
+    return names[:entries]
+
+def listing(title, names):
+    """
+    Renders an Apache style directory listing of `names`.
+    """
+    rows = ''.join(f'<tr><td valign="top"><img src="/icons/folder.gif" alt="[DIR]"></td>'
+                   f'<td><a href="{name}">{name}</a></td>'
+                   f'<td align="right">2024-09-29 23:18  </td><td align="right">  - </td>'
+                   f'<td>&nbsp;</td></tr>\n' for name in names)
+    return ('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">\n<html>\n <head>\n'
+            f'  <title>Index of {title}</title>\n </head>\n <body>\n'
+            f'<h1>Index of {title}</h1>\n  <table>\n'
+            '   <tr><th valign="top"><img src="/icons/blank.gif" alt="[ICO]"></th>'
+            '<th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">Last modified</a></th>'
+            '<th><a href="?C=S;O=A">Size</a></th><th><a href="?C=D;O=A">Description</a></th></tr>\n'
+            '<tr><td valign="top"><img src="/icons/back.gif" alt="[PARENTDIR]"></td>'
+            '<td><a href="/~kernel-ppa/">Parent Directory</a></td><td>&nbsp;</td>'
+            '<td align="right">  - </td><td>&nbsp;</td></tr>\n'
+            + rows +
+            '</table>\n<address>Apache/2.4.29 (Ubuntu) Server at kernel.ubuntu.com Port 443</address>\n'
+            '</body></html>\n').encode()
+
+def synthetic_index(entries):
+    """
+    Builds the mainline index page with `entries` version directories.
+    """
+    return listing('/~kernel-ppa/mainline', [f'v{version}/' for version in versions(entries)])
+
+def fragment(version):
+    """
+    Returns the ABI version used in package names, e.g. "6.12-rc1" gives "6.12.0-061200rc1".
+    """
+    base, _, rc = version.partition('-')
+    major, minor, patch = (list(map(int, base.split('.'))) + [0])[:3]
+    return f'{major}.{minor}.{patch}-{major:02d}{minor:02d}{patch:02d}{rc}'
+
+def packages(version, arch):
+    """
+    Returns the .deb file names published for `version` on `arch`.
+    """
+    abi = fragment(version)
+    names = [f'linux-headers-{abi}_{abi}.{BUILD}_all.deb']
+    for flavor in ('generic', 'lowlatency'):
+        names += [f'linux-{kind}-{abi}-{flavor}_{abi}.{BUILD}_{arch}.deb'
+                  for kind in ('headers', 'image-unsigned', 'modules')]
+    return names
+
+def control(name, deb_size, libc):
+    """
+    Returns the control file of package file `name`, depending on `libc` like the real builds do.
+    """
+    package, version, arch = name[:-len('.deb')].split('_')
+    abi = version.rsplit('.', 1)[0]
+    flavor = package.rpartition('-')[2]
+    if package == f'linux-headers-{abi}' or package.startswith('linux-modules'):
+        depends = ''
+    elif package.startswith('linux-headers'):
+        depends = f'linux-headers-{abi}, libc6 (>= {libc}), libelf1 (>= 0.142), libssl3 (>= 3.0.0~~alpha1)'
+    else:
+        depends = f'kmod, linux-base (>= 4.5ubuntu1~16.04.1), linux-modules-{abi}-{flavor}'
+    lines = [f'Package: {package}', f'Version: {version}', f'Architecture: {arch}',
+             # Packages unpack to a few times their compressed size.
+             f'Installed-Size: {deb_size * 4 // 1024}']
+    if depends:
+        lines.append(f'Depends: {depends}')
+    return ('\n'.join(lines + ['Description: Linux kernel (fake)']) + '\n').encode()
+
+def deb(name, deb_size, libc):
+    """
+    Builds a .deb of about `deb_size` bytes for package file `name`, deterministic so its checksum is stable.
+    """
+    def member(member_name, data):
+        header = f'{member_name:<16}{0:<12}{0:<6}{0:<6}{100644:<8}{len(data):<10}`\n'.encode()
+        return header + data + (b'\n' if len(data) % 2 else b'')
+
+    tar_data = io.BytesIO()
+    with tarfile.open(fileobj=tar_data, mode='w', format=tarfile.GNU_FORMAT) as tar:
+        content = control(name, deb_size, libc)
+        info = tarfile.TarInfo('./control')
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    head = b'!<arch>\n' + member('debian-binary', b'2.0\n') + \
+        member('control.tar.gz', gzip.compress(tar_data.getvalue(), mtime=0))
+    # The payload is incompressible filler derived from the name.
+    seed = hashlib.sha256(name.encode()).digest()
+    size = max(deb_size - len(head) - 60, 0)
+    return head + member('data.tar', (seed * (size // len(seed) + 1))[:size])
+
+class FakePPA(ThreadingHTTPServer):
+    """
+    HTTP server emulating the PPA.
+
+    Attributes:
+        versions (list): The published versions, oldest first.
+        deb_size (int): Size in bytes of every .deb file.
+        latency (float): Seconds added before every response.
+        error_rate (float): Fraction of requests answered with a 503.
+        bandwidth (int): Per-connection bytes per second, 0 for unlimited.
+        invalid_rate (float): Fraction of versions whose build failed (no status file).
+        libc (str): The libc6 version the headers packages depend on.
+        requests (int): Requests answered so far.
+        sent (int): Body bytes sent so far.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), entries=4000, deb_size=1024 * 1024,
+                 latency=0.0, error_rate=0.0, bandwidth=0, invalid_rate=0.1, libc='2.34', seed=0):
+        super().__init__(address, FakePPAHandler)
+        self.versions = versions(entries)
+        self.known = set(self.versions)
+        self.deb_size = deb_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.invalid_rate = invalid_rate
+        self.libc = libc
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.modified = email.utils.formatdate(time.time() - 3600, usegmt=True)
+        self.index = synthetic_index(entries)
+        self.requests = 0
+        self.sent = 0
+
+    @property
+    def url(self):
+        """
+        The base URL to use as kmanager's kernel_url.
+        """
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{PREFIX}'
+
+    def reset_stats(self):
+        """
+        Zeroes `requests` and `sent`.
+        """
+        with self.lock:
+            self.requests = 0
+            self.sent = 0
+
+    def valid(self, version):
+        """
+        Returns True if `version` built successfully; the newest one always did.
+        """
+        return version == self.versions[-1] or zlib.crc32(version.encode()) % 1000 >= self.invalid_rate * 1000
+
+    def fail(self):
+        """
+        Decides whether to inject an error into the next response.
+        """
+        with self.lock:
+            self.requests += 1
+            return self.random.random() < self.error_rate
+
+    @lru_cache(maxsize=64)
+    def body(self, name):
+        """
+        Returns the content of package `name`, a .deb of about `deb_size` bytes.
+        """
+        return deb(name, self.deb_size, self.libc)
+
+    def resolve(self, path):
+        """
+        Returns (body, content type) for `path`, or None if there is no such file.
+        """
+        if not path.startswith(PREFIX):
+            return None
+        rest = path[len(PREFIX):]
+        if not rest:
+            return self.index, 'text/html'
+        parts = rest.split('/')
+        version = parts[0][1:]
+        if not parts[0].startswith('v') or version not in self.known:
+            return None
+        if parts[1:] == ['']:
+            return listing(f'{PREFIX}{parts[0]}', [f'{arch}/' for arch in ARCHES]), 'text/html'
+        if len(parts) != 3 or parts[1] not in ARCHES:
+            return None
+        name = parts[2]
+        debs = packages(version, parts[1])
+        if name == '':
+            return listing(f'{PREFIX}{parts[0]}/{parts[1]}', ['status', 'CHECKSUMS', 'log'] + debs), 'text/html'
+        if name == 'status':
+            return (b'0\n', 'text/plain') if self.valid(version) else None
+        if name == 'CHECKSUMS':
+            lines = ['# Checksums-Sha256:'] + [f'{hashlib.sha256(self.body(deb)).hexdigest()}  {deb}' for deb in debs]
+            return ('\n'.join(lines) + '\n').encode(), 'text/plain'
+        if name == 'log':
+            return b'build log\n', 'text/plain'
+        if name in debs:
+            return self.body(name), 'application/vnd.debian.binary-package'
+        return None
+
+class FakePPAHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET and HEAD requests for `FakePPA`.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.__respond__(send_body=True)
+
+    def do_HEAD(self):
+        self.__respond__(send_body=False)
+
+    def __respond__(self, send_body):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if server.fail():
+            self.__send_empty__(503)
+            return
+        found = server.resolve(self.path.split('?', 1)[0])
+        if found is None:
+            self.__send_empty__(404)
+            return
+        body, content_type = found
+        etag = f'"{zlib.crc32(body):08x}-{len(body)}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.__send_empty__(304, etag)
+            return
+
+        start, end = 0, len(body) - 1
+        spec = self.headers.get('Range', '')
+        if spec.startswith('bytes='):
+            first, _, last = spec[len('bytes='):].partition('-')
+            if first:
+                start, end = int(first), min(int(last), end) if last else end
+            else:
+                # A suffix range, the last N bytes.
+                start = max(0, len(body) - int(last))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', server.modified)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if send_body:
+            self.__send_body__(memoryview(body)[start:end + 1])
+
+    def __send_empty__(self, status, etag=None):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def __send_body__(self, data):
+        """
+        Writes `data`, no faster than the server's bandwidth limit.
+        """
+        bandwidth = self.server.bandwidth
+        chunk_size = max(1024, bandwidth // 20) if bandwidth else 1024 * 1024
+        started = time.perf_counter()
+        sent = 0
+        for position in range(0, len(data), chunk_size):
+            chunk = data[position:position + chunk_size]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if bandwidth:
+                ahead = sent / bandwidth - (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        with self.server.lock:
+            self.server.sent += sent
+
+def add_arguments(parser):
+    """
+    Adds the server options shared by this script and the benchmarks to `parser`.
+    """
+    parser.add_argument('--entries', type=int, default=4000, help='versions in the index')
+    parser.add_argument('--deb-size', type=parse_size, default=1024 * 1024, help='size of every .deb, e.g. 5M')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument('--bandwidth', type=parse_size, default=0, help='per-connection bytes per second, e.g. 10M')
+    parser.add_argument('--invalid-rate', type=float, default=0.1, help='fraction of versions without a successful build')
+    parser.add_argument('--libc', default='2.34', help='libc6 version the headers packages depend on')
+
+def from_arguments(args, address=('127.0.0.1', 0)):
+    """
+    Creates a `FakePPA` from options added by `add_arguments`.
+    """
+    return FakePPA(address, entries=args.entries, deb_size=args.deb_size, latency=args.latency,
+                   error_rate=args.error_rate, bandwidth=args.bandwidth, invalid_rate=args.invalid_rate,
+                   libc=args.libc)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake mainline kernel PPA')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = from_arguments(args, ('127.0.0.1', args.port))
+    print(f'Serving {len(server.versions)} versions on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
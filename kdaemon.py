@@ -0,0 +1,279 @@
+""" Local kmanager daemon and its thin client, used by `kmanager --daemon` and `--socket` """
+import argparse
+import json
+import os
+import platform
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+from kformat import release_line, version_banner
+
+# Where the daemon listens unless told otherwise: the user's runtime directory,
+# /run for root, or the temporary directory.
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or
+                              ('/run' if os.geteuid() == 0 else tempfile.gettempdir()), 'kmanager.sock')
+# The commands the daemon answers.
+COMMANDS = ('list', 'status', 'version', 'get')
+
+class Coalescer:
+    """
+    Runs identical concurrent calls only once.
+
+    A call made while an identical one (same key) is in progress waits for
+    it and shares its result, or its exception, instead of doing the work
+    again.
+
+    Attributes:
+        coalesced (int): Calls answered by sharing another call's result.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def run(self, key, function, *args):
+        """
+        Returns `function(*args)`, shared with any call for `key` already in progress.
+        """
+        from concurrent.futures import Future
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.calls[key]
+        return future.result()
+
+class Daemon:
+    """
+    Answers kmanager requests from one warm `Kops`.
+
+    The `Kops` instance keeps its keep-alive session, its parsed version
+    index and the releases memoized by `Kops.releases` between requests,
+    so a request costs neither interpreter startup nor a TLS handshake nor
+    an index parse. The memoized releases are queried again once they are
+    older than the HTTP cache TTL (`kops.cache.ttl`), or on request.
+
+    Attributes:
+        kops (Kops): The instance doing the work.
+        started (float): When the daemon started, as a Unix time.
+        served (int): Requests answered so far.
+        coalescer (Coalescer): Shares the result of identical concurrent requests.
+    """
+    def __init__(self, kops):
+        self.kops = kops
+        self.started = time.time()
+        self.served = 0
+        self.fetched = None
+        self.coalescer = Coalescer()
+        # Downloads share the download directory and its manifest, so they run one at a time.
+        self.get_lock = threading.Lock()
+
+    def handle(self, request):
+        """
+        Answers one request.
+
+        Args:
+            request (dict): {"command": ..., and its arguments}.
+
+        Returns:
+            dict: {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+        """
+        self.served += 1
+        command = request.get('command')
+        if command not in COMMANDS:
+            return {'ok': False, 'error': f'Unknown command {command!r}, expected one of {", ".join(COMMANDS)}'}
+        if command == 'status':
+            # Never coalesced, it describes the daemon itself.
+            return {'ok': True, 'result': self.__status__()}
+        action = {'list': self.__releases__, 'version': self.__sysinfo__, 'get': self.__download__}[command]
+        key = json.dumps(request, sort_keys=True)
+        try:
+            return {'ok': True, 'result': self.coalescer.run(key, action, request)}
+        except Exception as e:
+            return {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+    def __releases__(self, request):
+        """
+        Returns the most recent releases as dicts, oldest first.
+        """
+        kops = self.kops
+        if request.get('refresh') or self.fetched is None or time.time() - self.fetched > kops.cache.ttl:
+            kops.refresh()
+            self.fetched = time.time()
+        count = int(request.get('count') or kops.listnumber)
+        return [{name: getattr(release, name) for name in release.__slots__} for release in kops.releases(count)]
+
+    def __sysinfo__(self, request):
+        """
+        Returns the information `kmanager -v` shows.
+        """
+        kops = self.kops
+        return {'system': kops.system, 'distro_name': kops.distro_name, 'distro_version': kops.distro_version,
+                'platform': kops.platform, 'node': platform.uname().node}
+
+    def __download__(self, request):
+        """
+        Downloads the versions or expressions in request['versions'] and returns the local paths.
+        """
+        versions = request.get('versions') or []
+        if not versions:
+            raise ValueError('No versions given')
+        with self.get_lock:
+            paths = self.kops.get(versions)
+        if paths is None:
+            raise RuntimeError(f'Could not download {" ".join(versions)}, see the daemon log')
+        # Downloads change what is staged.
+        self.fetched = None
+        return paths
+
+    def __status__(self):
+        """
+        Describes the daemon and what it keeps warm.
+        """
+        kops = self.kops
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started, 'served': self.served,
+                'coalesced': self.coalescer.coalesced, 'kernel_url': kops.kernel_url,
+                'indexed': len(kops.index) if kops._index is not None else 0,
+                'releases': len(kops._releases or ()),
+                'fetched': None if self.fetched is None else time.time() - self.fetched}
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one JSON request per line and writes one JSON response per line.
+    """
+    daemon = None # Set on the subclass created by `serve`
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('a request must be a JSON object')
+            except ValueError as e:
+                response = {'ok': False, 'error': f'Invalid request: {e}'}
+            else:
+                response = self.daemon.handle(request)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+def serve(kops, path):
+    """
+    Runs the daemon on the Unix socket `path` until interrupted.
+
+    Args:
+        kops (Kops): Does the work; its settings (kernel_url, mirrors, download_dir...) apply to every request.
+        path (str): The socket to listen on.
+    """
+    if os.path.exists(path):
+        # Only replace a socket nobody is listening on any more.
+        try:
+            request(path, 'status', timeout=1)
+        except OSError:
+            os.unlink(path)
+        else:
+            print(f'Error: A daemon is already listening on {path}.')
+            return
+    daemon = Daemon(kops)
+    handler = type('BoundDaemonHandler', (DaemonHandler,), {'daemon': daemon})
+    server = socketserver.ThreadingUnixStreamServer(path, handler)
+    server.daemon_threads = True
+    os.chmod(path, 0o600)
+    print(f'Serving {kops.kernel_url} on {path}')
+    print(f'Query it with: kmanager.py --socket {path} -l  (or: python kdaemon.py --socket {path} list)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Daemon stopped.')
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+def request(path, command, timeout=None, **arguments):
+    """
+    Sends one request to the daemon listening on `path` and returns its response.
+
+    Args:
+        path (str): The daemon's socket.
+        command (str): One of `COMMANDS`.
+        timeout (float): Seconds to wait for the answer, None to wait as long as it takes (e.g. downloads).
+        **arguments: The command's arguments, e.g. count=5 or versions=["6.12.*"].
+
+    Returns:
+        dict: {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+
+    Raises:
+        OSError: If no daemon answers on `path`.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        with client.makefile('rwb') as stream:
+            stream.write(json.dumps({'command': command, **arguments}).encode() + b'\n')
+            stream.flush()
+            line = stream.readline()
+    if not line:
+        raise ConnectionError(f'The daemon on {path} closed the connection')
+    return json.loads(line)
+
+def render(command, result):
+    """
+    Renders the result of a command the way kmanager prints it.
+    """
+    if command == 'list':
+        return '\n'.join(release_line(release['version'], release['status'], release['running'], release['state'])
+                         for release in result)
+    if command == 'version':
+        return version_banner(result['system'], result['distro_name'], result['distro_version'],
+                              result['platform'], result['node'])
+    if command == 'get':
+        return '\n'.join(result + ['Download complete!'])
+    fetched = 'never' if result['fetched'] is None else f'{result["fetched"]:.0f}s ago'
+    return (f'pid {result["pid"]}, up {result["uptime"]:.0f}s, {result["served"]} request(s) served, '
+            f'{result["coalesced"]} coalesced\n{result["kernel_url"]}: {result["indexed"]} versions indexed, '
+            f'{result["releases"]} releases fetched {fetched}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Query a running kmanager daemon (kmanager.py --daemon)')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f'the daemon socket (default: {DEFAULT_SOCKET})')
+    parser.add_argument('--json', action='store_true', help='print the raw JSON response')
+    commands = parser.add_subparsers(dest='command', required=True)
+    list_parser = commands.add_parser('list', help='list the most recent kernels')
+    list_parser.add_argument('-n', '--number', type=int, help='number of kernels to list')
+    list_parser.add_argument('--refresh', action='store_true', help='query the PPA again')
+    commands.add_parser('status', help='describe the daemon')
+    commands.add_parser('version', help='report version information')
+    get_parser = commands.add_parser('get', help='download kernels')
+    get_parser.add_argument('versions', nargs='+', metavar='VERSION', help="versions or expressions, e.g. '6.12.*'")
+    args = parser.parse_args()
+
+    arguments = {'list': {'count': getattr(args, 'number', None), 'refresh': getattr(args, 'refresh', False)},
+                 'get': {'versions': getattr(args, 'versions', None)}}.get(args.command, {})
+    try:
+        response = request(args.socket, args.command, **arguments)
+    except OSError as e:
+        print(f'Error: No kmanager daemon on {args.socket}. Details: {e}', file=sys.stderr)
+        sys.exit(2)
+    if args.json:
+        print(json.dumps(response, indent=1))
+    elif response['ok']:
+        print(render(args.command, response['result']))
+    else:
+        print(f'Error: {response["error"]}', file=sys.stderr)
+    sys.exit(0 if response['ok'] else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+""" Output formats shared by kmods and the kdaemon thin client, which must stay quick to import """
+
+def release_line(version, status, running, state):
+    """
+    Renders one line of `kmanager -l` output.
+
+    Args:
+        version (str): The kernel version, e.g. "6.12-rc1".
+        status (str): 'Valid', 'Invalid' or 'Unknown'.
+        running (bool): Whether it is the running kernel.
+        state (str): 'Installed', 'Staged' or 'Available'.
+    """
+    status = f'({status} **Running**)' if running else f'({status})'
+    return f'{version:7} \t{status:21} {state}'
+
+def version_banner(system, distro_name, distro_version, kernel, node):
+    """
+    Renders the application version and system information `kmanager -v` shows.
+    """
+    return f'\n\033[1mkupdate v0.2a \nsysinfo:\n- {system} ({distro_name}\
+               {distro_version}) \n- {kernel}\n- {node}\033[0m \n'
@@ -3,12 +3,18 @@
 import sys
 import os
 import argparse
+import itertools
 from colorama import init, Fore, Back, Style
 import kmods
 
 # Initialize colorama
 init(autoreset=True)
 
+# Command-line arguments that map directly onto a Kops operation.
+ACTIONS = ('update', 'list', 'get', 'clean', 'version', 'serve', 'watch', 'daemon', 'cache_stats')
+# The actions a daemon answers for clients started with --socket.
+DAEMON_ACTIONS = ('list', 'get', 'version')
+
 def clear_screen():
     """Clears the terminal screen using ANSI escape sequences.
 
@@ -45,24 +51,95 @@ def parse_args():
                         List available Kernels{Style.RESET_ALL}")
     list_group.add_argument("-n", "--number", type=int, default=5, help=f"{Fore.GREEN}\
                         Number of Kernels to List (only with -l){Style.RESET_ALL}")
-    parser.add_argument("-g", "--get", type=str, nargs=1, help=f"{Fore.GREEN}\
-                        Get a specific Kernel{Style.RESET_ALL}")
+    list_group.add_argument("-w", "--workers", type=int, default=8, help=f"{Fore.GREEN}\
+                        Number of concurrent status probes{Style.RESET_ALL}")
+    list_group.add_argument("--full-index", action="store_true", help=f"{Fore.GREEN}\
+                        Fetch the whole version index page instead of only its newest entries{Style.RESET_ALL}")
+    parser.add_argument("-g", "--get", type=str, nargs="+", metavar="VERSION", help=f"{Fore.GREEN}\
+                        Get Kernels by version or expression, e.g. 6.12.3, '6.12.*', latest-rc,\
+                        latest-stable or '>=6.10,<6.12'{Style.RESET_ALL}")
+    xparser.add_argument("-j", "--download-workers", type=int, default=4, help=f"{Fore.GREEN}\
+                        Number of concurrent downloads{Style.RESET_ALL}")
+    clean_group = xparser.add_argument_group('clean options')
+    clean_group.add_argument("--keep", type=int, default=2, help=f"{Fore.GREEN}\
+                        Number of newest Kernels to keep besides the running one (only with -c){Style.RESET_ALL}")
+    clean_group.add_argument("--dry-run", action="store_true", help=f"{Fore.GREEN}\
+                        Only show what would be removed (only with -c){Style.RESET_ALL}")
+    package_group = xparser.add_argument_group('package options')
+    package_group.add_argument("--arch", type=str, help=f"{Fore.GREEN}\
+                        Debian architecture to download (default: detected){Style.RESET_ALL}")
+    package_group.add_argument("--flavor", type=str, default="generic", help=f"{Fore.GREEN}\
+                        Kernel flavour to download, e.g. generic or lowlatency{Style.RESET_ALL}")
+    package_group.add_argument("--download-dir", type=str, default='/var/tmp/kmanager', help=f"{Fore.GREEN}\
+                        Staging cache the .deb files are downloaded to, one directory per version\
+                        and architecture (default: /var/tmp/kmanager){Style.RESET_ALL}")
+    package_group.add_argument("--cache-size", type=kmods.parse_size, default="2G", help=f"{Fore.GREEN}\
+                        Size cap of the staging cache, e.g. 500M or 4G, 0 for none; least recently used\
+                        versions are evicted, never the running or newest installed one (default: 2G){Style.RESET_ALL}")
+    package_group.add_argument("--no-preflight", action="store_true", help=f"{Fore.GREEN}\
+                        Do not check free space and dependencies before an update downloads{Style.RESET_ALL}")
+    package_group.add_argument("--no-headers", action="store_true", help=f"{Fore.GREEN}\
+                        Do not download the linux-headers packages{Style.RESET_ALL}")
+    rate_group = xparser.add_argument_group('bandwidth options')
+    rate_group.add_argument("--max-rate", type=kmods.parse_size, default=0, metavar="RATE", help=f"{Fore.GREEN}\
+                        Combined download rate in bytes per second, e.g. 500K or 2M (default: unlimited){Style.RESET_ALL}")
+    rate_group.add_argument("--rate-schedule", type=kmods.parse_schedule, default=[], metavar="SCHEDULE", help=f"{Fore.GREEN}\
+                        Rates by local time of day, e.g. '08:00-18:00=1M,18:00-22:00=10M'; --max-rate\
+                        applies outside these windows, 0 means unlimited{Style.RESET_ALL}")
+    xparser.add_argument("--offline", action="store_true", help=f"{Fore.GREEN}\
+                        Answer from the local cache only{Style.RESET_ALL}")
+    xparser.add_argument("--cache-ttl", type=int, default=300, help=f"{Fore.GREEN}\
+                        Seconds a cached PPA page is used without revalidation{Style.RESET_ALL}")
     parser.add_argument("-c", "--clean", action="store_true", help=f"{Fore.GREEN}\
                         Clean old Kernels{Style.RESET_ALL}")
     parser.add_argument("-v", "--version", action="store_true", help=f"{Fore.GREEN}\
                         Report Version{Style.RESET_ALL}")
+    parser.add_argument("--cache-stats", action="store_true", help=f"{Fore.GREEN}\
+                        Show what the staging cache holds and how much it evicted{Style.RESET_ALL}")
+    parser.add_argument("-s", "--serve", nargs="?", const="0.0.0.0:8080", metavar="HOST:PORT", help=f"{Fore.GREEN}\
+                        Relay the PPA to other hosts (default 0.0.0.0:8080){Style.RESET_ALL}")
+    parser.add_argument("--daemon", nargs="?", const="", metavar="SOCKET", help=f"{Fore.GREEN}\
+                        Answer list, version and get requests on a Unix socket, keeping the session\
+                        and index warm (default $XDG_RUNTIME_DIR/kmanager.sock){Style.RESET_ALL}")
+    xparser.add_argument("--socket", nargs="?", const="", metavar="SOCKET", help=f"{Fore.GREEN}\
+                        Ask the daemon on SOCKET for -l, -v and -g, running locally if there is none{Style.RESET_ALL}")
+    parser.add_argument("--watch", action="store_true", help=f"{Fore.GREEN}\
+                        Poll the PPA and stage new Kernels ahead of an update{Style.RESET_ALL}")
+    watch_group = xparser.add_argument_group('watch options')
+    watch_group.add_argument("--interval", type=int, default=3600, help=f"{Fore.GREEN}\
+                        Seconds between polls (only with --watch){Style.RESET_ALL}")
+    watch_group.add_argument("--once", action="store_true", help=f"{Fore.GREEN}\
+                        Poll once and exit, for cron jobs and timers (only with --watch){Style.RESET_ALL}")
+    xparser.add_argument("--kernel-url", type=str, help=f"{Fore.GREEN}\
+                        Base URL of the mainline PPA or of a kmanager relay{Style.RESET_ALL}")
+    mirror_group = xparser.add_argument_group('mirror options')
+    mirror_group.add_argument("--mirror", action="append", metavar="URL", help=f"{Fore.GREEN}\
+                        Another mirror of the PPA, may be repeated; the fastest healthy one is used{Style.RESET_ALL}")
+    mirror_group.add_argument("--hedge-percentile", type=int, default=95, help=f"{Fore.GREEN}\
+                        Also ask the next mirror once a request is slower than this percentile (0: never){Style.RESET_ALL}")
+    trace_group = xparser.add_argument_group('instrumentation')
+    trace_group.add_argument("--timings", action="store_true", help=f"{Fore.GREEN}\
+                        Print the time spent per phase when the command ends{Style.RESET_ALL}")
+    trace_group.add_argument("--trace-json", type=str, metavar="FILE", help=f"{Fore.GREEN}\
+                        Write every timed span to FILE (Chrome trace format){Style.RESET_ALL}")
+    trace_group.add_argument("--profile", type=str, metavar="FILE", help=f"{Fore.GREEN}\
+                        Write a cProfile dump of the command to FILE{Style.RESET_ALL}")
 
     return xparser.parse_args()
 
-def menu():
+def menu(status=None):
     """Displays a colorful interactive menu and captures user input.
 
     The menu provides options for various kernel management tasks such as
     updating, listing, getting specific versions, cleaning old kernels,
-    and displaying version information.
+    and displaying version information, plus 'r' to fetch the kernel
+    list again.
+
+    Args:
+        status (str): A line about the kernel list fetched in the background, shown under the header.
 
     Returns:
-        int: The user's menu choice as an integer (1-6).
+        int: The user's menu choice as an integer (1-6), or 7 to refresh.
              Returns 6 if the user chooses to exit or cancels via Ctrl+C.
     """
     # Menu items with colors
@@ -72,11 +149,14 @@ def menu():
         f"{Fore.GREEN}3.{Style.RESET_ALL}     Get a specific RC Kernel",
         f"{Fore.GREEN}4.{Style.RESET_ALL}     Cleanup. Remove old Kernels",
         f"{Fore.GREEN}5.{Style.RESET_ALL}     Report version information",
+        f"{Fore.GREEN}r.{Style.RESET_ALL}     Refresh the Kernel list",
         f"{Fore.RED}6/q/e.{Style.RESET_ALL} Exit"
     ]
 
     # Display menu header
     print(f"\n{Fore.YELLOW}{Back.BLUE}{Style.BRIGHT} Linux Kernel Management {Style.RESET_ALL}\n")
+    if status:
+        print(f"  {Fore.CYAN}{status}{Style.RESET_ALL}\n")
 
     # Display menu items
     for item in menu_items:
@@ -85,12 +165,15 @@ def menu():
     # Get user input
     while True:
         try:
-            choice = input(f"\n{Fore.CYAN}Enter your choice (1-6/q/e):{Style.RESET_ALL} ")
+            choice = input(f"\n{Fore.CYAN}Enter your choice (1-6/r/q/e):{Style.RESET_ALL} ")
             # Validate if the input is one of the allowed menu options or exit characters
-            if choice in ('1', '2', '3', '4', '5', '6', 'q', 'e'):
+            if choice in ('1', '2', '3', '4', '5', '6', 'r', 'q', 'e'):
                 # Map 'q', 'e', or '6' to the integer 6 for consistent exit handling
                 if choice in ('q','e','6'):
                     choice='6'
+                # 'r' (refresh) comes after the numbered options.
+                if choice == 'r':
+                    choice='7'
                 return int(choice) # Return the valid choice as an integer
             # If input is invalid, inform the user and loop again
             print(f"{Fore.RED}Invalid choice. Please enter a number between 1 and 6.\
@@ -99,6 +182,99 @@ def menu():
             print(f"\n{Fore.RED}Operation cancelled by user.{Style.RESET_ALL}")
             return 6  # Treat Ctrl+C as an exit choice
 
+def prefetch_status():
+    """Describes the kernel list being fetched in the background, for the menu.
+
+    Starts the background fetch (see `kmods.Kops.prefetch`) if it is not
+    running or done already.
+
+    Returns:
+        str: One line of status.
+    """
+    future = kops.prefetch()
+    if not future.done():
+        return f"Fetching the Kernel list in the background ({kops.progress or 'starting'})..."
+    if future.exception() is not None:
+        return "The Kernel list could not be fetched, press r to retry."
+    releases = future.result()
+    if not releases:
+        return "No Kernels found."
+    latest = releases[-1]
+    return f"{len(releases)} Kernels ready, latest {latest.version} ({latest.status}, {latest.state})."
+
+def wait_for_prefetch():
+    """Waits for the background fetch of the kernel list, showing what it is doing meanwhile."""
+    from concurrent.futures import wait
+    future = kops.prefetch()
+    spinner = itertools.cycle('|/-\\')
+    while not future.done():
+        # Rewrite the same line, \033[K clears what is left of the previous message.
+        print(f"\r{Fore.CYAN}{next(spinner)} {kops.progress or 'Working'}...{Style.RESET_ALL}\033[K", end="", flush=True)
+        wait([future], timeout=0.1)
+    print("\r\033[K", end="", flush=True)
+
+def refresh_list():
+    """Forgets the kernel list once local state changed, so the next menu fetches it again."""
+    wait_for_prefetch()
+    kops.refresh()
+
+def ask_daemon(arguments, name, val):
+    """Has a running daemon (kmanager --daemon) answer a list, version or get request.
+
+    Args:
+        arguments (argparse.Namespace): The parsed command-line arguments.
+        name (str): The action, one of DAEMON_ACTIONS.
+        val: The value of its argument, e.g. the versions for get.
+
+    Returns:
+        bool: True if the daemon answered, False if there is no daemon listening.
+    """
+    import kdaemon
+    path = arguments.socket or kdaemon.DEFAULT_SOCKET
+    fields = {'list': {'count': arguments.number}, 'get': {'versions': val}}.get(name, {})
+    try:
+        response = kdaemon.request(path, name, **fields)
+    except OSError as e:
+        print(f"Warning: No kmanager daemon on {path}, running locally. Details: {e}", file=sys.stderr)
+        return False
+    if response['ok']:
+        print(kdaemon.render(name, response['result']))
+    else:
+        print(f"Error: {response['error']}")
+    return True
+
+def run_action(arguments, name, action, *args):
+    """Runs a Kops action with the instrumentation asked for on the command line.
+
+    The whole action is timed as one span, optionally under cProfile, and
+    the `--timings` summary, `--trace-json` file and `--profile` dump are
+    written once it returns, even if it failed.
+
+    Args:
+        arguments (argparse.Namespace): The parsed command-line arguments.
+        name (str): The name of the action, used for its span.
+        action (callable): The Kops method to run.
+        *args: Passed to `action`.
+    """
+    profiler = None
+    if arguments.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with kops.tracer.span(name):
+            action(*args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(arguments.profile)
+            print(f"Profile written to {arguments.profile} (view with: python -m pstats {arguments.profile})", file=sys.stderr)
+        if arguments.timings:
+            kops.tracer.summary()
+        if arguments.trace_json:
+            kops.tracer.write_json(arguments.trace_json)
+            print(f"Trace written to {arguments.trace_json}", file=sys.stderr)
+
 def is_debian_based_file_check():
     """Checks if the system is Debian-based by looking for the /etc/debian_version file.
 
@@ -122,50 +298,94 @@ def main():
     cli = vars(arguments)
     # Incase we are using the '--list' extract the optional '--number'
     kops.listnumber = arguments.number
+    # Concurrency used when probing the status of listed kernels.
+    kops.workers = arguments.workers
+    # Concurrency used when downloading kernel packages.
+    kops.download_workers = arguments.download_workers
+    # How long cached PPA pages are trusted, whether the network may be used at all,
+    # and whether the whole index page is fetched rather than its tail.
+    kops.cache.ttl = arguments.cache_ttl
+    kops.offline = arguments.offline
+    kops.full_index = arguments.full_index
+    # How many old kernels --clean keeps, and whether it only shows its plan.
+    kops.keep = arguments.keep
+    kops.dry_run = arguments.dry_run
+    # Which packages to download, where to, and whether to check them first.
+    kops.deb_arch = arguments.arch
+    kops.flavor = arguments.flavor
+    kops.headers = not arguments.no_headers
+    kops.download_dir = arguments.download_dir
+    kops.cache_size = arguments.cache_size
+    # Bandwidth shared by all downloads, optionally by time of day.
+    kops.limiter.rate = arguments.max_rate
+    kops.limiter.schedule = arguments.rate_schedule
+    kops.preflight = not arguments.no_preflight
+    # Polling behaviour of --watch.
+    kops.watch_interval = arguments.interval
+    kops.watch_once = arguments.once
+    # Only record spans when they are going to be reported.
+    kops.tracer.enabled = bool(arguments.timings or arguments.trace_json)
+    # Download from a relay or another mirror of the PPA instead of kernel.ubuntu.com.
+    if arguments.kernel_url:
+        kops.kernel_url = arguments.kernel_url.rstrip('/') + '/'
+    # Other mirrors of the same tree, ranked by latency with failover between them.
+    kops.mirrors = [mirror.rstrip('/') + '/' for mirror in arguments.mirror or ()]
+    kops.hedge_percentile = arguments.hedge_percentile
 
     # Process command-line arguments.
     # If any relevant CLI argument is found (e.g. -u, -l, -g, -c, -v),
     # the corresponding function in kops is called and the program exits.
     # This loop iterates through parsed arguments. 'key' is the arg name (e.g., 'update'),
-    # and 'val' is its value (True if an action flag, list for args like -g).
+    # and 'val' is its value (True if an action flag, list for args like -g, str for -s).
     for key, val in cli.items():
-        if val is True or isinstance(val, list): # Check if the argument was passed
+        if key in ACTIONS and val not in (None, False): # Check if the argument was passed
+            # With --socket, a running daemon answers instead, with its warm session and index.
+            if arguments.socket is not None and key in DAEMON_ACTIONS and ask_daemon(arguments, key, val):
+                sys.exit(0)
             func = getattr(kops, key) # Dynamically get the method from kops object
-            func(val) # Call the method
+            run_action(arguments, key, func, val) # Call the method, timed and profiled if asked to
             sys.exit(0) # Exit after CLI operation is done
 
     # Main interactive loop for the menu system.
     # This loop runs if no command-line arguments were processed.
+    # The kernel list is fetched in the background as soon as the menu is drawn
+    # and kept for the session, so List and Update usually answer at once.
     while True:
 
             clear_screen()
-            choice = str(menu()) # Display menu and get user's choice
+            choice = str(menu(prefetch_status())) # Display menu and get user's choice
 
             # Match the user's choice to the corresponding action.
             match choice:
                 case '1':
                     print(f"\n{Fore.CYAN}Updating to the latest RC Kernel...{Style.RESET_ALL}")
+                    wait_for_prefetch()
                     # Pass None as 'val' is not relevant for menu-driven actions.
                     kops.update(None)
+                    # A downloaded Kernel is now staged.
+                    refresh_list()
                     # Pauses execution until the user presses Enter, allowing them to read the output.
                     input(f"\n{Fore.GREEN}Press Enter to continue...{Style.RESET_ALL}")
 
                 case '2':
                     print(f"\n{Fore.CYAN}Listing available RC Kernels...{Style.RESET_ALL}")
+                    wait_for_prefetch()
                     # Pass None as 'val' is not relevant for menu-driven actions.
                     kops.list(None)
                     input(f"\n{Fore.GREEN}Press Enter to continue...{Style.RESET_ALL}")
 
                 case '3':
                     print(f"\n{Fore.CYAN}Getting a specific RC Kernel...{Style.RESET_ALL}")
-                    version = input(f"{Fore.YELLOW}Enter the kernel version to get:{Style.RESET_ALL}  ")
-                    kops.get([version])
+                    version = input(f"{Fore.YELLOW}Enter the kernel version(s) to get:{Style.RESET_ALL}  ")
+                    kops.get(version.split())
+                    refresh_list()
                     input(f"\n{Fore.GREEN}Press Enter to continue...{Style.RESET_ALL}")
 
                 case '4':
                     print(f"\n{Fore.CYAN}Cleaning up old Kernels...{Style.RESET_ALL}")
                     # Pass None as 'val' is not relevant for menu-driven actions.
                     kops.clean(None)
+                    refresh_list()
                     input(f"\n{Fore.GREEN}Press Enter to continue...{Style.RESET_ALL}")
 
                 case '5':
@@ -174,6 +394,10 @@ def main():
                     kops.version(None)
                     input(f"\n{Fore.GREEN}Press Enter to continue...{Style.RESET_ALL}")
 
+                case '7':
+                    # Fetch the list again in the background; the menu shows its progress.
+                    refresh_list()
+
                 case 'q' | 'e' | '6':  # Handles exit conditions
                     print(f"\n{Fore.RED}Exiting....{Style.RESET_ALL}")
                     break # Exit the main loop
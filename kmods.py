@@ -1,16 +1,97 @@
 """ This Class defintion is used by kupdate """
+import hashlib
+import importlib
+import json
 import platform
+import random
 import re
+from bisect import bisect_left, bisect_right, insort
 import subprocess
+import sys
+import time
+import types
 from pathlib import Path
 import os
-from io import StringIO  # Python 3
-from contextlib import redirect_stdout
+import threading
+from collections import deque
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from functools import cached_property
+from html import unescape
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
-import requests
 
-import distro
+from kformat import release_line, version_banner
+
+def __lazy_import__(name):
+    """
+    Returns module `name`, deferring its actual import until an attribute is first used.
+
+    `requests` alone takes longer to import than everything `kmanager -v`
+    does, so it is only loaded once a command really goes to the network
+    (or an exception handler needs one of its exception classes).
+
+    The stand-in returned is not registered in sys.modules: the first
+    attribute lookup does a regular import, whose module locks make it safe
+    even when that first use happens on several worker threads at once
+    (importlib's LazyLoader is not, before Python 3.12).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    class LazyModule(types.ModuleType):
+        def __getattr__(self, attribute):
+            module = importlib.import_module(name)
+            # Later lookups find everything in the stand-in itself.
+            self.__dict__.update(module.__dict__)
+            return getattr(module, attribute)
+    return LazyModule(name)
+
+requests = __lazy_import__('requests')
+# bs4 (the fallback parser), distro (`version`), concurrent.futures and email.utils
+# are imported where they are used.
+
+# Regex explanation:
+# (\d+\.\d+)       : Captures the 'major.minor' part (e.g., "6.14") into group 1. This is required.
+# (?:\.\d+)?       : Optionally matches (but doesn't capture) a patch version (e.g., ".0"). The '?:' makes it non-capturing.
+# (?:-\d+)?        : Optionally matches (but doesn't capture) build metadata or other numbers like "-061400".
+# (?:rc(\d+))?     : Optionally matches (but doesn't capture the "rc" part itself) "rc" followed by one or more digits.
+#                   The digits (\d+) following "rc" are captured into group 2 (e.g., "3" from "rc3").
+VERSION_INFO_RE = re.compile(r"(\d+\.\d+)(?:\.\d+)?(?:-\d+)?(?:rc(\d+))?")
+# Matches the href attribute of an anchor tag, double quoted, single quoted or bare.
+HREF_RE = re.compile(rb"""<a\s[^>]*?href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+# Splits a package file name such as "linux-image-unsigned-6.12.0-061200rc1-generic_..._amd64.deb"
+# into its kind ("image-unsigned") and flavour ("generic"); the common headers have no flavour.
+PACKAGE_RE = re.compile(r"linux-(headers|image-unsigned|image|modules-extra|modules)-\d+\.\d+\.\d+-\d+(?:rc\d+)?(?:-([a-z][a-z0-9-]*))?_")
+# The kernel ABI version at the start of a release string, e.g. "6.12.0-061200rc1" or "6.8.0-45".
+KERNEL_ABI_RE = re.compile(r"\d+\.\d+\.\d+-\d+(?:rc\d+)?")
+# An installed kernel package and its ABI version, e.g. "linux-modules-6.8.0-45-generic".
+KERNEL_PACKAGE_RE = re.compile(r"linux-(?:headers|image-unsigned|image|modules-extra|modules)-(\d+\.\d+\.\d+-\d+(?:rc\d+)?)(?:-[a-z][a-z0-9-]*)?")
+# Maps the machine names reported by the kernel onto the Debian architectures used by the PPA.
+DEBIAN_ARCHES = {
+    'x86_64': 'amd64', 'amd64': 'amd64', 'i386': 'i386', 'i686': 'i386',
+    'aarch64': 'arm64', 'arm64': 'arm64', 'armv7l': 'armhf', 'armv8l': 'armhf',
+    'ppc64le': 'ppc64el', 's390x': 's390x', 'riscv64': 'riscv64',
+}
+# A plain PPA version name such as "6.12", "6.11.5" or "v6.12-rc1".
+VERSION_NAME_RE = re.compile(r"v?\d+\.\d+(?:\.\d+){0,2}(?:-rc\d+)?/?")
+# One clause of a version range such as ">=6.10,<6.12".
+VERSION_CLAUSE_RE = re.compile(r"(>=|<=|==|!=|>|<)\s*(\S+)")
+# The Ubuntu mainline kernel PPA, the default `Kops.kernel_url`.
+MAINLINE_URL = 'https://kernel.ubuntu.com/~kernel-ppa/mainline/'
+# A hex encoded SHA-256 digest.
+SHA256_RE = re.compile(r"[0-9a-fA-F]{64}")
+# One relation of a Depends or Provides field, e.g. "libc6 (>= 2.34)" or "linux-modules-6.12.0-061200-generic".
+DEPENDENCY_RE = re.compile(r"([a-z0-9][a-z0-9+.-]+)(?::[a-z0-9-]+)?\s*(?:\(\s*(<<|<=|=|>=|>>|<|>)\s*([^)\s]+)\s*\))?")
+# How much of a .deb the preflight asks for first: the ar header and, usually, the whole control.tar.
+PREFLIGHT_BYTES = 64 * 1024
+# Where the files of each kind of kernel package end up, for the free space check.
+PACKAGE_DESTINATIONS = (('linux-image', '/boot'), ('linux-modules', '/lib/modules'), ('linux-headers', '/usr/src'))
+# Bytes per row of the index page, generously (a row is about 190), and the smallest tail asked for.
+INDEX_ROW_BYTES = 256
+INDEX_TAIL_BYTES = 4096
+# Matches "v6.12-rc1/", "6.11.5", "2.6.39.4" and "6.14.0-061400rc3-generic", capturing
+# major, minor, patch, a fourth 'build' number and the rc number.
+VERSION_KEY_RE = re.compile(r"v?(\d+)\.(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-(?:\d{6})?rc(\d+))?(?![\d.])")
 
 class Kops:
     """
@@ -29,6 +110,31 @@ class Kops:
         distro_version (str): The distribution version (e.g., '22.04').
         listnumber (int): The number of latest kernels to list by default.
         availablekernels (list): A list to store available kernel version strings.
+        workers (int): Maximum number of concurrent status probes.
+        timeout (int): Timeout in seconds applied to every HTTP request.
+        download_workers (int): Maximum number of concurrent file downloads.
+        retries (int): Number of times an interrupted download is resumed.
+        cache (HttpCache): On-disk cache of index pages and status files.
+        offline (bool): Answer from the cache only, never touching the network.
+        index (KernelIndex): Sorted index of the versions published at `kernel_url`.
+        parser (str): 'stream' to extract links while pages download, 'bs4' for BeautifulSoup.
+        deb_arch (str): Debian architecture to use instead of the one derived from `kernel_arch`.
+        flavor (str): Kernel flavour whose packages are downloaded (e.g., 'generic', 'lowlatency').
+        headers (bool): Whether the linux-headers packages are downloaded too.
+        download_dir (str): Directory of the staging cache the .deb files are downloaded to.
+        cache_size (int): Size cap of the staging cache in bytes, 0 for none.
+        keep (int): Number of newest kernels `clean` keeps besides the running one.
+        dry_run (bool): Only show what `clean` would remove.
+        dpkg_status (str): Path of the dpkg status database, also read by `inventory`.
+        preflight (bool): Check free space and dependencies before `update` downloads anything.
+        watch_interval (int): Seconds between polls in `watch` mode.
+        watch_once (bool): Make a single `watch` poll and return.
+        tracer (Tracer): Times requests, parsing, downloads and subprocesses when enabled.
+        mirrors (list): Other base URLs serving the same tree as `kernel_url`.
+        connect_timeout (float): Seconds to wait for a connection before failing over.
+        hedge_percentile (int): Latency percentile after which a second mirror is asked too, 0 to never hedge.
+        limiter (RateLimiter): Caps the combined bandwidth of all downloads, optionally by time of day.
+        progress (str): What `releases` is doing while it runs (e.g. 'Probing build status 3/5'), else None.
     """
     #
     def __init__(self):
@@ -36,35 +142,565 @@ class Kops:
         Initializes the Kops instance with system-specific information.
 
         Sets attributes like the current platform's kernel release, the URL for
-        the kernel PPA, system architecture, OS type, distribution name/version,
-        and initializes `listnumber` and `availablekernels`.
+        the kernel PPA, and initializes `listnumber` and `availablekernels`.
+        The system architecture, OS type and distribution name/version are
+        looked up on first use instead (see the properties below), so that
+        commands which do not need them start faster.
         """
         self.platform=platform.release() # Stores the current kernel release (e.g., '5.15.0-78-generic')
-        self.kernel_url='https://kernel.ubuntu.com/~kernel-ppa/mainline/' # Base URL for Ubuntu mainline kernels
-        self.kernel_arch=platform.processor() # Stores system architecture (e.g., 'x86_64', 'aarch64'). Note: PPA interactions (get, list status) currently use 'amd64' in URLs.
-        self.system=platform.system() # Stores the OS type (e.g., 'Linux')
-        self.distro_name=distro.name() # Stores the distribution name (e.g., 'Ubuntu')
-        self.distro_version=distro.version() # Stores the distribution version (e.g., '22.04')
+        self.kernel_url=MAINLINE_URL # Base URL for Ubuntu mainline kernels
+        self.mirrors=[] # Other mirrors of kernel_url, used by measured latency
         self.listnumber=5 # Default number of kernels to list
         self.availablekernels=[] # Stores a list of available kernel version strings fetched from the PPA
+        self.workers=8 # Maximum number of concurrent status probes
+        self.timeout=10 # Timeout in seconds for every HTTP request
+        self.connect_timeout=3.05 # Timeout in seconds to connect, before failing over to another mirror
+        self.hedge_percentile=95 # Ask a second mirror once a request is slower than this percentile
+        self.download_workers=4 # Maximum number of concurrent .deb downloads
+        self.retries=3 # Number of times an interrupted download is resumed
+        self._session=None # Shared keep-alive requests.Session, created on first use
+        self.cache=HttpCache(__cache_dir__() / 'http') # On-disk cache of PPA pages and status files
+        self.tracer=Tracer() # Records the phases of a run for --timings and --trace-json
+        self.limiter=RateLimiter() # Bandwidth shared by every download of the run, unlimited by default
+        self.offline=False # When True, answer from the cache only
+        self._index=None # Persistent version index for kernel_url, loaded on first use
+        self.parser='stream' # How directory listings are parsed: 'stream' or 'bs4'
+        self.full_index=False # When True, always fetch the whole index page instead of its tail
+        self.deb_arch=None # Overrides the Debian architecture derived from kernel_arch
+        self.flavor='generic' # Kernel flavour to download
+        self.headers=True # Whether to download the headers packages
+        self.download_dir='/var/tmp/kmanager' # The staging cache get and update put the .deb files in
+        self.cache_size=2 * 1024 ** 3 # Size cap of the staging cache, least recently used versions go first
+        self.keep=2 # Number of newest kernels clean keeps besides the running one
+        self.dry_run=False # When True, clean only shows what it would remove
+        self.dpkg_status='/var/lib/dpkg/status' # The dpkg status database
+        self.preflight=True # Check space and dependencies before update downloads anything
+        self.watch_interval=3600 # Seconds between polls in watch mode
+        self.watch_once=False # Make a single watch poll, for cron jobs and timers
+        self._releases=None # Releases memoized for this session by releases()
+        self._releases_key=None # The (kernel_url, arch) _releases were queried for
+        self._releases_lock=threading.Lock() # Lets one thread at a time query releases()
+        self._prefetch=None # Future of the background query started by prefetch()
+        self.progress=None # What releases() is doing right now, for progress displays
+        self._inventory=None # Kernels present on this machine, see inventory
+        self._mirror_set=None # Latency scores and health of kernel_url and mirrors
+
+    @cached_property
+    def kernel_arch(self):
+        """
+        The system architecture (e.g., 'x86_64', 'aarch64'), mapped to a Debian architecture by `arch`.
+
+        `platform.machine()` comes from uname(2); `platform.processor()`,
+        which may run 'uname -p', is only a fallback.
+        """
+        return platform.machine() or platform.processor()
+
+    @cached_property
+    def system(self):
+        """
+        The OS type (e.g., 'Linux').
+        """
+        return platform.system()
+
+    @cached_property
+    def distro_name(self):
+        """
+        The distribution name (e.g., 'Ubuntu').
+        """
+        import distro
+        return distro.name()
+
+    @cached_property
+    def distro_version(self):
+        """
+        The distribution version (e.g., '22.04').
+        """
+        import distro
+        return distro.version()
+
+    @property
+    def session(self):
+        """
+        Returns the shared keep-alive HTTP session, creating it on first use.
+
+        The connection pool is sized from `self.workers` and `self.download_workers`
+        so that concurrent probes and downloads reuse connections instead of
+        opening a new TLS connection each.
+        """
+        if self._session is None:
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(self.workers, self.download_workers, 1))
+            self._session.mount('https://', adapter)
+            self._session.mount('http://', adapter)
+        return self._session
+
+    @property
+    def arch(self):
+        """
+        Returns the Debian architecture of the packages to use (e.g., 'amd64', 'arm64').
+
+        `self.deb_arch` wins if set; otherwise `self.kernel_arch` is mapped
+        onto the name the PPA uses for its per-architecture directories.
+        """
+        if self.deb_arch:
+            return self.deb_arch
+        return DEBIAN_ARCHES.get(self.kernel_arch, self.kernel_arch or 'amd64')
+
+    @property
+    def selection(self):
+        """
+        Returns the `PackageSelection` for the configured flavour and headers setting.
+        """
+        return PackageSelection(self.flavor, self.headers)
+
+    @property
+    def index(self):
+        """
+        Returns the persistent version index for the current `kernel_url`.
+
+        Each base URL gets its own index file, so pointing `kernel_url`
+        somewhere else never mixes up versions from different servers.
+        """
+        if self._index is None or self._index.url != self.kernel_url:
+            name = hashlib.sha256(self.kernel_url.encode()).hexdigest()[:16]
+            self._index = KernelIndex(__cache_dir__() / 'index' / f'{name}.json', self.kernel_url)
+        return self._index
+
+    @property
+    def mirror_set(self):
+        """
+        Returns the `MirrorSet` of `kernel_url` followed by `mirrors`.
+        """
+        urls = [self.kernel_url] + [url for url in self.mirrors if url != self.kernel_url]
+        if self._mirror_set is None or self._mirror_set.urls != urls:
+            self._mirror_set = MirrorSet(urls, __cache_dir__() / 'mirrors.json')
+        return self._mirror_set
+
+    @property
+    def inventory(self):
+        """
+        Returns the `LocalInventory` of kernels installed on this machine.
+
+        It is loaded once per session (see `refresh`) from a cache file that
+        is only rebuilt when dpkg, /boot or /lib/modules changed.
+        """
+        if self._inventory is None:
+            self._inventory = LocalInventory(__cache_dir__() / 'inventory.json', self.dpkg_status)
+        return self._inventory
+
+    @property
+    def staging(self):
+        """
+        The staging cache in `self.download_dir`, with its index read afresh.
+        """
+        return StagingCache(self.download_dir, self.cache_size)
+
+    #####################
+    def releases(self, count, quiet=False):
+        """
+        Returns the `count` most recent releases published on the PPA.
+
+        This is the programmatic counterpart of `list`: nothing is printed
+        (apart from the probe timing summary on stderr) and each release is a
+        `Release` record. The result is memoized for the session, so `list`,
+        `update`, `get` and the interactive menu share one index fetch and
+        one round of status probes; call `refresh` to query the PPA again.
+        Releases already installed or staged on this machine are known to
+        be valid builds and are not probed. It is safe to call from several
+        threads (see `prefetch`): a call made while another one is querying
+        the PPA waits for it and shares its result. `self.progress` tells
+        what the query is doing meanwhile.
+
+        Args:
+            count (int): The number of releases wanted.
+            quiet (bool): Do not print the probe timing summary.
+
+        Returns:
+            list: `Release` records, oldest first.
+
+        Raises:
+            requests.exceptions.RequestException: When the PPA cannot be queried.
+        """
+        with self._releases_lock:
+            if self._releases is None or self._releases_key != (self.kernel_url, self.arch) or len(self._releases) < count:
+                try:
+                    self.progress = 'Fetching the version index'
+                    with self.tracer.span('index', count=count):
+                        self.__refresh_index__(count)
+                    releases = [self.release(name) for name in self.index.recent(count)]
+                    # Only what is not known locally needs a status probe.
+                    pending = [release for release in releases if release.status == 'Unknown']
+                    statuses = {}
+                    with self.tracer.span('probes', count=len(pending)):
+                        for name, status in self.__probe_statuses__([release.version for release in pending], quiet):
+                            statuses[name] = status
+                            self.progress = f'Probing build status {len(statuses)}/{len(pending)}'
+                finally:
+                    self.progress = None
+                for release in pending:
+                    release.status = statuses[release.version]
+                self._releases = releases
+                self._releases_key = (self.kernel_url, self.arch)
+                # Kept for callers that still read the plain version strings.
+                self.availablekernels = [release.version for release in self._releases]
+            return self._releases[-count:] if count > 0 else []
+
+    def prefetch(self):
+        """
+        Starts querying the `self.listnumber` most recent releases in the background.
+
+        Nothing happens if they are already known or being queried. The
+        interactive menu calls this as soon as it is drawn, so that List and
+        Update find the result memoized by `releases` when they are chosen.
+
+        Returns:
+            Future: Completes when the query does, with its exception if it failed.
+        """
+        if self._prefetch is None or self._prefetch.done():
+            self._prefetch = __in_thread__(self.releases, self.listnumber, True)
+        return self._prefetch
+
+    def release(self, version, status='Unknown'):
+        """
+        Returns the `Release` record for `version`, reusing one already queried this session.
+
+        Args:
+            version (str): A kernel version as named on the PPA (e.g. "6.12-rc1").
+            status (str): The status to record if the release was not queried yet.
+
+        Returns:
+            Release: The release record.
+        """
+        for release in self._releases or ():
+            if release.version == version and self._releases_key == (self.kernel_url, self.arch):
+                return release
+        url = f'{self.kernel_url}v{version}/{self.arch}/'
+        running = version_key(version) == version_key(self.platform)
+        release = Release(version, self.arch, status, url, url + 'status', running)
+        if running or self.inventory.installed(version):
+            release.state = 'Installed'
+        elif self.__staged__(release) is not None:
+            release.state = 'Staged'
+        # Installed and staged builds are known to be valid without asking the PPA.
+        if release.state != 'Available':
+            release.status = 'Valid'
+        return release
+
+    def resolve(self, expressions):
+        """
+        Turns version names and query expressions into the versions they select.
+
+        Plain version names (e.g. "6.12-rc1") are taken as they are, without
+        looking at the PPA. Anything else (see `KernelIndex.select`) is
+        resolved against the version index, which is refreshed first and
+        completed from the whole index page if only its tail was fetched so far.
+
+        Args:
+            expressions (list): Version names and expressions.
+
+        Returns:
+            list: The selected versions without duplicates, in the order given.
+
+        Raises:
+            ValueError: If an expression is invalid.
+            requests.exceptions.RequestException: When the index cannot be refreshed.
+        """
+        if not all(VERSION_NAME_RE.fullmatch(expression.strip()) for expression in expressions):
+            with self.tracer.span('index', count=self.listnumber):
+                self.__refresh_index__(max(self.listnumber, 1), full=True)
+        names = []
+        for expression in expressions:
+            expression = expression.strip()
+            if VERSION_NAME_RE.fullmatch(expression):
+                names.append(expression.lstrip('v').rstrip('/'))
+            else:
+                names.extend(self.index.select(expression))
+        return list(dict.fromkeys(names))
+
+    def refresh(self):
+        """
+        Forgets the releases memoized by `releases`, so the next query goes to the PPA.
+
+        The local inventory is checked again too. A query in progress is
+        waited for first, so that its result does not replace the new one.
+        """
+        with self._releases_lock:
+            self._releases = None
+            self._inventory = None
+
+    #############################
+    def __refresh_index__(self, count, full=False):
+        """
+        Merges the versions published on the PPA into `self.index`.
+
+        The PPA lists versions oldest first, so the last `count` entries of
+        the index page are all a listing or an update needs: they are
+        fetched with HTTP Range requests (see `__index_tail__`), a few
+        kilobytes instead of the whole page. The whole page is fetched when
+        `full` is given and the index is not complete yet (query expressions
+        need every version), with `self.full_index` or the 'bs4' parser, in
+        offline mode, or when the server cannot answer with the tail. Once
+        complete, the index stays complete as long as what is fetched
+        overlaps it; otherwise it only vouches for the newest versions it
+        holds without a gap (`KernelIndex.known_recent`). An index checked
+        less than the cache TTL ago that is complete, or holds `count`
+        versions without a gap, is used as it is; in offline mode such an
+        index is used however old it is. An older one is revalidated with
+        the ETag it was fetched with, so a page nothing was published to
+        since is answered with a 304 and no body.
+
+        Args:
+            count (int): The number of most recent versions the caller needs.
+            full (bool): Whether every version published is needed, not just the recent ones.
+        """
+        index = self.index
+        enough = index.complete or (not full and index.known_recent() >= count)
+        if enough and (self.offline or time.time() - index.checked < self.cache.ttl):
+            return
+        if (index.complete or not full) and not (self.full_index or self.offline or self.parser == 'bs4'):
+            tail = self.__index_tail__(count, validate=enough)
+            if tail is not None:
+                names, whole = tail
+                if whole:
+                    index.merge(names, complete=True, checked=True)
+                elif names:
+                    index.merge_tail(names)
+                else:
+                    # The page has not changed since the index was last checked.
+                    index.merge((), checked=True)
+                return
+        # Kernel version directories on the PPA typically start with 'v', which also
+        # helps ignore other links like 'Parent Directory'.
+        window = count if index.complete else None
+        hrefs = self.__page_hrefs__(self.kernel_url, keep=__is_version_href__, window=window)
+        if window and hrefs and hrefs[0][1:-1] not in index:
+            hrefs = self.__page_hrefs__(self.kernel_url, keep=__is_version_href__)
+        # The page cache revalidates the whole page, the index keeps no ETag of its own for it.
+        index.etag = None
+        # href has a leading 'v' and a trailing '/', which are stripped.
+        index.merge((href[1:-1] for href in hrefs), complete=True, checked=True)
+
+    def __index_tail__(self, count, validate=False):
+        """
+        Returns the version names at the end of the index page, fetched with HTTP Range requests.
+
+        The first request asks for the last (count + 2) * `INDEX_ROW_BYTES`
+        bytes of the page, at least `INDEX_TAIL_BYTES`. The row cut off at
+        the start of the range is never matched, as an href is only taken
+        from a complete anchor tag. Until the tail, together with the
+        versions it joins in the index (see `KernelIndex.covered`), gives
+        `count` versions without a gap, and reaches back into a complete
+        index so that it stays complete, a range four times as large is
+        asked for, until the whole page is covered. A page unchanged since it was cached is
+        answered with a 304 and read from disk; if the server ignores Range,
+        the whole page it sends is used (and cached). Without a cached page,
+        `validate` sends the ETag recorded in the index instead, and a 304
+        then means the index is still current. The ETag of the page the
+        names are returned from is recorded in `self.index`.
+
+        Args:
+            count (int): The number of most recent versions needed.
+            validate (bool): Whether the index already holds the `count` newest versions of the page
+                its ETag belongs to, so that an unchanged page needs no body at all.
+
+        Returns:
+            tuple: (version names in page order, whether they cover the whole page), or
+                None if the page has to be read as a whole. The names are empty when the
+                page is unchanged since the index was last checked.
+        """
+        url = self.kernel_url
+        index = self.index
+        entry = self.cache.lookup(url)
+        cached_page = entry is not None and bool(entry.get('etag'))
+        size = max(INDEX_TAIL_BYTES, (count + 2) * INDEX_ROW_BYTES)
+        while True:
+            headers = {'Range': f'bytes=-{size}'}
+            if cached_page:
+                # An unchanged page is cheaper to read back from the cache.
+                headers['If-None-Match'] = entry['etag']
+            elif validate and index.etag:
+                # Nothing to read back, but the index already ends the way an unchanged page does.
+                headers['If-None-Match'] = index.etag
+            with self.tracer.span('fetch', url=url, source='network', range=size, bytes=0) as span, \
+                    self.__request__('GET', url, headers=headers, stream=True) as response:
+                span.update(status=response.status_code, ttfb=response.elapsed.total_seconds())
+                if response.status_code == 304 and not cached_page:
+                    span['source'] = 'index'
+                    return [], False
+                if response.status_code == 304:
+                    # Unchanged since it was cached, the whole page is on disk already.
+                    self.cache.store(url, response)
+                    span['source'] = 'cache'
+                    cached = self.cache.open_body(url)
+                    if cached is None:
+                        return None
+                    with cached:
+                        names = [href[1:-1] for href in iter_hrefs(__read_chunks__(cached, 64 * 1024))
+                                 if __is_version_href__(href)]
+                    index.etag = entry['etag']
+                    return (names, True) if names else None
+                if response.status_code == 416:
+                    return None
+                response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+                if response.status_code != 206:
+                    # The server ignored Range and is sending the whole page.
+                    chunks = self.cache.store_stream(url, response, response.iter_content(64 * 1024))
+                    names = [href[1:-1] for href in iter_hrefs(chunks) if __is_version_href__(href)]
+                    span['bytes'] = int(response.headers.get('Content-Length') or 0)
+                    index.etag = response.headers.get('ETag')
+                    return (names, True) if names else None
+                body = response.content
+                etag = response.headers.get('ETag')
+                span['bytes'] = len(body)
+                # Content-Range: bytes first-last/total
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if not total.isdigit():
+                # Without the size of the page there is no telling whether the tail is all of it.
+                return None
+            names = [href[1:-1] for href in iter_hrefs([body]) if __is_version_href__(href)]
+            if size >= int(total):
+                index.etag = etag
+                return (names, True) if names else None
+            if index.covered(names) >= count and (index.joins(names) or not index.complete):
+                index.etag = etag
+                return names, False
+            size *= 4
 
     #####################
     def clean(self,val):
         """
-        Cleans old kernel files from the system by calling an external script.
+        Removes old kernels, keeping the running kernel and the `self.keep` newest ones.
 
-        This method executes '/usr/local/bin/kclean.sh' with sudo privileges
-        to remove old kernel packages. The `val` argument is not currently used.
+        The installed kernel packages are read from the dpkg status database
+        in a single parse and grouped by kernel version. Kernels that other
+        installed packages depend on (e.g. the distribution kernel of the
+        linux-image-generic metapackage) are kept too. A plan listing the
+        versions and packages to remove, and the disk space that frees
+        (installed size plus any generated initrd in /boot), is printed
+        first. With `self.dry_run` nothing else happens; otherwise, after
+        confirmation, every package is purged in one `dpkg --purge` run, so
+        the initramfs and grub triggers run once rather than once per package.
+        The `val` argument is not used.
         """
-        # The original attempt to use 'dpkg' directly via subprocess was problematic,
-        # possibly due to complexities in managing interactive prompts or privileges.
-        # Calling an external shell script simplifies this by encapsulating the dpkg logic.
         print('Cleaning Up')
-        sudo='sudo'
-        tool='/usr/local/bin/kclean.sh'
-        return_code = subprocess.call([sudo,tool],shell=False)
+        installed = parse_dpkg_status(self.dpkg_status)
+        kernels = installed_kernels(packages=installed)
+        required = required_kernels(installed)
+        running = KERNEL_ABI_RE.match(self.platform)
+        running = running.group(0) if running else None
+        # Newest first; the running kernel and the ones other packages need are always kept on top of the N newest.
+        ordered = sorted(kernels, key=__kernel_sort_key__, reverse=True)
+        keep = set(ordered[:max(self.keep, 0)]) | {running} | set(required)
+        remove = [abi for abi in ordered if abi not in keep]
+        if not remove:
+            print(f'Nothing to clean, {len(ordered)} kernel(s) installed '
+                  f'(keeping the running kernel and the {self.keep} newest).')
+            return
+
+        # Show the plan before touching anything.
+        packages = []
+        total = 0
+        print(f'Keeping: {", ".join(abi for abi in ordered if abi in keep)}')
+        for abi in ordered:
+            if abi in required:
+                print(f'  {abi} is needed by {", ".join(required[abi])}')
+        print('Removing:')
+        for abi in remove:
+            initrd = sum(path.stat().st_size for path in Path('/boot').glob(f'initrd.img-{abi}-*'))
+            size = sum(package.size for package in kernels[abi]) + initrd
+            total += size
+            packages.extend(package.name for package in kernels[abi])
+            print(f'  {abi:24} {size/1e6:8.1f} MB  {" ".join(package.name for package in kernels[abi])}')
+        print(f'{len(packages)} package(s) from {len(remove)} kernel(s), {total/1e6:.1f} MB will be freed.')
+        if self.dry_run:
+            print('Dry run, nothing was removed.')
+            return
+
+        prompt = input("Do you want to continue? (yes/no): ").strip().lower()
+        if prompt not in {"yes", "y"}:
+            return
+        # One dpkg transaction for everything, so post-removal triggers run only once.
+        with self.tracer.span('subprocess', command='dpkg --purge'):
+            return_code = subprocess.call(['sudo', 'dpkg', '--purge'] + packages, shell=False)
         if return_code != 0:
-            print(f"Error: The kernel cleanup script (kclean.sh) failed with exit code {return_code}.")
+            print(f"Error: 'dpkg --purge' failed with exit code {return_code}. Some old kernels may not have been removed.")
+
+    #####################
+    def serve(self,val):
+        """
+        Runs a caching relay of the PPA so that other hosts download through this one.
+
+        The relay mirrors the PPA directory layout, fetches each package from
+        `self.kernel_url` only once and streams it to any number of clients
+        while it is still downloading. Other hosts use it by pointing their
+        `kernel_url` (--kernel-url) at it. See krelay.py.
+
+        Args:
+            val (str): The address to listen on, as "host:port".
+        """
+        import krelay
+        krelay.serve(self, val)
+
+    #####################
+    def daemon(self,val):
+        """
+        Runs a local daemon answering list, status, version and get requests on a Unix socket.
+
+        The daemon keeps this instance, its HTTP session and its parsed
+        index warm between requests, and identical concurrent requests are
+        answered with one upstream fetch. Clients use `kmanager --socket`
+        or the thin client in kdaemon.py. See kdaemon.py.
+
+        Args:
+            val (str): The socket to listen on, or '' for `kdaemon.DEFAULT_SOCKET`.
+        """
+        import kdaemon
+        kdaemon.serve(self, val or kdaemon.DEFAULT_SOCKET)
+
+    #####################
+    def watch(self,val):
+        """
+        Polls the PPA and stages new kernels ahead of `update`.
+
+        Every `self.watch_interval` seconds the tail of the index page is
+        requested with the ETag the index was last fetched with, which is
+        answered with a 304 and no body when nothing was published (see
+        `__index_tail__`), and the newest release is probed. When it is a Valid build that is not running and
+        not staged yet, its packages are downloaded and verified into
+        `self.download_dir`, so a later `update` only has to compare versions and
+        install. Failures are retried with exponential backoff, starting at
+        30 seconds and capped at the poll interval. With `self.watch_once`
+        a single poll is made, for use from a cron job or systemd timer.
+        The `val` argument is not used.
+        """
+        # Every poll must revalidate the index, which is cheap thanks to the ETag it keeps.
+        self.cache.ttl = 0
+        failures = 0
+        while True:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            try:
+                self.refresh()
+                latest = self.releases(1)[-1]
+                if latest.running:
+                    print(f'{stamp} {latest.version} is running, nothing to stage.')
+                elif not latest.valid:
+                    print(f'{stamp} {latest.version} has no valid build yet.')
+                elif self.__staged__(latest) is not None:
+                    print(f'{stamp} {latest.version} is already staged.')
+                else:
+                    print(f'{stamp} New kernel {latest.version} found, staging it.')
+                    if not self.get([latest.version]):
+                        raise RuntimeError(f'staging {latest.version} failed')
+                    print(f'{stamp} {latest.version} is staged, run update to install it.')
+                failures = 0
+                delay = self.watch_interval
+            except (IndexError, RuntimeError, requests.exceptions.RequestException) as e:
+                failures += 1
+                delay = min(30 * 2 ** (failures - 1), self.watch_interval)
+                print(f'{stamp} Error: Poll failed ({e}), retrying in {delay}s.')
+            if self.watch_once:
+                return
+            time.sleep(delay)
 
     #####################
     def version(self,val):
@@ -74,58 +710,24 @@ class Kops:
         Prints the application version, OS type, distribution name and version,
         current kernel release, and hostname. The `val` argument is not used.
         """
-        print(f'\n\033[1mkupdate v0.2a \nsysinfo:\n- {self.system} ({self.distro_name}\
-               {self.distro_version}) \n- {self.platform}\n- {platform.uname().node}\033[0m \n')
+        print(version_banner(self.system, self.distro_name, self.distro_version, self.platform, platform.uname().node))
 
     #####################
     def list(self,val):
         """
         Lists available kernels from the Ubuntu mainline PPA.
 
-        Fetches the list of kernel versions from `self.kernel_url`.
-        It then filters and displays the latest `self.listnumber` kernel versions.
-        For each version, it checks its status (e.g., if it's the currently
-        running one or if it's a valid downloadable build for amd64).
+        Displays the latest `self.listnumber` kernel versions as returned by
+        `self.releases()`, together with their status (e.g., if it's the
+        currently running one or if it's a valid downloadable build for `self.arch`).
         The `val` argument is not used directly by this method for its primary logic,
         though it's passed from a context where it might exist (CLI parsing).
         The number of kernels to list is controlled by `self.listnumber`.
         """
-        hrefs=[]
         try:
-            response = requests.get(self.kernel_url, timeout=10)
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            # Parse the HTML content of the kernel PPA page using BeautifulSoup.
-            # 'html.parser' is the built-in Python HTML parser.
-            soup = BeautifulSoup(response.text, 'html.parser')
-            # Find all '<a>' (anchor) tags, which typically contain links.
-            links = soup.find_all('a')
-            # Extract the 'href' attribute from each link.
-            # These hrefs usually represent directories for kernel versions.
-            for link in links:
-                # Filter for hrefs that likely represent kernel version directories.
-                # Kernel version directories on the PPA typically start with 'v'.
-                # This also helps ignore other links like 'Parent Directory'.
-                if 'v' in link.get('href'):
-                    hrefs.append(link.get('href'))
-            # Extract major.minor-rcN from the currently running kernel string for comparison.
-            plat=__extract_version_info__(self.platform)
-            # Iterate through the N most recent kernel versions found (controlled by self.listnumber).
-            # hrefs are typically sorted chronologically on the PPA page, so the end of the list is newer.
-            for href in hrefs[-self.listnumber:]:
-                # Store the cleaned version string (e.g., "6.5.3-rc1") in availablekernels.
-                # href has a leading 'v' and a trailing '/', which are stripped.
-                kernel_version_str = href[1:-1]
-                self.availablekernels.append(kernel_version_str)
-                # Determine the status of this kernel version.
-                if plat == kernel_version_str:
-                    # If the listed kernel matches the running kernel version.
-                    status='(Valid **Running**)'
-                else:
-                    # For other kernels, check their build status for 'amd64' architecture.
-                    # Construct the URL to the 'status' file for this kernel version.
-                    statusurl=self.kernel_url + href + 'amd64/status' # URL to check status for amd64 architecture.
-                    status=self.__get_kernel_status__(statusurl)
-                print(f'{kernel_version_str:7} \t{status}')
+            # Query (or reuse) the N most recent releases and render them one per line.
+            for release in self.releases(self.listnumber):
+                print(format_release(release))
 
         except requests.exceptions.ConnectionError as e:
             print(f"Error: Connection failed for {self.kernel_url}. Please check your network connection. Details: {e}")
@@ -140,76 +742,90 @@ class Kops:
         """
         Updates the system to the latest available valid kernel from the PPA.
 
-        This method first calls `self.list(1)` to determine the most recent
+        This method first calls `self.releases(1)` to determine the most recent
         kernel version. It compares this with the currently running kernel.
         If an update is available and the latest kernel is marked as 'Valid',
-        it prompts the user for confirmation to download and install.
-        If the kernel files have been previously downloaded to '/var/tmp/',
-        it uses those; otherwise, it calls `self.get()` to download them.
+        a preflight check (`__preflight__`) reads just the control data of its
+        packages to make sure they fit on disk and their dependencies are met,
+        then it prompts the user for confirmation to download and install.
+        If the kernel files have been previously downloaded to the staging cache in
+        `self.download_dir` and verified, it uses those; otherwise, it calls `self.get()` to download them.
         Finally, it attempts a dry-run of `dpkg -i` for the downloaded .deb files.
         The `val` argument is not used.
         """
 
-        # Use StringIO to capture the output of self.list(1) in memory.
-        # redirect_stdout temporarily changes the standard output to the StringIO buffer.
-        new_out = StringIO()
-        with redirect_stdout(new_out):
-            # Call self.list(1) to get information about the very latest kernel.
-            # The output, including its status, will be captured in new_out.
-            self.list(1)
-
-        # Retrieve the captured output.
-        ver=new_out.getvalue()
-        # The captured output format is "X.Y.Z-rcN (Status)". Split to get the status part.
-        vers=ver.split(' ')
+        # Query the very latest release; this reuses the releases already fetched in this session.
+        try:
+            latest = self.releases(1)[-1]
+        except IndexError:
+            print(f'Error: No kernel versions found at {self.kernel_url}.')
+            return
+        except requests.exceptions.ConnectionError as e:
+            print(f"Error: Connection failed for {self.kernel_url}. Please check your network connection. Details: {e}")
+            return
+        except requests.exceptions.Timeout as e:
+            print(f"Error: Request timed out for {self.kernel_url}. The server might be too slow. Details: {e}")
+            return
+        except requests.exceptions.HTTPError as e:
+            print(f"Error: HTTP error occurred for {self.kernel_url}. Status code: {e.response.status_code}. Details: {e}")
+            return
+        except requests.exceptions.RequestException as e:
+            print(f"Error: An unexpected error occurred while fetching {self.kernel_url}. Details: {e}")
+            return
         # Get the version string of the currently running kernel.
         running=__extract_version_info__(self.platform)
-        # Get the version string of the latest available kernel from the populated list.
-        availablekernel=self.availablekernels[-1]
+        # Get the version string of the latest available kernel.
+        availablekernel=latest.version
 
         # Compare running kernel with the latest available one.
-        if running == availablekernel:
+        if latest.running:
             print(f'No update required, lastest version is already installed({running})')
             return
 
         # Check if the latest available kernel is marked as 'Valid'.
-        # vers[-1] contains the status string, e.g., "(Valid)\n".
-        if 'Valid' not in vers[-1]:
-            # If not valid (e.g., build failed for amd64), do not proceed.
+        if not latest.valid:
+            # If not valid (e.g., build failed for this architecture), do not proceed.
             print(f'No valid downloadable version for {availablekernel}')
             return
 
         print(f'Update required from {running} to {availablekernel}')
-        
+
+        # Reuse the .deb files if they were already downloaded and verified against the
+        # published checksums; this needs no network at all.
+        installs = self.__staged__(latest)
+
+        # Make sure the packages fit and their dependencies are met before anything is downloaded.
+        if self.preflight and not self.__preflight__(latest, installs):
+            print(f'Error: Preflight check failed for {availablekernel}, nothing was downloaded or installed.')
+            return
+
         # Prompt the user for confirmation before proceeding with download/install.
         prompt = input("Do you want to continue? (yes/no): ").strip().lower()
         if prompt not in {"yes", "y"}:
             # If user declines, provide manual installation instructions.
             # The kernel version fragment is used to generalize the .deb file names.
             print(f'To manually install the new kernel run:\n'
-                f'sudo dpkg -i /var/tmp/*{availablekernel.split("-")[1]}*.deb')
+                f'sudo dpkg -i {self.staging.directory(availablekernel, latest.arch)}/*.deb')
             return
 
-        # Extract a fragment of the kernel version string (typically the part after major.minor-).
-        # This fragment (e.g., "060503rc1") is used to identify related .deb files.
-        kernel_version_fragment = availablekernel.split('-')[1]
-        # Check if .deb files for this kernel version fragment already exist in /var/tmp/.
-        installs = list(Path("/var/tmp/").glob(f"*{kernel_version_fragment}*.deb"))
-
         if installs:
             # If files exist, inform the user they've already been downloaded.
             print(f'Version {availablekernel} has already been downloaded.')
+            # Using the staged packages counts as a use for the cache's LRU order.
+            self.staging.touch(availablekernel, latest.arch)
         else:
-            # If files don't exist, call self.get() to download them.
-            self.get([availablekernel])
+            # If files don't exist (or some failed verification), call self.get() to download them.
+            installs = self.get([availablekernel])
+            if not installs:
+                print(f'Error: Version {availablekernel} could not be downloaded.')
+                return
             print(f'Version {availablekernel} has been downloaded.')
-            # Refresh the list of .deb files after download.
-            installs = list(Path("/var/tmp/").glob(f"*{kernel_version_fragment}*.deb"))
 
         # Prepare and execute the dpkg command for a dry run to simulate installation.
         # This shows what would happen without actually installing.
         command = ["sudo", "dpkg", "-i", "--dry-run"] + installs
-        return_code = subprocess.call(command, shell=False)
+        with self.tracer.span('subprocess', command='dpkg -i --dry-run'):
+            return_code = subprocess.call(command, shell=False)
         if return_code != 0:
             print(f"Error: 'dpkg --dry-run' command failed with exit code {return_code}. The kernel installation was not simulated successfully.")
         return
@@ -217,132 +833,2388 @@ class Kops:
     #############################
     def get(self,val):
         """
-        Downloads kernel .deb files for a specific version.
+        Downloads kernel .deb files for one or more versions.
 
-        Constructs the URL for the specified kernel version (from `val[0]`)
-        and architecture (amd64), then calls `__download_files_with_ext__`
-        to download all .deb files from that URL to '/var/tmp/'.
+        Each entry of `val` is a version (e.g., "6.5.3") or a query
+        expression such as "6.12.*", "latest-rc", "latest-stable" or
+        ">=6.10,<6.12" (see `resolve`). The package directories of every
+        selected version for `self.arch` are then fetched in one batch by
+        `__download_batch__`, sharing connections and the download workers,
+        and the .deb files of the configured flavour (`self.selection`) are
+        saved to the staging cache in `self.download_dir`, one directory per
+        version and architecture. The cache is then brought back under
+        `self.cache_size` by evicting the least recently used versions, but
+        never the ones just fetched, the running kernel or the newest
+        installed one (see `StagingCache`).
 
         Args:
-            val (list): A list where `val[0]` is a string representing the
-                        kernel version to download (e.g., "6.5.3").
+            val (list): Kernel versions or expressions (e.g., ["6.5.3"] or ["6.12.*", "latest-rc"]).
+
+        Returns:
+            list: The local paths of the downloaded files, or None on failure.
         """
+        try:
+            versions = self.resolve(val)
+        except ValueError as e:
+            print(f'Error: {e}')
+            return None
+        except requests.exceptions.RequestException as e:
+            print(f"Error: The version index at {self.kernel_url} could not be fetched. Details: {e}")
+            return None
+        if not versions:
+            print(f'Error: No published version matches {" ".join(val)}.')
+            return None
+        if len(versions) > 1:
+            print(f'Getting {len(versions)} versions: {", ".join(versions)}')
 
-        # Construct the specific URL for the kernel version and architecture.
-        # val[0] contains the kernel version string like "6.5.3".
-        # Example URL: https://kernel.ubuntu.com/~kernel-ppa/mainline/v6.5.3/amd64/
-        url = f'https://kernel.ubuntu.com/~kernel-ppa/mainline/v{val[0]}/amd64/' # URL for amd64 architecture kernels.
+        # The package directory of each version for this architecture, e.g.
+        # https://kernel.ubuntu.com/~kernel-ppa/mainline/v6.5.3/amd64/
+        urls = [self.release(version).url for version in versions]
         extension = '.deb'  # We are interested in .deb packages.
-        output_path = '/var/tmp' # Standard temporary directory for downloads.
-
-        self.__download_files_with_ext__(url, extension, output_path)
+        staging = self.staging # '/var/tmp/kmanager' unless set with --download-dir.
+        output_paths = {url: str(staging.directory(version, self.arch)) for version, url in zip(versions, urls)}
 
+        results = self.__download_batch__(urls, extension, output_paths, self.selection)
+        for version, url in zip(versions, urls):
+            if results[url] is not None:
+                staging.touch(version, self.arch)
+        self.__evict__(staging, set(versions))
+        failed = [version for version, url in zip(versions, urls) if results[url] is None]
+        for version in failed:
+            # Leave no empty directories behind for versions that could not be fetched.
+            for directory in (staging.directory(version, self.arch), staging.directory(version, self.arch).parent):
+                try:
+                    directory.rmdir()
+                except OSError:
+                    break
+        if failed:
+            print(f'Error: Could not download {", ".join(failed)}.')
+            return None
         print('Download complete!')
+        return [path for url in urls for path in results[url]]
+    #############################
+    def __staged__(self, release):
+        """
+        Returns the verified local packages of `release` for the configured flavour, or None.
+        """
+        # The directory StagingCache.directory gives, without reading the cache index.
+        directory = os.path.join(self.download_dir, release.version, release.arch)
+        return VerifiedManifest(directory).verified(self.selection.manifest_key(release.url))
+
+    def __protected__(self, versions):
+        """
+        Returns which of the staged `versions` must never be evicted: the running and the newest installed kernel.
+        """
+        running = {version for version in versions if version_key(version) == version_key(self.platform)}
+        installed = [version for version in versions if self.inventory.installed(version)]
+        newest = max(installed, key=version_key, default=None)
+        return running | ({newest} if newest else set())
+
+    def __evict__(self, staging, keep=()):
+        """
+        Evicts least recently used versions from `staging` until it fits `self.cache_size`.
+
+        Args:
+            staging (StagingCache): The cache.
+            keep (set): Versions to keep besides the protected ones.
+        """
+        for key in staging.evict(self.__protected__(staging.versions()) | set(keep)):
+            print(f'Evicted {key} from the staging cache {staging.root} (least recently used)')
+
+    #####################
+    def cache_stats(self,val):
+        """
+        Shows what the staging cache holds and how much it has evicted.
+
+        Every staged version is listed, least recently used first (the
+        order of eviction), with its size, whether it is protected from
+        eviction and whether it has no manifest (an interrupted download, or
+        one made before manifests were kept). The `val` argument is not used.
+        """
+        staging = self.staging
+        protected = self.__protected__(staging.versions())
+        limit = f'{staging.limit/1e6:.1f} MB' if staging.limit else 'no limit'
+        print(f'Staging cache {staging.root}: {len(staging.entries)} version(s), {staging.size/1e6:.1f} MB of {limit}')
+        entries = sorted(staging.entries.items(), key=lambda item: item[1]['last_used'])
+        if entries:
+            print(f'  {"version/arch":24} {"size MB":>9}  {"last used":19}')
+        for key, entry in entries:
+            used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used']))
+            kept = '  kept (running or newest installed)' if key.partition('/')[0] in protected else ''
+            unverified = '' if staging.verified(key) else '  no manifest (interrupted or older download)'
+            print(f'  {key:24} {entry["size"]/1e6:9.1f}  {used}{kept}{unverified}')
+        print(f'Evicted so far: {staging.evicted["count"]} version(s), {staging.evicted["bytes"]/1e6:.1f} MB')
+
+    #############################
+    def __preflight__(self, release, installs=None):
+        """
+        Checks that the packages of a release can be installed, before they are downloaded.
+
+        The control data (Installed-Size and Depends) of every package is read
+        from the PPA with HTTP Range requests covering only the ar header and
+        the control member of each .deb (see `read_deb_control`), or from the
+        local files when they are already staged. The space the packages will
+        take is compared with the free space of the filesystems they install
+        to (`PACKAGE_DESTINATIONS`, plus an initramfs the size of the largest
+        one in /boot), and their dependencies with the packages in the dpkg
+        status database. A report is printed.
+
+        Args:
+            release (Release): The release to check.
+            installs (list): Local paths of its packages, if already downloaded.
+
+        Returns:
+            bool: False if the installation would fail. Packages whose control
+            data cannot be read are reported but do not fail the check.
+        """
+        if installs:
+            sources = {os.path.basename(path): path for path in installs}
+        else:
+            try:
+                file_urls = [urljoin(release.url, href) for href in self.__page_hrefs__(release.url, \
+                             keep=lambda href: href.endswith('.deb') and self.selection(href.split('/')[-1]))]
+            except requests.exceptions.RequestException as e:
+                print(f'Warning: Preflight check skipped, {release.url} could not be listed. Details: {e}')
+                return True
+            sources = {file_url.split('/')[-1]: file_url for file_url in file_urls}
+
+        def control(item):
+            filename, source = item
+            with self.tracer.span('preflight', file=filename, bytes=0) as span:
+                def read(offset, length):
+                    data = self.__read_range__(source, offset, length) if source.startswith(('http://', 'https://')) \
+                        else __read_file_range__(source, offset, length)
+                    span['bytes'] += len(data)
+                    return data
+                try:
+                    return filename, read_deb_control(read), span['bytes']
+                except (requests.exceptions.RequestException, OSError, ValueError) as e:
+                    print(f'Warning: Could not read the control data of {filename}. Details: {e}')
+                    return filename, None, span['bytes']
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(min(self.workers, len(sources)), 1)) as pool:
+            results = list(pool.map(control, sources.items()))
+        controls = [fields for _, fields, _ in results if fields is not None]
+        print(f'Preflight of {release.version}: {len(controls)}/{len(sources)} package(s), '
+              f'{sum(read for _, _, read in results)/1e3:.1f} KB read')
+
+        # The space each filesystem needs, keyed by device so that destinations sharing one add up.
+        needed = {}
+        for filename, fields, _ in results:
+            if fields is None:
+                continue
+            size = int(fields.get('Installed-Size', '0') or 0) * 1024
+            destination = next((path for prefix, path in PACKAGE_DESTINATIONS if filename.startswith(prefix)), '/usr')
+            print(f'  {fields.get("Package", filename):56} {size/1e6:8.1f} MB  {destination}')
+            needed.setdefault(destination, 0)
+            needed[destination] += size
+        if any(filename.startswith('linux-image') for filename, fields, _ in results if fields is not None):
+            # The initramfs is generated on installation; expect it to be as large as the largest one there.
+            needed['/boot'] = needed.get('/boot', 0) + max(
+                (path.stat().st_size for path in Path('/boot').glob('initrd.img-*')), default=0)
+
+        ok = True
+        filesystems = {}
+        for destination, size in needed.items():
+            # A destination that does not exist yet is created on the filesystem of its parent.
+            existing = Path(destination)
+            while not existing.exists() and existing != existing.parent:
+                existing = existing.parent
+            device = existing.stat().st_dev
+            paths, total, _ = filesystems.get(device, ([], 0, None))
+            filesystems[device] = (paths + [destination], total + size, existing)
+        import shutil
+        for paths, size, existing in filesystems.values():
+            free = shutil.disk_usage(existing).free
+            enough = free >= size
+            ok = ok and enough
+            print(f'Space: {", ".join(paths)} needs {size/1e6:.1f} MB, {free/1e6:.1f} MB free'
+                  f'{"" if enough else "  NOT ENOUGH"}')
+
+        try:
+            unmet = unmet_dependencies(controls, parse_dpkg_status(self.dpkg_status))
+        except OSError as e:
+            print(f'Warning: Dependencies not checked, {self.dpkg_status} could not be read. Details: {e}')
+            return ok
+        for package, relation, found in unmet:
+            print(f'Unmet dependency: {package} depends on {relation}{f" (found {found})" if found else " (not installed)"}')
+        if not unmet:
+            print('Dependencies: all met')
+        return ok and not unmet
+
+    #############################
+    def __read_range__(self, url, offset, length):
+        """
+        Returns `length` bytes of `url` from `offset`, asked for with an HTTP Range request.
+
+        Fewer bytes are returned at the end of the file. If the server ignores
+        the Range header, only the bytes needed are read from the full body.
+        """
+        headers = {'Range': f'bytes={offset}-{offset + length - 1}'}
+        with self.__request__('GET', url, headers=headers, stream=True) as response:
+            if response.status_code == 416:
+                return b''
+            response.raise_for_status()
+            # A 200 answer carries the whole file, skip to `offset` in it.
+            skip = 0 if response.status_code == 206 else offset
+            data = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                data += chunk
+                if len(data) >= skip + length:
+                    break
+            return bytes(data[skip:skip + length])
+
+    #############################
+    def __request__(self, method, url, retries=None, **kwargs):
+        """
+        Sends a GET or HEAD request for `url` to the fastest healthy mirror.
+
+        `url` is always built from `kernel_url`, which keeps cache keys the
+        same whichever mirror answers; it is rewritten onto the mirror
+        ranked first by `mirror_set`. A mirror that cannot be connected to
+        within `connect_timeout` or times out is skipped for a while, and
+        the request fails over to the next one after a jittered backoff, up
+        to `retries` times; a server error moves this request on to
+        the next mirror, or retries the same one if it is the only one. With more than
+        one mirror, a request still unanswered after the
+        `hedge_percentile` latency of earlier requests is also sent to the
+        next mirror, and whichever answers first is used.
+
+        Args:
+            method (str): 'GET' or 'HEAD'.
+            url (str): The URL under `kernel_url`.
+            retries (int, optional): Times to retry, `self.retries` if not given. Callers
+                with their own retry loop pass 0, so attempts do not multiply.
+            **kwargs: Passed to `requests.Session.request`.
+
+        Returns:
+            requests.Response: The response; server errors are only returned from the last attempt.
+
+        Raises:
+            requests.exceptions.RequestException: When no mirror could answer.
+        """
+        kwargs.setdefault('timeout', (min(self.connect_timeout, self.timeout), self.timeout))
+        if not url.startswith(self.kernel_url):
+            return self.session.request(method, url, **kwargs)
+        path = url[len(self.kernel_url):]
+        mirrors = self.mirror_set
+        retries = self.retries if retries is None else retries
+        tried = set()
+        error = None
+        for attempt in range(retries + 1):
+            candidates = mirrors.ranked(self.session)
+            if attempt:
+                # Full jitter, so that clients failing together do not retry together.
+                time.sleep(random.uniform(0, min(0.25 * 2 ** attempt, 5)))
+            try:
+                # Prefer mirrors that have not answered this request with a server error yet.
+                base, response = self.__hedged__(method, path, [url for url in candidates if url not in tried] or candidates, kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+                continue
+            if response.status_code < 500 or attempt == retries:
+                return response
+            tried.add(base)
+            response.close()
+            error = requests.exceptions.HTTPError(f'{response.status_code} Server Error for url: {base + path}', response=response)
+        raise error or requests.exceptions.ConnectionError(f'No mirror of {self.kernel_url} is reachable')
+
+    def __hedged__(self, method, path, candidates, kwargs):
+        """
+        Sends the request to `candidates[0]`, and to `candidates[1]` too if the first is slow.
+
+        Returns:
+            tuple: (base URL of the mirror that answered, response).
+        """
+        delay = self.mirror_set.hedge_after(self.hedge_percentile) if len(candidates) > 1 and self.hedge_percentile else None
+        if delay is None:
+            return self.__send__(method, candidates[0], path, kwargs)
+        from concurrent.futures import TimeoutError, FIRST_COMPLETED, wait
+        first = __in_thread__(self.__send__, method, candidates[0], path, kwargs)
+        try:
+            return first.result(timeout=delay)
+        except TimeoutError:
+            pass
+        with self.tracer.span('hedge', url=candidates[0] + path, mirror=candidates[1], after=delay):
+            pending = {first, __in_thread__(self.__send__, method, candidates[1], path, kwargs)}
+            error = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        # The slower request is still closed once it answers.
+                        for other in pending:
+                            other.add_done_callback(lambda f: f.exception() is None and f.result()[1].close())
+                        return future.result()
+                    error = future.exception()
+            raise error
+
+    def __send__(self, method, base, path, kwargs):
+        """
+        Sends one request to mirror `base`, recording its latency or failure in `mirror_set`.
+
+        Returns:
+            tuple: (base, response).
+        """
+        try:
+            response = self.session.request(method, base + path, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.mirror_set.fail(base)
+            raise
+        self.mirror_set.record(base, response.elapsed.total_seconds())
+        return base, response
+
+    #############################
+    def __fetch__(self, url, permanent=False):
+        """
+        Returns the whole body of `url`, see `__fetch_chunks__`.
+
+        Args:
+            url (str): The URL to fetch.
+            permanent (bool): Cache the response forever, for content that never changes.
+
+        Returns:
+            bytes: The response body.
+        """
+        return b''.join(self.__fetch_chunks__(url, permanent=permanent))
+
+    #############################
+    def __fetch_chunks__(self, url, chunk_size=64 * 1024, permanent=False):
+        """
+        Yields the body of `url` in chunks, served from the on-disk cache when possible.
+
+        A cached copy younger than the cache TTL is read back from disk without
+        any network traffic. An older copy is revalidated with If-None-Match /
+        If-Modified-Since, so an unchanged page costs a single 304 round trip.
+        A changed page is streamed from the network and written to the cache
+        as it is consumed. In offline mode only the cache is consulted.
+
+        Args:
+            url (str): The URL to fetch.
+            chunk_size (int): The size of the chunks to yield.
+            permanent (bool): Cache the response forever, for content that never changes.
+
+        Yields:
+            bytes: Successive chunks of the response body.
+
+        Raises:
+            requests.exceptions.ConnectionError: In offline mode when `url` has never been cached.
+            requests.exceptions.RequestException: When the request itself fails.
+        """
+        with self.tracer.span('fetch', url=url, source='cache', bytes=0) as span:
+            for chunk in self.__fetch_chunks_from__(url, chunk_size, permanent, span):
+                span['bytes'] += len(chunk)
+                yield chunk
+
+    def __fetch_chunks_from__(self, url, chunk_size, permanent, span):
+        """
+        Yields the body of `url` for `__fetch_chunks__`, noting in `span` where it came from.
+        """
+        entry = self.cache.lookup(url)
+        cached = self.cache.open_body(url) if entry is not None else None
+        if cached is not None and (self.offline or self.cache.is_fresh(entry)):
+            yield from __read_chunks__(cached, chunk_size)
+            return
+        if self.offline:
+            raise requests.exceptions.ConnectionError(f'{url} is not cached and --offline was given')
+
+        headers = {}
+        if cached is not None:
+            # Ask the server to only send the page if it changed since it was cached.
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            with self.__request__('GET', url, headers=headers, stream=True) as response:
+                # `elapsed` runs until the response headers were parsed, the time to first byte.
+                span.update(source='network', status=response.status_code, ttfb=response.elapsed.total_seconds())
+                if response.status_code == 304 and cached is not None:
+                    # Unchanged, refresh the cache entry and serve the copy on disk.
+                    self.cache.store(url, response)
+                    yield from __read_chunks__(cached, chunk_size)
+                    return
+                response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+                yield from self.cache.store_stream(url, response, response.iter_content(chunk_size),
+                                                   permanent=permanent)
+        finally:
+            if cached is not None:
+                cached.close()
+
+    #############################
+    def __page_hrefs__(self, url, keep=None, window=None):
+        """
+        Returns the link targets of a PPA directory listing.
+
+        The page is fed through `iter_hrefs` chunk by chunk as it arrives, so
+        no DOM is ever built. When `window` is given only the last `window`
+        matching hrefs are retained. If the streaming extractor finds no links
+        at all, or `self.parser` is 'bs4', the page is parsed with
+        BeautifulSoup instead.
+
+        Args:
+            url (str): The URL of the directory listing.
+            keep (callable): Optional predicate selecting the hrefs to return.
+            window (int): Optional number of trailing hrefs to keep.
+
+        Returns:
+            list: The matching hrefs in page order.
+        """
+        if self.parser != 'bs4':
+            # Parsing overlaps the download here, it is the self time of this span.
+            with self.tracer.span('parse', url=url, parser='stream') as span:
+                hrefs = iter_hrefs(self.__fetch_chunks__(url))
+                if keep is not None:
+                    hrefs = filter(keep, hrefs)
+                found = list(deque(hrefs, maxlen=window) if window else hrefs)
+                span['hrefs'] = len(found)
+            if found or keep is None:
+                return found
+            # Nothing matched, make sure that is not down to an unusual page layout.
+        from bs4 import BeautifulSoup
+        body = self.__fetch__(url)
+        with self.tracer.span('parse', url=url, parser='bs4'):
+            # Parse the HTML content with BeautifulSoup ('html.parser' is the built-in Python HTML parser).
+            soup = BeautifulSoup(body, 'html.parser')
+            # Find all '<a>' (anchor) tags and extract their 'href' attributes.
+            hrefs = [link['href'] for link in soup.find_all('a', href=True)]
+        if keep is not None:
+            hrefs = [href for href in hrefs if keep(href)]
+        return hrefs[-window:] if window else hrefs
+
     #############################
     def __get_kernel_status__(self,url):
         """
         Checks the status of a kernel version by trying to access its 'status' file.
 
-        Sends a GET request to the provided URL, which should point to a
-        'status' file for a specific kernel build (e.g., on the Ubuntu kernel PPA,
-        this indicates if a build for amd64 was successful).
+        Sends a HEAD request over the shared session to the provided URL, which
+        should point to a 'status' file for a specific kernel build (e.g., on the
+        Ubuntu kernel PPA, this indicates if a build for an architecture was successful).
+        Only the headers are transferred; servers that reject HEAD are asked for
+        the first byte with a ranged GET instead.
+
+        The status file of a published build never changes, so a successful
+        probe is cached permanently. A missing status file may still appear
+        while a build is in progress and is only cached for the cache TTL.
 
         Args:
             url (str): The URL of the 'status' file to check.
 
         Returns:
-            str: '(Valid)' if the URL returns a 200 status code,
-                 '(Invalid)' if it returns a 404 status code or an exception occurs.
+            str: 'Valid' if the URL returns a 200 status code,
+                 'Invalid' if it returns a 404 status code or an exception occurs,
+                 'Unknown' in offline mode when the status has never been fetched.
         """
+        with self.tracer.span('probe', url=url, source='cache') as span:
+            status = self.__kernel_status_of__(url, span)
+            span['result'] = status
+            return status
+
+    def __kernel_status_of__(self, url, span):
+        """
+        Returns the status of the build at `url` for `__get_kernel_status__`, noting in `span` how it was found.
+        """
+        entry = self.cache.lookup(url)
+        if entry is not None and (self.offline or self.cache.is_fresh(entry)):
+            return 'Valid' if 200 <= entry['status'] < 300 else 'Invalid'
+        if self.offline:
+            return 'Unknown'
         try:
-            # Send a GET request to the kernel status URL.
-            response = requests.get(url, timeout=10)
+            # Send a HEAD request to the kernel status URL, the body is never needed.
+            response = self.__request__('HEAD', url, allow_redirects=True)
+            span.update(source='network', status=response.status_code, ttfb=response.elapsed.total_seconds())
+            if response.status_code in (405, 501):
+                # HEAD not supported, fall back to a one byte ranged GET.
+                response = self.__request__('GET', url, headers={'Range': 'bytes=0-0'}, stream=True)
+                response.close()
             response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
             # If request is successful (e.g. status 200), it's a valid build.
-            return '(Valid)'
+            self.cache.store(url, response, permanent=True)
+            return 'Valid'
         except requests.exceptions.HTTPError as e:
             # Specifically handle 404 Not Found as an 'Invalid' build status.
             if e.response.status_code == 404:
-                return '(Invalid)'
+                self.cache.store(url, e.response)
+                return 'Invalid'
             # For other HTTP errors, print a message and return Invalid.
             print(f"Error: HTTP error occurred while checking status for {url}. Status code: {e.response.status_code}. Details: {e}")
-            return '(Invalid)'
+            return 'Invalid'
         except requests.exceptions.ConnectionError as e:
             print(f"Error: Connection failed while checking status for {url}. Please check your network connection. Details: {e}")
-            return '(Invalid)'
+            return 'Invalid'
         except requests.exceptions.Timeout as e:
             print(f"Error: Request timed out while checking status for {url}. The server might be too slow. Details: {e}")
-            return '(Invalid)'
+            return 'Invalid'
         except requests.exceptions.RequestException as e:
             print(f"Error: An unexpected error occurred while checking status for {url}. Details: {e}")
-            return '(Invalid)'
-    ##############################
-    def __download_files_with_ext__(self,url, extension, output_path):
+            return 'Invalid'
+    #############################
+    def __probe_statuses__(self, names, quiet=False):
+        """
+        Probes the build status of several kernel versions concurrently.
+
+        Status files are requested on a bounded thread pool of `self.workers`
+        threads sharing `self.session`, so connections are kept alive and one
+        slow status file does not hold up the others. Results are yielded in
+        the order of `names` as soon as each one (and all before it) is known, and the
+        total time and per-probe latency are reported on stderr once all
+        probes finish.
+
+        Args:
+            names (list): Kernel versions as named on the PPA (e.g. "6.5.3").
+            quiet (bool): Do not print the timing summary.
+
+        Yields:
+            tuple: (name, status) pairs in the same order as `names`.
+        """
+        start = time.perf_counter()
+        latencies = []
+
+        def probe(name):
+            probe_start = time.perf_counter()
+            status = self.__get_kernel_status__(f'{self.kernel_url}v{name}/{self.arch}/status')
+            latencies.append((time.perf_counter() - probe_start, name))
+            return status
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            futures = [pool.submit(probe, name) for name in names]
+            for name, future in zip(names, futures):
+                yield name, future.result()
+
+        if latencies and not quiet:
+            total = time.perf_counter() - start
+            times = sorted(latencies)
+            average = sum(t for t, _ in times) / len(times)
+            print(f'Probed {len(times)} status file(s) with {min(self.workers, len(times))} worker(s) '
+                  f'in {total:.2f}s (per probe min {times[0][0]*1000:.0f}ms, avg {average*1000:.0f}ms, '
+                  f'max {times[-1][0]*1000:.0f}ms for {times[-1][1]})', file=sys.stderr)
+
+    ##############################
+    def __download_files_with_ext__(self,url, extension, output_path, selection=None):
         """Downloads all files with the given extension from the URL
         and saves them to the output path.
 
+        See `__download_batch__`, which does the work for any number of URLs.
+
         Args:
           url: The URL of the website.
           extension: The extension of the files to download (e.g., ".pdf", ".jpg").
           output_path: The directory where the downloaded files will be saved.
+          selection: Optional `PackageSelection` choosing which files to download.
+
+        Returns:
+          list: The local paths of the files now present (and verified when
+          CHECKSUMS were published), or None if the directory could not be fetched.
         """
+        return self.__download_batch__([url], extension, output_path, selection)[url]
 
-        # Ensure the target directory for downloads exists; create it if not.
-        # exist_ok=True means it won't raise an error if the directory already exists.
-        os.makedirs(output_path, exist_ok=True)
+    def __download_batch__(self, urls, extension, output_path, selection=None):
+        """Downloads all files with the given extension from several directories in one batch.
 
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            # Parse the HTML content of the specific kernel version page.
-            soup = BeautifulSoup(response.content, 'html.parser')
+        With a `selection` only the packages it accepts are downloaded, and
+        the size of the skipped ones is reported as bytes saved.
+
+        The directory listings and CHECKSUMS of all `urls` are fetched
+        concurrently first, then every file goes through a single pool of
+        `self.download_workers` downloads sharing `self.session`. A file
+        listed in more than one directory for the same destination is only
+        downloaded once.
+
+        Files are checked against the SHA-256 sums the PPA publishes in the
+        directory's CHECKSUMS file while they download. Verified files are
+        recorded in a manifest in their output directory (see `VerifiedManifest`), so a
+        directory whose files are all still present and unchanged is skipped
+        without touching the network, and otherwise only the files that are
+        missing or fail verification are fetched again.
 
-            # Find all '<a>' (anchor) tags on the page.
-            links = soup.find_all('a')
+        All transfers share the bandwidth allowed by `self.limiter`, and
+        the effective throughput is reported once they are done.
 
-            # Create a list of full URLs for files that end with the specified extension (e.g., '.deb').
-            # urljoin ensures that relative links (like 'linux-headers-...deb') are correctly combined with the base URL.
-            file_urls = [urljoin(url, link['href']) \
-                        for link in links if link['href'].endswith(extension)]
+        Args:
+          urls: The URLs of the package directories.
+          extension: The extension of the files to download (e.g., ".deb").
+          output_path: The directory where the downloaded files will be saved,
+            or a dict giving the directory for each of `urls`.
+          selection: Optional `PackageSelection` choosing which files to download.
 
-            # Iterate through the list of identified file URLs to download each one.
-            for i, file_url in enumerate(file_urls):
-                # Extract the filename from the URL.
-                filename = file_url.split('/')[-1]
-                # Construct the full local path to save the file.
-                file_path = os.path.join(output_path, filename)
+        Returns:
+          dict: Maps each of `urls` to the local paths of its files now present
+          (and verified when CHECKSUMS were published), or to None if the
+          directory could not be fetched.
+        """
 
-                print(f'Downloading file {i+1}/{len(file_urls)}: {filename} to {output_path}')
+        directories = output_path if isinstance(output_path, dict) else dict.fromkeys(urls, output_path)
+        manifests = {}
+        for directory in set(directories.values()):
+            # Ensure the target directory for downloads exists; create it if not.
+            # exist_ok=True means it won't raise an error if the directory already exists.
+            os.makedirs(directory, exist_ok=True)
+            manifests[directory] = VerifiedManifest(directory)
+        keys = {url: selection.manifest_key(url) if selection is not None else url for url in urls}
+        results = {}
+        # Nothing to do for a directory whose files were all verified and are still intact.
+        for url in dict.fromkeys(urls):
+            verified = manifests[directories[url]].verified(keys[url])
+            if verified is not None:
+                print(f'All {len(verified)} file(s) from {url} are already downloaded and verified.')
+                results[url] = verified
+        pending = [url for url in dict.fromkeys(urls) if url not in results]
+        if not pending:
+            return results
 
-                # Download the file using streaming to handle potentially large files efficiently.
-                # stream=True defers downloading the response body until content is accessed.
+        # List every directory and read its CHECKSUMS concurrently.
+        from concurrent.futures import ThreadPoolExecutor
+        plans = {}
+        with ThreadPoolExecutor(max_workers=max(min(self.workers, len(pending)), 1)) as pool:
+            futures = {url: pool.submit(self.__plan_directory__, url, extension, selection) for url in pending}
+            for url, future in futures.items():
                 try:
-                    response_file = requests.get(file_url, stream=True, timeout=10)
-                    response_file.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                    # Open the local file in write-binary mode.
-                    with open(file_path, 'wb') as f:
-                        # Iterate over the response data in chunks of 1024 bytes.
-                        for chunk in response_file.iter_content(chunk_size=1024):
-                            if chunk:  # Filter out keep-alive new chunks (which are empty).
-                                f.write(chunk) # Write the current chunk to the file.
-                except requests.exceptions.ConnectionError as e_file:
-                    print(f"Error: Connection failed for {file_url} while downloading. Please check your network connection. Details: {e_file}")
-                except requests.exceptions.Timeout as e_file:
-                    print(f"Error: Request timed out for {file_url} while downloading. The server might be too slow. Details: {e_file}")
-                except requests.exceptions.HTTPError as e_file:
-                    print(f"Error: HTTP error occurred for {file_url} while downloading. Status code: {e_file.response.status_code}. Details: {e_file}")
-                except requests.exceptions.RequestException as e_file:
-                    print(f"Error: An unexpected error occurred while downloading {file_url}. Details: {e_file}")
-        except requests.exceptions.ConnectionError as e:
-            print(f"Error: Connection failed for {url} (kernel branch page). Please check your network connection. Details: {e}")
-        except requests.exceptions.Timeout as e:
-            print(f"Error: Request timed out for {url} (kernel branch page). The server might be too slow. Details: {e}")
+                    plans[url] = future.result()
+                except requests.exceptions.ConnectionError as e:
+                    print(f"Error: Connection failed for {url} (kernel branch page). Please check your network connection. Details: {e}")
+                except requests.exceptions.Timeout as e:
+                    print(f"Error: Request timed out for {url} (kernel branch page). The server might be too slow. Details: {e}")
+                except requests.exceptions.HTTPError as e:
+                    # Handle case where the kernel branch URL itself gives an HTTP error (e.g., 404 for a non-existent version)
+                    print(f"Error: HTTP error occurred for {url} (kernel branch page). Status code: {e.response.status_code}. Details: {e}")
+                    print(f'\n****Failed to find kernel branch:  {url}****\n') # Keep original specific error message
+                except requests.exceptions.RequestException as e:
+                    print(f"Error: An unexpected error occurred while fetching {url} (kernel branch page). Details: {e}")
+                if url not in plans:
+                    results[url] = None
+
+        # Download the files concurrently, each one into a '.part' file that is
+        # resumed on failure and only renamed into place once it is complete.
+        # Together they stay within the bandwidth of self.limiter.
+        started = time.perf_counter()
+        throttled = self.limiter.throttled
+        total = sum(len(file_urls) for file_urls, _ in plans.values())
+        downloads = {}
+        present = {}
+        number = 0
+        with ThreadPoolExecutor(max_workers=max(self.download_workers, 1)) as pool:
+            for url, (file_urls, checksums) in plans.items():
+                directory = directories[url]
+                for file_url in file_urls:
+                    number += 1
+                    # Extract the filename from the URL.
+                    filename = file_url.split('/')[-1]
+                    # Construct the full local path to save the file.
+                    file_path = os.path.join(directory, filename)
+                    expected = checksums.get(filename)
+                    if file_path in downloads or file_path in present:
+                        print(f'Skipping file {number}/{total}: {filename} is already part of this batch')
+                        continue
+                    # Keep a file that is already on disk if it matches the published checksum.
+                    if expected and (manifests[directory].is_intact(keys[url], filename, file_path) or \
+                                     (os.path.exists(file_path) and __sha256_file__(file_path) == expected)):
+                        print(f'Skipping file {number}/{total}: {filename} is already verified')
+                        present[file_path] = file_path
+                        continue
+                    print(f'Downloading file {number}/{total}: {filename} to {directory}')
+                    downloads[file_path] = pool.submit(self.__download_file__, file_url, file_path, expected)
+            transfers = []
+            for file_path, future in downloads.items():
+                result = future.result()
+                if result is not None:
+                    transfers.append(result)
+                    present[file_path] = file_path
+
+        # Report the aggregate throughput of everything that was transferred.
+        elapsed = time.perf_counter() - started
+        transferred = sum(size for size, _ in transfers)
+        if transfers:
+            limit = self.limiter.describe()
+            throttling = f', limit {limit}, {self.limiter.throttled - throttled:.1f}s throttled' if limit != 'unlimited' else ''
+            print(f'Downloaded {len(transfers)}/{len(downloads)} file(s), {transferred/1e6:.1f} MB '
+                  f'in {elapsed:.1f}s ({transferred/1e6/max(elapsed, 1e-6):.1f} MB/s aggregate{throttling})')
+        for url, (file_urls, checksums) in plans.items():
+            filenames = [file_url.split('/')[-1] for file_url in file_urls]
+            paths = [os.path.join(directories[url], filename) for filename in filenames]
+            if checksums and all(path in present for path in paths) \
+                    and all(filename in checksums for filename in filenames):
+                # Record the verified set so the next run can skip the network entirely,
+                # unless CHECKSUMS does not cover every file and some were not verified.
+                manifests[directories[url]].record(keys[url], {filename: checksums[filename] for filename in filenames})
+            results[url] = [path for path in paths if path in present]
+        return results
+
+    def __plan_directory__(self, url, extension, selection=None):
+        """
+        Lists the files of one directory for `__download_batch__`.
+
+        Returns:
+            tuple: (URLs of the files to download, published checksums by file name).
+        """
+        # Create a list of full URLs for files that end with the specified extension (e.g., '.deb').
+        # urljoin ensures that relative links (like 'linux-headers-...deb') are correctly combined with the base URL.
+        file_urls = [urljoin(url, href) \
+                    for href in self.__page_hrefs__(url, keep=lambda href: href.endswith(extension))]
+        if selection is not None:
+            # Leave out the flavours (and optionally headers) that are never installed.
+            skipped = [file_url for file_url in file_urls if not selection(file_url.split('/')[-1])]
+            file_urls = [file_url for file_url in file_urls if file_url not in skipped]
+            if skipped:
+                saved = sum(self.__remote_sizes__(skipped))
+                print(f'Skipping {len(skipped)} package(s) from {url} not needed for {selection} ({saved/1e6:.1f} MB saved)')
+        return file_urls, self.__published_checksums__(url)
+
+    ##############################
+    def __remote_sizes__(self, urls):
+        """
+        Returns the Content-Length of each of `urls`, asked for concurrently with HEAD requests.
+
+        Sizes that cannot be determined count as 0.
+        """
+        def size(url):
+            with self.tracer.span('head', url=url) as span:
+                try:
+                    response = self.__request__('HEAD', url, allow_redirects=True)
+                    span.update(status=response.status_code, ttfb=response.elapsed.total_seconds())
+                    return int(response.headers.get('Content-Length', 0)) if response.ok else 0
+                except (requests.exceptions.RequestException, ValueError):
+                    return 0
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            return list(pool.map(size, urls))
+
+    ##############################
+    def __published_checksums__(self, url):
+        """
+        Returns the SHA-256 sums published in the CHECKSUMS file of a PPA directory.
+
+        The CHECKSUMS file of a build never changes, so it is cached
+        permanently. A directory without one yields an empty mapping.
+
+        Args:
+            url (str): The URL of the package directory.
+
+        Returns:
+            dict: Maps file names to lowercase hex SHA-256 digests.
+        """
+        try:
+            checksums = self.__fetch__(url + 'CHECKSUMS', permanent=True).decode('utf-8', 'replace')
         except requests.exceptions.HTTPError as e:
-            # Handle case where the kernel branch URL itself gives an HTTP error (e.g., 404 for a non-existent version)
-            print(f"Error: HTTP error occurred for {url} (kernel branch page). Status code: {e.response.status_code}. Details: {e}")
-            print(f'\n****Failed to find kernel branch:  {url}****\n') # Keep original specific error message
-        except requests.exceptions.RequestException as e:
-            print(f"Error: An unexpected error occurred while fetching {url} (kernel branch page). Details: {e}")
+            if e.response.status_code == 404:
+                return {}
+            raise
+        sums = {}
+        for line in checksums.splitlines():
+            # The file lists SHA-1 and SHA-256 sums as "<digest>  <file>", only the latter are 64 hex digits.
+            fields = line.split()
+            if len(fields) == 2 and SHA256_RE.fullmatch(fields[0]):
+                sums[fields[1].lstrip('*')] = fields[0].lower()
+        return sums
+
+    ##############################
+    def __download_file__(self, file_url, file_path, expected=None):
+        """
+        Downloads a single file into place via a resumable '.part' file.
+
+        The body is streamed into `file_path + '.part'` using a buffer sized
+        from the Content-Length (see `__chunk_size__`), and its SHA-256 is
+        computed chunk by chunk as it is written, so no second pass over the
+        file is needed. If the transfer fails it is retried up to
+        `self.retries` times, resuming from the bytes already on disk with an
+        HTTP Range request. The '.part' file is only renamed to `file_path`
+        (atomically, with os.replace) once the whole body has been received
+        and matches `expected`, so an interrupted run never leaves a
+        truncated or corrupt file under the final name.
+
+        Args:
+            file_url (str): The URL of the file to download.
+            file_path (str): The final local path of the file.
+            expected (str): The published SHA-256 of the file, if known.
+
+        Returns:
+            tuple or None: (bytes transferred, seconds taken) on success,
+            None if the file could not be downloaded.
+        """
+        with self.tracer.span('download', url=file_url, bytes=0, attempts=0) as span:
+            return self.__download_file_into__(file_url, file_path, expected, span)
+
+    def __download_file_into__(self, file_url, file_path, expected, span):
+        """
+        Does the work of `__download_file__`, recording bytes, attempts and TTFB in `span`.
+        """
+        part_path = file_path + '.part'
+        filename = os.path.basename(file_path)
+        transferred = 0
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            span['attempts'] = attempt + 1
+            if attempt:
+                # Back off a little before resuming the transfer.
+                time.sleep(min(2 ** attempt, 30) / 4)
+                __print_line__(f'Retrying {filename} (attempt {attempt + 1}/{self.retries + 1})')
+            # Resume from whatever is already in the '.part' file.
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            try:
+                # This loop does the retrying, each attempt is a single request.
+                with self.__request__('GET', file_url, retries=0, headers=headers, stream=True) as response_file:
+                    span.setdefault('ttfb', response_file.elapsed.total_seconds())
+                    if response_file.status_code == 416 and offset:
+                        # The '.part' file may already hold the whole body, verify it below.
+                        digest = __sha256_file__(part_path)
+                    else:
+                        response_file.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+                        if response_file.status_code != 206:
+                            # The server ignored the Range header, start again from scratch.
+                            offset = 0
+                        # Hash the bytes already on disk once, then every chunk as it is written.
+                        sha256 = __sha256_file__(part_path, digest=False) if offset else hashlib.sha256()
+                        length = int(response_file.headers.get('Content-Length', 0)) or None
+                        with open(part_path, 'ab' if offset else 'wb') as f:
+                            chunk_size = self.limiter.chunk_size(__chunk_size__(length))
+                            for chunk in response_file.iter_content(chunk_size=chunk_size):
+                                if chunk:  # Filter out keep-alive new chunks (which are empty).
+                                    f.write(chunk)
+                                    sha256.update(chunk)
+                                    transferred += len(chunk)
+                                    span['bytes'] = transferred
+                                    # Hold back while the run is over its bandwidth limit.
+                                    span['throttled'] = span.get('throttled', 0) + self.limiter.consume(len(chunk))
+                        if length is not None and os.path.getsize(part_path) != offset + length:
+                            raise requests.exceptions.ChunkedEncodingError(
+                                f'Transfer ended early ({os.path.getsize(part_path) - offset} of {length} bytes)')
+                        digest = sha256.hexdigest()
+                if expected and digest != expected:
+                    # Corrupt data cannot be resumed, throw it away and fetch the file again.
+                    __print_line__(f'Error: Checksum mismatch for {filename} (expected {expected}, got {digest})')
+                    os.unlink(part_path)
+                    continue
+                os.replace(part_path, file_path)
+                elapsed = time.perf_counter() - started
+                __print_line__(f'Downloaded {filename}{" (verified)" if expected else ""}: {transferred/1e6:.1f} MB '
+                               f'in {elapsed:.1f}s ({transferred/1e6/max(elapsed, 1e-6):.1f} MB/s)')
+                return transferred, elapsed
+            except requests.exceptions.ConnectionError as e_file:
+                __print_line__(f"Error: Connection failed for {file_url} while downloading. Please check your network connection. Details: {e_file}")
+            except requests.exceptions.Timeout as e_file:
+                __print_line__(f"Error: Request timed out for {file_url} while downloading. The server might be too slow. Details: {e_file}")
+            except requests.exceptions.HTTPError as e_file:
+                __print_line__(f"Error: HTTP error occurred for {file_url} while downloading. Status code: {e_file.response.status_code}. Details: {e_file}")
+                # A missing file will not appear by retrying.
+                if e_file.response.status_code == 404:
+                    return None
+            except requests.exceptions.RequestException as e_file:
+                __print_line__(f"Error: An unexpected error occurred while downloading {file_url}. Details: {e_file}")
+            except OSError as e_file:
+                __print_line__(f"Error: Could not write {part_path}. Details: {e_file}")
+                return None
+        __print_line__(f'Error: Giving up on {filename} after {self.retries + 1} attempts'
+                       f'{f", partial data kept in {part_path}" if os.path.exists(part_path) else ""}')
+        return None
+
+class PackageSelection:
+    """
+    Chooses which of a build's packages are downloaded.
+
+    A mainline build ships images, modules and headers for several kernel
+    flavours, plus the flavour independent headers. Only the configured
+    flavour's image and modules are selected, and its headers (both the
+    flavoured and the common package) unless `headers` is False. Files
+    whose names are not recognised are always selected.
+
+    Attributes:
+        flavor (str): The kernel flavour, e.g. 'generic' or 'lowlatency'.
+        headers (bool): Whether headers packages are selected.
+    """
+    def __init__(self, flavor='generic', headers=True):
+        self.flavor = flavor
+        self.headers = headers
+
+    def __call__(self, filename):
+        match = PACKAGE_RE.match(filename)
+        if not match:
+            return True
+        kind, flavor = match.group(1), match.group(2)
+        if flavor is None:
+            # The flavour independent headers package.
+            return self.headers
+        return flavor == self.flavor and (self.headers or kind != 'headers')
+
+    def __str__(self):
+        return f'the {self.flavor} flavour{"" if self.headers else " without headers"}'
+
+    def manifest_key(self, url):
+        """
+        Returns the key under which files selected from `url` are recorded as verified.
+        """
+        return f'{url}#{self.flavor}{"" if self.headers else "-noheaders"}'
+
+class VerifiedManifest:
+    """
+    Record of downloaded files whose SHA-256 matched the published CHECKSUMS.
+
+    The manifest is a JSON file in the download directory mapping each
+    package directory URL to the files fetched from it, with their digest,
+    size and modification time. A file whose size and mtime are unchanged
+    since it was verified is trusted without reading it again.
+
+    Attributes:
+        path (Path): The manifest file.
+    """
+    FILENAME = '.kmanager-verified.json'
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.path = self.directory / self.FILENAME
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_intact(self, url, filename, file_path):
+        """
+        Returns True if `file_path` was verified from `url` and has not changed since.
+        """
+        recorded = self.entries.get(url, {}).get(filename)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return recorded is not None and recorded['size'] == stat.st_size and recorded['mtime_ns'] == stat.st_mtime_ns
+
+    def verified(self, url):
+        """
+        Returns the paths of every file verified from `url`, or None unless all are still intact.
+        """
+        files = self.entries.get(url)
+        if not files:
+            return None
+        paths = [str(self.directory / filename) for filename in files]
+        if all(self.is_intact(url, filename, path) for filename, path in zip(files, paths)):
+            return paths
+        return None
+
+    def record(self, url, digests):
+        """
+        Records that the files in `digests` (name to SHA-256) were verified from `url`.
+        """
+        files = {}
+        for filename, digest in digests.items():
+            stat = os.stat(self.directory / filename)
+            files[filename] = {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        self.entries[url] = files
+        try:
+            __write_atomic__(self.path, json.dumps(self.entries, indent=1).encode())
+        except OSError as e:
+            print(f'Warning: Could not update {self.path}. Details: {e}')
+
+class StagingCache:
+    """
+    Size-capped cache of downloaded packages, one directory per version and architecture.
+
+    Packages are staged in `<root>/<version>/<arch>/`, each directory with
+    its own `VerifiedManifest`. An index file in `root` records the size
+    and last use of every directory, and how much was evicted so far. Once
+    the cache holds more than `limit` bytes, the least recently used
+    directories are removed, except the protected ones given to `evict`.
+    Directories without a manifest, left by interrupted downloads or made
+    before manifests were kept, are tracked and evicted like the others.
+    Only directories shaped like the ones the cache creates (see
+    `__owns__`) are ever adopted or removed, and only the packages in them
+    (the files their manifest lists, other .deb files and '.part'
+    leftovers) are deleted, so `root` may be a shared directory such as /var/tmp.
+
+    Attributes:
+        root (Path): The cache directory.
+        limit (int): The size cap in bytes, 0 for none.
+        entries (dict): Maps "<version>/<arch>" to {'size': bytes, 'last_used': Unix time}.
+        evicted (dict): {'count': directories, 'bytes': bytes} evicted so far.
+    """
+    INDEX = 'index.json'
+
+    def __init__(self, root, limit=0):
+        self.root = Path(root)
+        self.limit = limit
+        self.path = self.root / self.INDEX
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data['entries']
+            self.evicted = data['evicted']
+        except (OSError, ValueError, KeyError):
+            self.entries = {}
+            self.evicted = {'count': 0, 'bytes': 0}
+        self.__reconcile__()
+
+    def directory(self, version, arch):
+        """
+        Returns the directory `version` is staged in for `arch`.
+        """
+        return self.root / version / arch
+
+    @property
+    def size(self):
+        """
+        The bytes held by the cache.
+        """
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def versions(self):
+        """
+        Returns the versions staged, for any architecture.
+        """
+        return {key.partition('/')[0] for key in self.entries}
+
+    def touch(self, version, arch):
+        """
+        Records that the directory of `version` was just used, and its current size.
+        """
+        self.entries[f'{version}/{arch}'] = {'size': __tree_size__(self.directory(version, arch)),
+                                             'last_used': time.time()}
+        self.save()
+
+    def evict(self, protected=()):
+        """
+        Removes least recently used directories until the cache fits `limit`.
+
+        Args:
+            protected (set): Versions never evicted.
+
+        Returns:
+            list: The "<version>/<arch>" keys evicted.
+        """
+        removed = []
+        size = self.size
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_used']):
+            if not self.limit or size <= self.limit:
+                break
+            if key.partition('/')[0] in protected or not self.__owns__(self.root / key):
+                continue
+            freed = self.__remove__(self.root / key)
+            size -= entry['size']
+            self.evicted['count'] += 1
+            self.evicted['bytes'] += freed
+            removed.append(key)
+        for key in removed:
+            del self.entries[key]
+        if removed:
+            self.save()
+        return removed
+
+    def save(self):
+        """
+        Writes the index file.
+        """
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            __write_atomic__(self.path, json.dumps({'entries': self.entries, 'evicted': self.evicted}, indent=1).encode())
+        except OSError as e:
+            print(f'Warning: Could not update {self.path}. Details: {e}')
+
+    def verified(self, key):
+        """
+        Returns True if the directory of "<version>/<arch>" `key` holds a `VerifiedManifest`.
+        """
+        return (self.root / key / VerifiedManifest.FILENAME).is_file()
+
+    def __owns__(self, path):
+        """
+        Returns True if `path` is a directory the cache stages packages in.
+
+        That is `<root>/<version>/<arch>` for a kernel version and a known
+        Debian architecture, holding a `VerifiedManifest` or, for a download
+        that was interrupted or made before manifests were kept, packages.
+        """
+        return (path.parent.parent == self.root and VERSION_NAME_RE.fullmatch(path.parent.name) is not None
+                and path.name in DEBIAN_ARCHES.values()
+                and ((path / VerifiedManifest.FILENAME).is_file() or bool(self.__packages__(path))))
+
+    @staticmethod
+    def __packages__(path):
+        """
+        Returns the names of the .deb files in `path`, complete or still '.part'.
+        """
+        try:
+            return [entry.name for entry in os.scandir(path)
+                    if entry.name.endswith(('.deb', '.deb.part')) and entry.is_file()]
+        except OSError:
+            return []
+
+    def __remove__(self, path):
+        """
+        Deletes the packages staged in `path` and returns the bytes freed.
+
+        Only the files its manifest lists (with any '.part' leftovers), any
+        other .deb files and the manifest itself are deleted; the directory,
+        and its version directory, are removed only once nothing else is left in them.
+        """
+        manifest = VerifiedManifest(path)
+        before = __tree_size__(path)
+        names = {filename for files in manifest.entries.values() for filename in files}
+        names.update(self.__packages__(path))
+        for name in [*names, *(f'{name}.part' for name in names), VerifiedManifest.FILENAME]:
+            try:
+                (path / name).unlink()
+            except OSError:
+                pass
+        for directory in (path, path.parent):
+            try:
+                directory.rmdir()
+            except OSError:
+                break
+        return before - __tree_size__(path)
+
+    def __reconcile__(self):
+        """
+        Brings the index in line with the directories actually present.
+
+        Directories removed behind the cache's back, or no longer holding
+        packages, are forgotten, and unknown ones that `__owns__` are adopted
+        as last used when they were last modified, with or without a manifest.
+        """
+        present = {f'{path.parent.name}/{path.name}': path for path in self.root.glob('*/*')
+                   if path.is_dir() and self.__owns__(path)}
+        changed = False
+        for key in [key for key in self.entries if key not in present]:
+            del self.entries[key]
+            changed = True
+        for key, path in present.items():
+            if key not in self.entries:
+                self.entries[key] = {'size': __tree_size__(path), 'last_used': path.stat().st_mtime}
+                changed = True
+        if changed:
+            self.save()
+
+class InstalledPackage:
+    """
+    A package recorded in the dpkg status database.
+
+    Attributes:
+        name (str): The package name.
+        version (str): The package version.
+        state (str): The dpkg state, e.g. 'installed' or 'config-files'.
+        size (int): The installed size in bytes (0 once only configuration files are left).
+        depends (str): The raw Depends field.
+        provides (str): The raw Provides field.
+    """
+    __slots__ = ('name', 'version', 'state', 'size', 'depends', 'provides')
+
+    def __init__(self, name, version, state, size, depends='', provides=''):
+        self.name = name
+        self.version = version
+        self.state = state
+        self.size = size
+        self.depends = depends
+        self.provides = provides
+
+    def __repr__(self):
+        return f'InstalledPackage({self.name!r}, {self.version!r}, {self.state!r})'
+
+def parse_dpkg_status(path='/var/lib/dpkg/status'):
+    """
+    Parses the dpkg status database in one pass.
+
+    Only packages that are installed, or removed but with configuration
+    files left behind, are returned.
+
+    Args:
+        path (str): The status file to read.
+
+    Returns:
+        list: `InstalledPackage` records.
+    """
+    packages = []
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for paragraph in f.read().split('\n\n'):
+            fields = __control_fields__(paragraph)
+            state = fields.get('Status', '').rpartition(' ')[2]
+            if 'Package' not in fields or state not in ('installed', 'config-files'):
+                continue
+            # Packages already removed only have their configuration files left, which take no space.
+            size = int(fields.get('Installed-Size', '0') or 0) * 1024 if state == 'installed' else 0
+            packages.append(InstalledPackage(fields['Package'], fields.get('Version', ''), state, size,
+                                             fields.get('Depends', ''), fields.get('Provides', '')))
+    return packages
+
+def __control_fields__(paragraph):
+    """
+    Returns the fields of a Debian control paragraph as a dict.
+    """
+    fields = {}
+    for line in paragraph.splitlines():
+        # Continuation lines (descriptions, conffiles) start with whitespace and are not needed.
+        if line and not line[0].isspace():
+            key, _, value = line.partition(':')
+            fields[key] = value.strip()
+    return fields
+
+def installed_kernels(path='/var/lib/dpkg/status', packages=None):
+    """
+    Groups the installed kernel packages by kernel version.
+
+    Args:
+        path (str): The dpkg status file to read.
+        packages (list): Packages already read with `parse_dpkg_status`, used instead of `path`.
+
+    Returns:
+        dict: Maps kernel ABI versions (e.g. "6.12.0-061200rc1") to lists of `InstalledPackage`.
+    """
+    kernels = {}
+    for package in parse_dpkg_status(path) if packages is None else packages:
+        match = KERNEL_PACKAGE_RE.fullmatch(package.name)
+        if match:
+            kernels.setdefault(match.group(1), []).append(package)
+    return kernels
+
+def required_kernels(packages):
+    """
+    Finds the kernel versions that installed packages other than kernels depend on.
+
+    Metapackages such as linux-image-generic depend on the packages of one
+    distribution kernel, which dpkg refuses to purge while they are installed.
+
+    Args:
+        packages (list): The installed packages (see `parse_dpkg_status`).
+
+    Returns:
+        dict: Maps kernel ABI versions to the names of the packages depending on them.
+    """
+    required = {}
+    for package in packages:
+        if package.state != 'installed' or KERNEL_PACKAGE_RE.fullmatch(package.name):
+            continue
+        for name, _, _ in DEPENDENCY_RE.findall(package.depends):
+            match = KERNEL_PACKAGE_RE.fullmatch(name)
+            if match:
+                required.setdefault(match.group(1), []).append(package.name)
+    return required
+
+def __kernel_sort_key__(abi):
+    """
+    Orders kernel ABI versions such as "6.12.0-061200rc1" or "6.8.0-45" oldest first.
+    """
+    number = abi.rpartition('-')[2]
+    digits = re.match(r"\d+", number)
+    return (version_key(abi) or (0,), int(digits.group(0)) if digits else 0)
+
+def read_deb_control(read):
+    """
+    Reads the control file of a .deb without reading the rest of the package.
+
+    A .deb is an ar archive holding 'debian-binary', then 'control.tar*'
+    and finally the (large) 'data.tar*'. Only the ar headers and the
+    control member are read, through `read`, which may be backed by HTTP
+    Range requests: the first call asks for `PREFLIGHT_BYTES`, which
+    usually covers the whole control member, and a second one fetches the
+    rest of it when it is larger.
+
+    Args:
+        read (callable): read(offset, length) returning up to `length` bytes of the package from `offset`.
+
+    Returns:
+        dict: The control fields, e.g. 'Package', 'Version', 'Installed-Size' and 'Depends'.
+
+    Raises:
+        ValueError: If the data is not a Debian package or its control member cannot be read.
+    """
+    data = bytearray()
+    def need(end):
+        # Read up to `end` bytes from the start, in as few requests as possible.
+        if end > len(data):
+            data.extend(read(len(data), max(end, PREFLIGHT_BYTES) - len(data)))
+        if end > len(data):
+            raise ValueError('the package is truncated')
+
+    need(8)
+    if bytes(data[:8]) != b'!<arch>\n':
+        raise ValueError('not a Debian package')
+    offset = 8
+    # The control member is the second one, but tolerate extra members before it.
+    for _ in range(4):
+        need(offset + 60)
+        header = bytes(data[offset:offset + 60])
+        name = header[:16].decode('ascii', 'replace').strip().rstrip('/')
+        try:
+            size = int(header[48:58])
+        except ValueError:
+            raise ValueError(f'corrupt ar header at offset {offset}') from None
+        if name.startswith('control.tar'):
+            need(offset + 60 + size)
+            member = __decompress__(name, bytes(data[offset + 60:offset + 60 + size]))
+            import io
+            import tarfile
+            try:
+                with tarfile.open(fileobj=io.BytesIO(member)) as tar:
+                    control = tar.extractfile(next(info for info in tar if info.name.lstrip('./') == 'control'))
+                    return __control_fields__(control.read().decode('utf-8', 'replace'))
+            except (tarfile.TarError, StopIteration) as e:
+                raise ValueError(f'no control file in {name}') from e
+        # ar members are aligned to even offsets.
+        offset += 60 + size + (size & 1)
+    raise ValueError('no control member found')
+
+def __decompress__(name, data):
+    """
+    Decompresses a 'control.tar' member according to the extension of its `name`.
+    """
+    extension = name.rpartition('.')[2]
+    if extension == 'gz':
+        import gzip
+        return gzip.decompress(data)
+    if extension == 'xz':
+        import lzma
+        return lzma.decompress(data)
+    if extension == 'zst':
+        # The standard library only has zstd from Python 3.14 on; otherwise use the zstd tool.
+        try:
+            from compression import zstd
+            return zstd.decompress(data)
+        except ImportError:
+            try:
+                return subprocess.run(['zstd', '-dcq'], input=data, stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL, check=True).stdout
+            except (OSError, subprocess.CalledProcessError) as e:
+                raise ValueError(f'cannot decompress {name} (zstd is not available)') from e
+    if extension == 'tar':
+        return data
+    raise ValueError(f'unknown compression of {name}')
+
+def compare_debian_versions(a, b):
+    """
+    Compares two Debian package versions the way dpkg does.
+
+    Returns:
+        int: A negative number if `a` is older than `b`, 0 if they are equal, a positive number if it is newer.
+    """
+    def split(version):
+        epoch, _, rest = version.partition(':') if ':' in version else ('0', '', version)
+        upstream, _, revision = rest.rpartition('-') if '-' in rest else (rest, '', '')
+        return int(epoch or 0), upstream, revision
+
+    def order(char):
+        # '~' sorts before everything, even the end of the string, and letters before other characters.
+        if char == '~':
+            return -1
+        return ord(char) if char.isalpha() else ord(char) + 256
+
+    def compare(x, y):
+        x_parts, y_parts = re.findall(r"(\D*)(\d*)", x), re.findall(r"(\D*)(\d*)", y)
+        for index in range(max(len(x_parts), len(y_parts))):
+            x_text, x_number = x_parts[index] if index < len(x_parts) else ('', '')
+            y_text, y_number = y_parts[index] if index < len(y_parts) else ('', '')
+            for position in range(max(len(x_text), len(y_text))):
+                x_order = order(x_text[position]) if position < len(x_text) else 0
+                y_order = order(y_text[position]) if position < len(y_text) else 0
+                if x_order != y_order:
+                    return x_order - y_order
+            if int(x_number or 0) != int(y_number or 0):
+                return int(x_number or 0) - int(y_number or 0)
+        return 0
+
+    a_epoch, a_upstream, a_revision = split(a)
+    b_epoch, b_upstream, b_revision = split(b)
+    return (a_epoch - b_epoch) or compare(a_upstream, b_upstream) or compare(a_revision, b_revision)
+
+def unmet_dependencies(controls, installed):
+    """
+    Finds the dependencies of a set of packages that would not be satisfied.
+
+    A relation is met by an installed package, by a package it provides,
+    or by one of the packages in `controls` themselves (as they are
+    installed together). Alternatives separated by '|' need only one match.
+
+    Args:
+        controls (list): The control fields of the packages to install (see `read_deb_control`).
+        installed (list): The installed packages (see `parse_dpkg_status`).
+
+    Returns:
+        list: (package, unmet relation, versions available) tuples.
+    """
+    available = {}
+    for package in installed:
+        if package.state != 'installed':
+            continue
+        available.setdefault(package.name, []).append(package.version)
+        for name, _, version in DEPENDENCY_RE.findall(package.provides):
+            available.setdefault(name, []).append(version or None)
+    for control in controls:
+        available.setdefault(control.get('Package', ''), []).append(control.get('Version', ''))
+
+    def satisfied(name, operator, version):
+        for candidate in available.get(name, ()):
+            if not operator:
+                return True
+            # A Provides without a version does not satisfy a versioned dependency.
+            if candidate is None:
+                continue
+            result = compare_debian_versions(candidate, version)
+            if {'<<': result < 0, '<=': result <= 0, '<': result <= 0, '=': result == 0,
+                    '>=': result >= 0, '>': result >= 0, '>>': result > 0}[operator]:
+                return True
+        return False
+
+    unmet = []
+    for control in controls:
+        for relation in filter(None, (relation.strip() for relation in control.get('Depends', '').split(','))):
+            alternatives = [DEPENDENCY_RE.match(alternative.strip()) for alternative in relation.split('|')]
+            if not any(match and satisfied(*match.groups()) for match in alternatives):
+                names = [match.group(1) for match in alternatives if match]
+                found = ', '.join(f'{name} {version}' for name in names for version in available.get(name, ()) if version)
+                unmet.append((control.get('Package', '?'), relation, found))
+    return unmet
+
+class MirrorSet:
+    """
+    Base URLs serving the same PPA tree, ranked by latency.
+
+    With more than one mirror each is scored by a HEAD request for its
+    base URL on first use; the scores are cached in a JSON file for `TTL`
+    seconds, then kept up to date from the latency of real requests. A
+    mirror that fails is skipped for `DOWN_FOR` seconds, so an unreachable
+    one only costs a connect timeout once rather than on every request. A
+    single mirror is never skipped, and when every mirror is down the one
+    that failed longest ago is tried anyway, so a transient error never
+    fails the requests that follow without sending them.
+
+    Attributes:
+        urls (list): The base URLs in configured order, which breaks ties.
+        path (Path): The score cache file.
+    """
+    TTL = 3600 # Seconds a latency probe is trusted
+    DOWN_FOR = 30 # Seconds an unreachable mirror is skipped
+    PROBE_TIMEOUT = 2 # Seconds a latency probe may take
+
+    def __init__(self, urls, path):
+        self.urls = list(urls)
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.scores = {} # Latency in seconds, a moving average
+        self.down = {} # Monotonic time until which a mirror is skipped
+        self.samples = deque(maxlen=200) # Recent latencies of every mirror, for hedging
+        self.probed = len(self.urls) < 2 # A single mirror has nothing to be ranked against
+
+    def ranked(self, session):
+        """
+        Returns the healthy mirrors, fastest first, scoring them first if needed.
+
+        Never empty: when every mirror is down, they are all returned, the
+        least recently failed first.
+        """
+        if not self.probed:
+            self.__probe__(session)
+        now = time.monotonic()
+        with self.lock:
+            healthy = [url for url in self.urls if self.down.get(url, 0) <= now]
+            if not healthy:
+                return sorted(self.urls, key=lambda url: self.down.get(url, 0))
+            return sorted(healthy, key=lambda url: self.scores.get(url, float('inf')))
+
+    def record(self, url, seconds):
+        """
+        Records that `url` answered after `seconds`.
+        """
+        with self.lock:
+            previous = self.scores.get(url)
+            self.scores[url] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+            self.samples.append(seconds)
+            self.down.pop(url, None)
+
+    def fail(self, url):
+        """
+        Records that `url` failed, so it is skipped for `DOWN_FOR` seconds.
+
+        The only mirror is never marked down, there is nothing to skip to.
+        """
+        if len(self.urls) < 2:
+            return
+        with self.lock:
+            self.down[url] = time.monotonic() + self.DOWN_FOR
+
+    def hedge_after(self, percentile):
+        """
+        Returns the `percentile` latency of recent requests, or None until there are enough of them.
+        """
+        with self.lock:
+            if len(self.samples) < 10:
+                return None
+            samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, len(samples) * percentile // 100)]
+
+    def __probe__(self, session):
+        """
+        Loads the cached scores, or measures every mirror concurrently if they are stale.
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        fresh = {url: entry for url, entry in cached.items() if time.time() - entry['probed'] < self.TTL}
+        if all(url in fresh for url in self.urls):
+            with self.lock:
+                for url in self.urls:
+                    if fresh[url]['latency'] is not None:
+                        self.scores[url] = fresh[url]['latency']
+                self.probed = True
+            return
+
+        def probe(url):
+            try:
+                response = session.head(url, timeout=self.PROBE_TIMEOUT, allow_redirects=True)
+                return response.elapsed.total_seconds() if response.ok else None
+            except requests.exceptions.RequestException:
+                return None
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(self.urls)) as pool:
+            latencies = dict(zip(self.urls, pool.map(probe, self.urls)))
+        with self.lock:
+            for url, latency in latencies.items():
+                if latency is None:
+                    self.down[url] = time.monotonic() + self.DOWN_FOR
+                else:
+                    self.scores[url] = latency
+            self.probed = True
+        cached.update({url: {'latency': latency, 'probed': time.time()} for url, latency in latencies.items()})
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            __write_atomic__(self.path, json.dumps(cached, indent=1).encode())
+        except OSError as e:
+            print(f'Warning: Could not update {self.path}. Details: {e}')
+
+class LocalInventory:
+    """
+    The mainline kernels present on this machine.
+
+    Built in one pass over the dpkg status database, /boot (vmlinuz-*) and
+    /lib/modules, so that a kernel installed without dpkg is found too.
+    The result is cached in a JSON file together with the modification
+    times of those three sources, and only rebuilt when one of them changed.
+
+    Attributes:
+        path (Path): The cache file.
+        kernels (dict): Maps kernel ABI versions (e.g. "6.12.0-061200rc1") to
+            where they were found ('dpkg', 'boot', 'modules').
+    """
+    def __init__(self, path, dpkg_status='/var/lib/dpkg/status', boot='/boot', modules='/lib/modules'):
+        self.path = Path(path)
+        self.dpkg_status = dpkg_status
+        self.boot = Path(boot)
+        self.modules = Path(modules)
+        stamp = self.__stamp__()
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        if cached.get('stamp') == stamp:
+            self.kernels = cached['kernels']
+        else:
+            self.kernels = self.__scan__()
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                __write_atomic__(self.path, json.dumps({'stamp': stamp, 'kernels': self.kernels}).encode())
+            except OSError as e:
+                print(f'Warning: Could not update {self.path}. Details: {e}')
+        # Only mainline builds, whose ABI number is the package fragment ("6.12.0-061200rc1"),
+        # can match PPA versions; a distribution kernel such as "6.8.0-45" cannot.
+        self.keys = {version_key(abi) for abi in self.kernels
+                     if abi.partition('-')[2] == package_fragment(abi)}
+
+    def installed(self, version):
+        """
+        Returns True if the PPA `version` (e.g. "6.12-rc1") is installed.
+        """
+        return version_key(version) in self.keys
+
+    def __stamp__(self):
+        """
+        Returns the modification times of the sources, None for those missing.
+        """
+        stamp = []
+        for source in (self.dpkg_status, self.boot, self.modules):
+            try:
+                stamp.append(os.stat(source).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+    def __scan__(self):
+        """
+        Reads the sources and returns the kernels found, see `kernels`.
+        """
+        kernels = {}
+        try:
+            for abi, packages in installed_kernels(self.dpkg_status).items():
+                if any(package.state == 'installed' for package in packages):
+                    kernels.setdefault(abi, []).append('dpkg')
+        except OSError:
+            pass
+        for where, names in (('boot', (path.name[len('vmlinuz-'):] for path in self.boot.glob('vmlinuz-*'))),
+                             ('modules', (path.name for path in self.modules.glob('*')))):
+            for name in names:
+                match = KERNEL_ABI_RE.match(name)
+                if match and where not in kernels.setdefault(match.group(0), []):
+                    kernels[match.group(0)].append(where)
+        return kernels
+
+class Release:
+    """
+    A kernel build published on the PPA, as returned by `Kops.releases`.
+
+    Attributes:
+        version (str): The version as named on the PPA (e.g. "6.12-rc1").
+        arch (str): The Debian architecture of the build (e.g. "amd64").
+        status (str): 'Valid', 'Invalid' or 'Unknown'.
+        url (str): The URL of the build's package directory.
+        status_url (str): The URL of the build's status file.
+        running (bool): True if this is the running kernel.
+        state (str): 'Installed', 'Staged' (verified packages downloaded) or 'Available'.
+    """
+    __slots__ = ('version', 'arch', 'status', 'url', 'status_url', 'running', 'state')
+
+    def __init__(self, version, arch, status, url, status_url, running=False, state='Available'):
+        self.version = version
+        self.arch = arch
+        self.status = status
+        self.url = url
+        self.status_url = status_url
+        self.running = running
+        self.state = state
+
+    @property
+    def valid(self):
+        """
+        True if the build succeeded and its packages can be downloaded.
+        """
+        return self.status == 'Valid'
+
+    def __repr__(self):
+        return f'Release({self.version!r}, {self.arch!r}, {self.status!r})'
+
+def format_release(release):
+    """
+    Renders a `Release` as one line of `kmanager -l` output.
+    """
+    return release_line(release.version, release.status, release.running, release.state)
+
+class KernelIndex:
+    """
+    Sorted, persistent index of the kernel versions published on the PPA.
+
+    Versions are kept in version order (see `version_key`) rather than in
+    the order the PPA page happens to list them, together with separate
+    sorted views of the stable releases and release candidates. The version
+    names are stored as a compact JSON list and new versions are merged in
+    incrementally, so a refresh only pays for entries not seen before.
+
+    Attributes:
+        path (Path): The JSON file the index is stored in.
+        url (str): The base URL the versions were published at.
+        keys (list): Sorted version keys.
+        names (list): Version names (e.g. "6.12-rc1") matching `keys`.
+        complete (bool): Whether every version on the PPA is indexed, not just the most recent ones.
+        since (str): When not complete, the oldest of the newest versions indexed without a gap
+            (the start of the tails fetched so far, see `merge_tail`), or None.
+        checked (float): When the index was last compared with the PPA, as a Unix time.
+        etag (str): The ETag of the index page the newest versions were last fetched from, or None.
+    """
+    def __init__(self, path, url):
+        self.path = Path(path)
+        self.url = url
+        self.keys = []
+        self.names = []
+        self._stable = []    # Sorted keys of stable releases
+        self._candidate = [] # Sorted keys of release candidates
+        self._known = set()
+        self.complete = False
+        self.since = None
+        self.checked = 0
+        self.etag = None
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get('url') == url:
+                self.merge(stored.get('names', []), save=False)
+                # Indexes saved before tails were fetched were built from the whole page.
+                self.complete = stored.get('complete', bool(self.names))
+                self.since = stored.get('since')
+                self.checked = stored.get('checked', 0)
+                self.etag = stored.get('etag')
+        except (OSError, ValueError):
+            pass
+
+    def merge(self, names, save=True, complete=False, checked=False):
+        """
+        Adds any versions in `names` that are not in the index yet.
+
+        Names that do not look like a kernel version are ignored. The index
+        file is only rewritten when something changed.
+
+        Args:
+            names (iterable): Version names as published on the PPA.
+            save (bool): Whether to persist the index after merging.
+            complete (bool): Whether `names` is every version on the PPA, which makes the index complete.
+            checked (bool): Whether `names` was just fetched from the PPA, see `checked`.
+
+        Returns:
+            int: The number of versions added.
+        """
+        new = [(key, name) for name in dict.fromkeys(names) if name not in self._known
+               for key in (version_key(name),) if key is not None]
+        changed = (complete and not self.complete) or checked
+        self.complete = self.complete or complete
+        if complete:
+            self.since = None
+        if checked:
+            self.checked = time.time()
+        if not new:
+            if save and changed:
+                self.save()
+            return 0
+        if len(new) > 1:
+            # Large merges (e.g. the very first one) are cheaper as a single sort.
+            merged = sorted(list(zip(self.keys, self.names)) + new)
+            self.keys = [key for key, _ in merged]
+            self.names = [name for _, name in merged]
+            self._stable = [key for key in self.keys if key[4]]
+            self._candidate = [key for key in self.keys if not key[4]]
+        else:
+            key, name = new[0]
+            position = bisect_left(self.keys, key)
+            self.keys.insert(position, key)
+            self.names.insert(position, name)
+            insort(self._stable if key[4] else self._candidate, key)
+        self._known.update(name for _, name in new)
+        if save:
+            self.save()
+        return len(new)
+
+    def save(self):
+        """
+        Writes the index to disk. Failing to do so only costs a rescan next time.
+        """
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            __write_atomic__(self.path, json.dumps({'url': self.url, 'names': self.names, 'complete': self.complete,
+                                                    'since': self.since, 'checked': self.checked, 'etag': self.etag},
+                                                   separators=(',', ':')).encode())
+        except OSError:
+            pass
+
+    def merge_tail(self, names):
+        """
+        Merges `names`, the newest versions on the PPA fetched without the older ones.
+
+        If they reach back into the versions already indexed without a gap
+        (see `joins`) they extend them, and a complete index stays complete;
+        otherwise they start a new gap-free run and `since` moves to them.
+
+        Args:
+            names (list): Version names in page order, oldest first.
+        """
+        if not self.joins(names):
+            self.complete = False
+            self.since = names[0] if names else None
+        self.merge(names, checked=True)
+
+    def joins(self, names):
+        """
+        Returns True if tail `names` starts at a version indexed without a gap up to the newest.
+        """
+        if not names or names[0] not in self:
+            return False
+        return self.complete or (self.since is not None and version_key(names[0]) >= version_key(self.since))
+
+    def known_recent(self):
+        """
+        Returns how many of the newest versions are indexed without a gap.
+        """
+        if self.complete:
+            return len(self.keys)
+        if self.since is None:
+            return 0
+        return len(self.keys) - bisect_left(self.keys, version_key(self.since))
+
+    def covered(self, names):
+        """
+        Returns how many of the newest versions would be indexed without a gap once tail `names` is merged.
+        """
+        if not self.joins(names):
+            return len(names)
+        start = 0 if self.complete else bisect_left(self.keys, version_key(self.since))
+        return len(set(self.names[start:]).union(names))
+
+    def recent(self, count):
+        """
+        Returns the `count` newest versions, oldest first.
+        """
+        return self.names[-count:] if count > 0 else []
+
+    def latest(self):
+        """
+        Returns the newest version, or None if the index is empty.
+        """
+        return self.names[-1] if self.names else None
+
+    def latest_rc(self):
+        """
+        Returns the newest release candidate, or None if there is none.
+        """
+        return self.__name_of__(self._candidate[-1]) if self._candidate else None
+
+    def latest_stable(self):
+        """
+        Returns the newest stable release, or None if there is none.
+        """
+        return self.__name_of__(self._stable[-1]) if self._stable else None
+
+    def select(self, expression):
+        """
+        Returns the versions matching a query expression, oldest first.
+
+        Accepted expressions are 'latest', 'latest-rc' and 'latest-stable',
+        shell style patterns such as "6.12.*" or "6.1?-rc*", and ranges made
+        of comma separated comparisons such as ">=6.10,<6.12" (using version
+        order, so "<6.12" includes the 6.12 release candidates). Ranges are
+        resolved with a binary search on the sorted index.
+
+        Args:
+            expression (str): The expression.
+
+        Returns:
+            list: The matching version names.
+
+        Raises:
+            ValueError: If a range clause is not a comparison with a version.
+        """
+        expression = expression.strip()
+        aliases = {'latest': self.latest, 'latest-rc': self.latest_rc, 'latest-stable': self.latest_stable}
+        if expression in aliases:
+            name = aliases[expression]()
+            return [name] if name else []
+        if any(char in expression for char in '*?['):
+            pattern = expression[1:] if expression.startswith('v') else expression
+            return [name for name in self.names if fnmatchcase(name, pattern)]
+        low, high = 0, len(self.keys)
+        excluded = set()
+        for clause in expression.split(','):
+            match = VERSION_CLAUSE_RE.fullmatch(clause.strip())
+            key = version_key(match.group(2)) if match else None
+            if key is None:
+                raise ValueError(f'Invalid version expression: {expression!r}')
+            operator = match.group(1)
+            if operator in ('>=', '=='):
+                low = max(low, bisect_left(self.keys, key))
+            if operator in ('<=', '=='):
+                high = min(high, bisect_right(self.keys, key))
+            if operator == '>':
+                low = max(low, bisect_right(self.keys, key))
+            elif operator == '<':
+                high = min(high, bisect_left(self.keys, key))
+            elif operator == '!=':
+                excluded.add(key)
+        return [name for key, name in zip(self.keys[low:high], self.names[low:high]) if key not in excluded]
+
+    def __contains__(self, name):
+        key = version_key(name)
+        if key is None:
+            return False
+        position = bisect_left(self.keys, key)
+        return position < len(self.keys) and self.keys[position] == key
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __name_of__(self, key):
+        return self.names[bisect_left(self.keys, key)]
+
+def version_key(version_string):
+    """
+    Parses a kernel version into a key that sorts in release order.
+
+    Accepts PPA directory names ("6.12-rc1", "v6.11.5/", "2.6.39.4") as well
+    as running kernel releases ("6.14.0-061400rc3-generic"). A release
+    candidate sorts before the final release, which sorts before its point
+    releases: 6.12-rc1 < 6.12-rc7 < 6.12 < 6.12.1. Anything after the
+    version itself, such as a "-generic" flavour, is ignored.
+
+    Args:
+        version_string (str): The version to parse.
+
+    Returns:
+        tuple or None: (major, minor, patch, build, is_final, rc) or None if
+        the string is not a kernel version.
+    """
+    match = VERSION_KEY_RE.match(version_string)
+    if not match:
+        return None
+    major, minor, patch, build, rc = match.groups()
+    return (int(major), int(minor), int(patch or 0), int(build or 0),
+            0 if rc else 1, int(rc or 0))
+
+def package_fragment(version_string):
+    """
+    Returns the version fragment used in the PPA's package file names.
+
+    For example "6.12-rc1" gives "061200rc1" and "6.11.5" gives "061105",
+    as found in "linux-image-unsigned-6.11.5-061105-generic_..._amd64.deb".
+
+    Args:
+        version_string (str): A kernel version (see `version_key`).
+
+    Returns:
+        str or None: The fragment, or None if the version cannot be parsed.
+    """
+    key = version_key(version_string)
+    if key is None:
+        return None
+    major, minor, patch, _, final, rc = key
+    return f"{major:02d}{minor:02d}{patch:02d}" + ('' if final else f"rc{rc}")
+
+class HttpCache:
+    """
+    On-disk cache of HTTP responses keyed by URL.
+
+    Every entry is a small JSON metadata file (status code, ETag,
+    Last-Modified, time fetched) plus, for GET responses, a file holding the
+    body. Entries are fresh for `ttl` seconds, after which they have to be
+    revalidated with the server. Permanent entries never expire.
+
+    Attributes:
+        directory (Path): Where the cache files live.
+        ttl (int): Number of seconds an entry is used without revalidation.
+    """
+    def __init__(self, directory, ttl=300):
+        self.directory = Path(directory)
+        self.ttl = ttl
+
+    def __paths__(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.directory / f'{key}.json', self.directory / f'{key}.body'
+
+    def lookup(self, url):
+        """
+        Returns the metadata stored for `url`, or None if it is not cached.
+        """
+        meta_path, _ = self.__paths__(url)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry):
+        """
+        Returns True if `entry` can be used without asking the server.
+        """
+        return entry.get('permanent', False) or time.time() - entry.get('fetched', 0) < self.ttl
+
+    def open_body(self, url):
+        """
+        Returns the cached body of `url` opened for reading, or None if no body is stored.
+        """
+        _, body_path = self.__paths__(url)
+        try:
+            return open(body_path, 'rb')
+        except OSError:
+            return None
+
+    def store(self, url, response, body=None, permanent=False):
+        """
+        Records `response` (and optionally its body) as the cached copy of `url`.
+
+        The cache is best effort: if it cannot be written the request simply
+        is not cached. Without a body only the metadata is updated.
+        """
+        from email.utils import formatdate
+        meta_path, body_path = self.__paths__(url)
+        # A 304 may omit validators, keep the ones the cached copy was stored with.
+        previous = (self.lookup(url) or {}) if response.status_code == 304 else {}
+        entry = {
+            'url': url,
+            'status': 200 if response.status_code == 304 else response.status_code,
+            'etag': response.headers.get('ETag') or previous.get('etag'),
+            'last_modified': response.headers.get('Last-Modified') or previous.get('last_modified') \
+                or formatdate(usegmt=True),
+            'fetched': time.time(),
+            'permanent': permanent,
+        }
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if body is not None:
+                __write_atomic__(body_path, body)
+            __write_atomic__(meta_path, json.dumps(entry).encode())
+        except OSError:
+            pass
+
+    def store_stream(self, url, response, chunks, permanent=False):
+        """
+        Passes `chunks` through while writing them to the cache as the body of `url`.
+
+        The entry is only recorded once every chunk has been consumed, so an
+        abandoned or failed transfer never replaces a good cached copy.
+
+        Yields:
+            bytes: The chunks of `chunks`, unchanged.
+        """
+        _, body_path = self.__paths__(url)
+        tmp_path = f'{body_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            f = open(tmp_path, 'wb')
+        except OSError:
+            f = None
+        try:
+            for chunk in chunks:
+                if f is not None:
+                    try:
+                        f.write(chunk)
+                    except OSError:
+                        f.close()
+                        f = None
+                yield chunk
+            if f is not None:
+                f.close()
+                os.replace(tmp_path, body_path)
+                self.store(url, response, permanent=permanent)
+        finally:
+            if f is not None and not f.closed:
+                f.close()
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+class RateLimiter:
+    """
+    Token bucket shared by every transfer of a run, capping their combined bandwidth.
+
+    Transfers call `consume` with the size of each chunk they receive; it
+    returns at once while the bucket holds enough tokens and otherwise
+    sleeps until the chunk fits the rate. Tokens are reserved before
+    sleeping, so concurrent transfers get their turns in order and share
+    the rate evenly. Not reading the socket meanwhile lets TCP flow control
+    slow the sender down.
+
+    The rate can follow a time-of-day schedule: inside one of its windows
+    the window's rate applies, elsewhere `rate` does.
+
+    Attributes:
+        rate (int): Bytes per second outside the schedule, 0 for unlimited.
+        schedule (list): (start minute, end minute, bytes per second) windows of the day, local time.
+        throttled (float): Seconds transfers spent waiting so far, summed over all of them.
+    """
+    def __init__(self, rate=0, schedule=()):
+        self.rate = rate
+        self.schedule = list(schedule)
+        self.throttled = 0.0
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def current_rate(self):
+        """
+        Returns the rate that applies now, 0 for unlimited.
+        """
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.schedule:
+            # A window such as 22:00-06:00 wraps around midnight.
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate
+        return self.rate
+
+    def chunk_size(self, size):
+        """
+        Caps a read size so that single chunks stay within the bucket.
+        """
+        rate = self.current_rate()
+        return min(size, self.__burst__(rate)) if rate else size
+
+    def consume(self, size):
+        """
+        Takes `size` bytes from the bucket, sleeping until the rate allows them.
+
+        Returns:
+            float: The seconds slept.
+        """
+        rate = self.current_rate()
+        if not rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.__burst__(rate), self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= size
+            delay = -self.tokens / rate if self.tokens < 0 else 0.0
+            self.throttled += delay
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def describe(self):
+        """
+        Describes the limit for reports, e.g. "2.0 MB/s" or "unlimited".
+        """
+        rate = self.current_rate()
+        return f'{rate/1e6:.1f} MB/s' if rate else 'unlimited'
+
+    @staticmethod
+    def __burst__(rate):
+        # A quarter of a second of traffic, but at least 16 KiB.
+        return max(rate / 4, 16 * 1024)
+
+def parse_schedule(text):
+    """
+    Parses a rate schedule such as "09:00-18:00=2M,18:00-20:00=10M" for `RateLimiter`.
+
+    Each comma separated window gives a local time range and the rate (see
+    `parse_size`, 0 for unlimited) that applies inside it.
+
+    Returns:
+        list: (start minute, end minute, bytes per second) tuples.
+
+    Raises:
+        ValueError: If a window is malformed.
+    """
+    windows = []
+    for window in filter(None, (window.strip() for window in text.split(','))):
+        match = re.fullmatch(r"(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=(\S+)", window)
+        if not match:
+            raise ValueError(f'Invalid rate schedule window {window!r}, expected HH:MM-HH:MM=RATE')
+        start_hour, start_minute, end_hour, end_minute = map(int, match.groups()[:4])
+        if max(start_hour, end_hour) > 24 or max(start_minute, end_minute) > 59:
+            raise ValueError(f'Invalid time in rate schedule window {window!r}')
+        windows.append((start_hour * 60 + start_minute, end_hour * 60 + end_minute, parse_size(match.group(5))))
+    return windows
+
+class Tracer:
+    """
+    Records timed spans for the phases of a run: requests, parsing, downloads, subprocesses.
+
+    Each span has a name, a start and duration, the thread it ran on, its
+    parent span on that thread and a dict of attributes that the code
+    being timed fills in (url, bytes, status, ttfb, ...). Nothing is
+    recorded unless `enabled` is set, so the hooks cost next to nothing
+    in a normal run.
+
+    Attributes:
+        enabled (bool): Whether spans are recorded.
+        spans (list): The recorded spans, in start order.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Times the enclosed block as span `name`, yielding its attribute dict for the block to fill in.
+        """
+        if not self.enabled:
+            yield attrs
+            return
+        stack = self.local.__dict__.setdefault('stack', [])
+        record = {'name': name, 'start': time.perf_counter() - self.started, 'duration': None,
+                  'thread': threading.get_ident(), 'parent': stack[-1]['id'] if stack else None, 'attrs': attrs}
+        with self.lock:
+            record['id'] = len(self.spans)
+            self.spans.append(record)
+        stack.append(record)
+        try:
+            yield attrs
+        except Exception as e:
+            attrs['error'] = type(e).__name__
+            raise
+        finally:
+            record['duration'] = time.perf_counter() - self.started - record['start']
+            # Spans opened in generators do not always close in stack order.
+            stack.remove(record)
+
+    def summary(self, file=sys.stderr):
+        """
+        Prints a table of the time spent per phase to `file`.
+
+        'self' is the time not covered by child spans on the same thread,
+        e.g. the parsing part of a streamed listing.
+        """
+        spans = [span for span in self.spans if span['duration'] is not None]
+        if not spans:
+            return
+        children = {}
+        for span in spans:
+            if span['parent'] is not None:
+                children[span['parent']] = children.get(span['parent'], 0) + span['duration']
+        phases = {}
+        for span in spans:
+            phase = phases.setdefault(span['name'], {'count': 0, 'total': 0, 'self': 0, 'max': 0, 'bytes': 0, 'ttfb': []})
+            phase['count'] += 1
+            phase['total'] += span['duration']
+            phase['self'] += max(span['duration'] - children.get(span['id'], 0), 0)
+            phase['max'] = max(phase['max'], span['duration'])
+            phase['bytes'] += span['attrs'].get('bytes', 0)
+            if 'ttfb' in span['attrs']:
+                phase['ttfb'].append(span['attrs']['ttfb'])
+        print(f'\n{"phase":<12} {"count":>6} {"total s":>9} {"self s":>8} {"max ms":>8} '
+              f'{"avg TTFB ms":>12} {"MB":>8} {"MB/s":>7}', file=file)
+        for name, phase in phases.items():
+            ttfb = f'{sum(phase["ttfb"]) / len(phase["ttfb"]) * 1000:.0f}' if phase['ttfb'] else '-'
+            rate = f'{phase["bytes"] / 1e6 / phase["total"]:.1f}' if phase['bytes'] and phase['total'] else '-'
+            print(f'{name:<12} {phase["count"]:>6} {phase["total"]:>9.3f} {phase["self"]:>8.3f} '
+                  f'{phase["max"] * 1000:>8.0f} {ttfb:>12} {phase["bytes"] / 1e6:>8.1f} {rate:>7}', file=file)
+
+    def write_json(self, path):
+        """
+        Writes the spans to `path` in the Chrome trace event format (chrome://tracing, Perfetto).
+        """
+        events = [{'name': span['name'], 'cat': 'kmanager', 'ph': 'X', 'pid': os.getpid(), 'tid': span['thread'],
+                   'ts': round(span['start'] * 1e6), 'dur': round((span['duration'] or 0) * 1e6),
+                   'args': dict(span['attrs'], id=span['id'], parent=span['parent'])}
+                  for span in self.spans]
+        from email.utils import formatdate
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms',
+                 'otherData': {'started': formatdate(self.wall_started, usegmt=True), 'argv': sys.argv}}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, indent=1, default=str)
+
+def __cache_dir__():
+    """
+    Returns the kmanager cache directory, honouring $XDG_CACHE_HOME.
+    """
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'kmanager'
+
+def __write_atomic__(path, data):
+    """
+    Writes `data` to `path` through a temporary file so readers never see a partial file.
+    """
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def iter_hrefs(chunks):
+    """
+    Yields the href of every anchor tag in an HTML page, as the page streams in.
+
+    Only the bytes after the last complete tag are carried over between
+    chunks, so memory use is bounded by the chunk size rather than the page.
+    This is all a PPA directory listing needs; BeautifulSoup is only used
+    as a fallback (see `Kops.__page_hrefs__`).
+
+    Args:
+        chunks (iterable): The page as a sequence of bytes chunks.
+
+    Yields:
+        str: The (HTML unescaped) href values in page order.
+    """
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        # Everything up to the last '>' holds only complete tags.
+        cut = pending.rfind(b'>') + 1
+        if not cut:
+            continue
+        for match in HREF_RE.finditer(pending, 0, cut):
+            yield unescape((match.group(1) or match.group(2) or match.group(3) or b'').decode('utf-8', 'replace'))
+        pending = pending[cut:]
+    for match in HREF_RE.finditer(pending):
+        yield unescape((match.group(1) or match.group(2) or match.group(3) or b'').decode('utf-8', 'replace'))
+
+def __is_version_href__(href):
+    """
+    Returns True if `href` looks like a kernel version directory (e.g. "v6.12-rc1/").
+    """
+    return href.startswith('v') and href.endswith('/')
+
+def __sha256_file__(path, digest=True):
+    """
+    Returns the SHA-256 of the file at `path`, as a hex digest or (with digest=False) the hash object.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            sha256.update(chunk)
+    return sha256.hexdigest() if digest else sha256
+
+def __tree_size__(path):
+    """
+    Returns the total size of the files under `path`.
+    """
+    return sum(file.stat().st_size for file in Path(path).rglob('*') if file.is_file())
+
+def parse_size(text):
+    """
+    Parses a size such as "512K", "20M" or "2G" (powers of 1024) into bytes.
+
+    Raises:
+        ValueError: If `text` is not a size.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    text = text.strip().upper().removesuffix('B').removesuffix('I')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def __read_file_range__(path, offset, length):
+    """
+    Returns up to `length` bytes of the file at `path` from `offset`.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+def __read_chunks__(f, chunk_size):
+    """
+    Yields the contents of the open file `f` in chunks, closing it when done.
+    """
+    with f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+def __in_thread__(function, *args):
+    """
+    Runs `function(*args)` on a new daemon thread and returns a Future of its result.
+
+    Unlike an executor's workers, a daemon thread never holds up the exit
+    of the program, so a hedged request left waiting on a slow mirror is
+    simply abandoned.
+    """
+    from concurrent.futures import Future
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(function(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+def __print_line__(message):
+    """
+    Prints `message` as a whole line with a single write, so that lines printed
+    from concurrent worker threads never interleave.
+    """
+    print(f'{message}\n', end='', flush=True)
+
+def __chunk_size__(length):
+    """
+    Picks a streaming buffer size for a download of the given length.
+
+    Small files are read in 64 KiB chunks; large files use up to 1 MiB so
+    that per-chunk overhead does not limit throughput.
+
+    Args:
+        length (int or None): The Content-Length of the response, if known.
+
+    Returns:
+        int: The chunk size in bytes.
+    """
+    if not length:
+        return 256 * 1024
+    return max(64 * 1024, min(length // 64, 1024 * 1024))
 
 def __extract_version_info__(version_string):
     """
@@ -372,13 +3244,8 @@ def __extract_version_info__(version_string):
             - Returns None if the `version_string` does not match the expected pattern
               to extract major.minor version.
     """
-    # Regex explanation:
-    # (\d+\.\d+)       : Captures the 'major.minor' part (e.g., "6.14") into group 1. This is required.
-    # (?:\.\d+)?       : Optionally matches (but doesn't capture) a patch version (e.g., ".0"). The '?:' makes it non-capturing.
-    # (?:-\d+)?        : Optionally matches (but doesn't capture) build metadata or other numbers like "-061400".
-    # (?:rc(\d+))?     : Optionally matches (but doesn't capture the "rc" part itself) "rc" followed by one or more digits.
-    #                   The digits (\d+) following "rc" are captured into group 2 (e.g., "3" from "rc3").
-    match = re.match(r"(\d+\.\d+)(?:\.\d+)?(?:-\d+)?(?:rc(\d+))?", version_string)
+    # The pattern is compiled once at import time, see VERSION_INFO_RE.
+    match = VERSION_INFO_RE.match(version_string)
 
     major_minor=None # Initialize to None, in case of no match.
     if match:
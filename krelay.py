@@ -0,0 +1,379 @@
+""" Caching relay of the mainline kernel PPA, used by `kmanager --serve` """
+import hashlib
+import os
+import posixpath
+import re
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+import requests
+
+import kmods
+
+# Package files are cached forever and shared between concurrent downloads;
+# everything else (directory listings, status, CHECKSUMS) goes through the HTTP cache.
+ARTIFACT_RE = re.compile(r"v[^/]+/[^/]+/[^/]+\.deb")
+# The only paths the relay answers: the index, version directories and their contents.
+PATH_RE = re.compile(r"(v[^/]+/([^/]+/([^/]+)?)?)?")
+# A "bytes=N-" range, as kmanager sends when it resumes a download, or a
+# bounded "bytes=N-M" one, as the preflight sends to read the control data.
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)$")
+
+class Transfer:
+    """
+    One upstream download of an artifact, shared by every client that asks for it.
+
+    The upstream body is written to a '.part' file by a single thread while
+    any number of clients read it back as it grows. Once complete (and
+    verified against the published CHECKSUMS) the file is renamed into the
+    mirror.
+
+    Attributes:
+        size (int): Bytes written to the '.part' file so far.
+        total (int): The full size of the artifact, once upstream has answered.
+        done (bool): True once the artifact is complete and in the mirror.
+        error (str): Why the transfer failed, if it did.
+    """
+    def __init__(self, part_path):
+        self.part_path = part_path
+        self.cond = threading.Condition()
+        self.size = 0
+        self.total = None
+        self.done = False
+        self.error = None
+
+    def wait_for(self, position):
+        """
+        Blocks until more than `position` bytes are available or the transfer ends.
+
+        Returns:
+            int: The number of bytes now available.
+        """
+        with self.cond:
+            while self.size <= position and not self.done and self.error is None:
+                self.cond.wait(timeout=30)
+            return self.size
+
+class Relay:
+    """
+    Mirrors the PPA directory layout and fetches each artifact upstream only once.
+
+    Attributes:
+        kops (Kops): Provides the upstream mirrors, `kernel_url` and HTTP cache.
+        root (Path): Where mirrored artifacts are stored.
+    """
+    def __init__(self, kops, root):
+        self.kops = kops
+        self.root = Path(root)
+        self.transfers = {}
+        self.lock = threading.Lock()
+
+    def transfer(self, path):
+        """
+        Returns the in-progress Transfer for `path`, starting one if there is none.
+        """
+        with self.lock:
+            transfer = self.transfers.get(path)
+            if transfer is None or transfer.error is not None:
+                local = self.root / path
+                local.parent.mkdir(parents=True, exist_ok=True)
+                transfer = Transfer(f'{local}.part')
+                self.transfers[path] = transfer
+                threading.Thread(target=self.__download__, args=(path, transfer), daemon=True).start()
+            return transfer
+
+    def __download__(self, path, transfer):
+        """
+        Fetches `path` from upstream into the mirror, publishing progress on `transfer`.
+        """
+        url = self.kops.kernel_url + path
+        try:
+            expected = self.kops.__published_checksums__(posixpath.dirname(url) + '/').get(posixpath.basename(path))
+            sha256 = hashlib.sha256()
+            # The '.part' file exists before any client is told the size, so readers can always open it.
+            with self.kops.__request__('GET', url, stream=True) as response, \
+                    open(transfer.part_path, 'wb') as f:
+                response.raise_for_status()
+                with transfer.cond:
+                    transfer.total = int(response.headers.get('Content-Length', 0)) or None
+                    transfer.cond.notify_all()
+                chunk_size = self.kops.limiter.chunk_size(kmods.__chunk_size__(transfer.total))
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    f.flush()
+                    sha256.update(chunk)
+                    with transfer.cond:
+                        transfer.size += len(chunk)
+                        transfer.cond.notify_all()
+                    # Upstream fetches share the relay's bandwidth limit.
+                    self.kops.limiter.consume(len(chunk))
+            if transfer.total is not None and transfer.size != transfer.total:
+                raise requests.exceptions.ChunkedEncodingError(f'upstream sent {transfer.size} of {transfer.total} bytes')
+            if expected and sha256.hexdigest() != expected:
+                raise ValueError(f'checksum mismatch (expected {expected}, got {sha256.hexdigest()})')
+            os.replace(transfer.part_path, self.root / path)
+            print(f'Relay: mirrored {path} ({transfer.size / 1e6:.1f} MB)')
+            with transfer.cond:
+                transfer.total = transfer.size
+                transfer.done = True
+                transfer.cond.notify_all()
+        except (requests.exceptions.RequestException, OSError, ValueError) as e:
+            print(f'Error: Relay could not fetch {url}. Details: {e}')
+            with transfer.cond:
+                transfer.error = str(e)
+                transfer.cond.notify_all()
+            if os.path.exists(transfer.part_path):
+                os.unlink(transfer.part_path)
+        finally:
+            with self.lock:
+                if self.transfers.get(path) is transfer and transfer.error is None:
+                    del self.transfers[path]
+
+class RelayHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET and HEAD requests for the mirrored PPA layout.
+    """
+    protocol_version = 'HTTP/1.1'
+    relay = None # Set on the subclass created by `serve`
+
+    def do_GET(self):
+        self.__respond__(send_body=True)
+
+    def do_HEAD(self):
+        self.__respond__(send_body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+    def __respond__(self, send_body):
+        requested = self.path.split('?', 1)[0]
+        path = posixpath.normpath(requested).lstrip('/')
+        path = '' if path in ('', '.') else path + ('/' if requested.endswith('/') else '')
+        if '..' in path.split('/') or not PATH_RE.fullmatch(path):
+            self.__send_error__(404)
+        elif ARTIFACT_RE.fullmatch(path):
+            try:
+                self.__send_artifact__(path, send_body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client hung up, e.g. once it read all it needed.
+                self.close_connection = True
+        else:
+            self.__send_page__(path, send_body)
+
+    def __send_error__(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def __send_page__(self, path, send_body):
+        """
+        Serves a listing, status or CHECKSUMS file through the relay's HTTP cache.
+        """
+        kops = self.relay.kops
+        # Published status and CHECKSUMS files never change.
+        permanent = path.endswith('/status') or path.endswith('/CHECKSUMS')
+        try:
+            body = kops.__fetch__(kops.kernel_url + path, permanent=permanent)
+        except requests.exceptions.HTTPError as e:
+            self.__send_error__(e.response.status_code)
+            return
+        except requests.exceptions.RequestException:
+            self.__send_error__(502)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html' if not path or path.endswith('/') else 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def __send_artifact__(self, path, send_body):
+        """
+        Serves an artifact from the mirror, or streams it while it is fetched upstream.
+
+        Open ranges ("bytes=N-", a resumed download) are served from the
+        mirror or from the transfer that fills it. A bounded range for an
+        artifact that is neither mirrored nor being fetched (e.g. the
+        control data the preflight reads) is passed on upstream instead,
+        so that reading a few kilobytes never makes the relay mirror the package.
+        """
+        local = self.relay.root / path
+        start, end = 0, None
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else None
+            if end is not None and end < start:
+                match = None
+                start, end = 0, None
+        transfer = None
+        if local.exists():
+            total = local.stat().st_size
+        elif not send_body:
+            self.__send_head__(path)
+            return
+        else:
+            with self.relay.lock:
+                transfer = self.relay.transfers.get(path)
+            if end is not None and (transfer is None or transfer.error is not None):
+                self.__send_upstream_range__(path, start, end)
+                return
+            transfer = self.relay.transfer(path)
+            with transfer.cond:
+                while transfer.total is None and not transfer.done and transfer.error is None:
+                    transfer.cond.wait(timeout=30)
+            if transfer.error is not None:
+                self.__send_error__(502)
+                return
+            if transfer.total is None:
+                # Upstream did not send a length, wait for the whole file.
+                transfer.wait_for(float('inf'))
+            total = transfer.total
+
+        end = total - 1 if end is None else min(end, total - 1)
+        if match:
+            if start >= total:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{total}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{total}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.debian.binary-package')
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if not send_body:
+            return
+        if transfer is None or transfer.done:
+            with open(local if transfer is None or local.exists() else transfer.part_path, 'rb') as f:
+                f.seek(start)
+                remaining = end + 1 - start
+                while remaining and (chunk := f.read(min(remaining, 1024 * 1024))):
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            return
+        # Tail the '.part' file; the open handle stays valid when it is renamed into the mirror.
+        try:
+            f = open(transfer.part_path, 'rb')
+        except FileNotFoundError:
+            # Completed (and renamed) between the checks above.
+            f = open(local, 'rb')
+        with f:
+            position = start
+            while position <= end:
+                available = transfer.wait_for(position)
+                if transfer.error is not None and available <= position:
+                    # Upstream failed, cut the response short so the client retries.
+                    self.close_connection = True
+                    return
+                f.seek(position)
+                chunk = f.read(min(available, end + 1, position + 1024 * 1024) - position)
+                if not chunk:
+                    continue
+                self.wfile.write(chunk)
+                position += len(chunk)
+
+    def __send_upstream_range__(self, path, start, end):
+        """
+        Answers the range `start`-`end` of an artifact that is not mirrored straight from upstream.
+        """
+        kops = self.relay.kops
+        try:
+            response = kops.__request__('GET', kops.kernel_url + path, headers={'Range': f'bytes={start}-{end}'},
+                                        stream=True)
+        except requests.exceptions.RequestException:
+            self.__send_error__(502)
+            return
+        with response:
+            if response.status_code == 416:
+                self.send_response(416)
+                self.send_header('Content-Range', response.headers.get('Content-Range', 'bytes */*'))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if response.status_code not in (200, 206):
+                self.__send_error__(response.status_code if response.status_code < 500 else 502)
+                return
+            if response.status_code == 206:
+                content_range = response.headers.get('Content-Range', f'bytes {start}-{end}/*')
+                body = response.content
+            else:
+                # Upstream ignored the range and sends the whole file, keep only the part asked for.
+                total = response.headers.get('Content-Length', '*')
+                data = bytearray()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    data += chunk
+                    if len(data) > end:
+                        break
+                body = bytes(data[start:end + 1])
+                if not body:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{total}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                content_range = f'bytes {start}-{start + len(body) - 1}/{total}'
+        self.send_response(206)
+        self.send_header('Content-Type', 'application/vnd.debian.binary-package')
+        self.send_header('Content-Range', content_range)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __send_head__(self, path):
+        """
+        Answers a HEAD request for an artifact that is not mirrored, without fetching it.
+
+        A transfer in progress already knows the size, otherwise the request
+        is passed on upstream: clients asking only for a size (e.g. of the
+        packages they skip) never make the relay download the artifact.
+        """
+        kops = self.relay.kops
+        with self.relay.lock:
+            transfer = self.relay.transfers.get(path)
+        if transfer is not None and transfer.error is None and transfer.total is not None:
+            total = transfer.total
+        else:
+            try:
+                response = kops.__request__('HEAD', kops.kernel_url + path, allow_redirects=True)
+            except requests.exceptions.RequestException:
+                self.__send_error__(502)
+                return
+            if not response.ok:
+                self.__send_error__(response.status_code if response.status_code < 500 else 502)
+                return
+            total = response.headers.get('Content-Length')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.debian.binary-package')
+        if total is not None:
+            self.send_header('Content-Length', str(total))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+def serve(kops, address):
+    """
+    Runs the relay on `address` ("host:port") until interrupted.
+
+    Args:
+        kops (Kops): Supplies the upstream `kernel_url`, session and HTTP cache.
+        address (str): Where to listen, e.g. "0.0.0.0:8080".
+    """
+    host, _, port = address.rpartition(':')
+    relay = Relay(kops, kmods.__cache_dir__() / 'mirror')
+    handler = type('BoundRelayHandler', (RelayHandler,), {'relay': relay})
+    server = ThreadingHTTPServer((host or '0.0.0.0', int(port)), handler)
+    server.daemon_threads = True
+    print(f'Relaying {kops.kernel_url} on http://{host or "0.0.0.0"}:{port}/ (mirror in {relay.root})')
+    print(f'Point clients at it with: kmanager.py --kernel-url http://<this host>:{port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Relay stopped.')
+    finally:
+        server.server_close()
@@ -0,0 +1,58 @@
+""" Fixtures shared by the tests: a fake PPA in this process and the real command line run against it """
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'bench')]
+
+import fakeppa
+
+@pytest.fixture
+def ppa():
+    """
+    A small fake PPA served on a free local port for the duration of a test.
+    """
+    server = fakeppa.FakePPA(entries=200, deb_size=256 * 1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def relay(ppa, tmp_path):
+    """
+    A `--serve` relay of `ppa`, mirroring into a temporary directory.
+    """
+    import kmods
+    import krelay
+    from http.server import ThreadingHTTPServer
+    kops = kmods.Kops()
+    kops.kernel_url = ppa.url
+    kops.cache = kmods.HttpCache(tmp_path / 'relay-cache')
+    relay = krelay.Relay(kops, tmp_path / 'mirror')
+    handler = type('BoundRelayHandler', (krelay.RelayHandler,), {'relay': relay})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/'
+    server.relay = relay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def kmanager(ppa, tmp_path):
+    """
+    Runs kmanager.py against `ppa` with its own cache and download directory, returning the process.
+    """
+    def run(*args):
+        env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / 'cache'), PYTHONPATH=str(ROOT))
+        command = [sys.executable, str(ROOT / 'kmanager.py'), '--kernel-url', ppa.url,
+                   '--download-dir', str(tmp_path / 'debs'), *args]
+        return subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, timeout=60)
+    return run
@@ -0,0 +1,45 @@
+""" Planning which old kernels --clean removes """
+import kmods
+
+def package(name, depends=''):
+    return (f'Package: {name}\nStatus: install ok installed\nInstalled-Size: 1024\nVersion: 1.0\n'
+            + (f'Depends: {depends}\n' if depends else ''))
+
+# Two distribution kernels, the newest one pulled in by the linux-image-generic
+# metapackage, and three mainline kernels, one of them running.
+STATUS = '\n'.join([
+    package('linux-image-6.8.0-45-generic'),
+    package('linux-modules-6.8.0-45-generic'),
+    package('linux-image-6.8.0-50-generic'),
+    package('linux-modules-6.8.0-50-generic'),
+    package('linux-image-generic', 'linux-image-6.8.0-50-generic (= 6.8.0-50.51), linux-firmware | wireless-firmware'),
+    package('linux-image-unsigned-6.11.0-061100-generic'),
+    package('linux-image-unsigned-6.12.0-061200-generic'),
+    package('linux-image-unsigned-6.13.0-061300-generic'),
+    package('bash', 'base-files (>= 2.1.12)'),
+])
+
+def plan(tmp_path, capsys):
+    status = tmp_path / 'status'
+    status.write_text(STATUS)
+    kops = kmods.Kops()
+    kops.dpkg_status = str(status)
+    kops.platform = '6.13.0-061300-generic'
+    kops.keep = 1
+    kops.dry_run = True
+    kops.clean(None)
+    output = capsys.readouterr().out
+    return output.partition('Removing:')[2]
+
+def test_clean_keeps_kernels_metapackages_depend_on(tmp_path, capsys):
+    removing = plan(tmp_path, capsys)
+    assert '6.8.0-50' not in removing
+    assert 'linux-image-6.8.0-45-generic' in removing
+    assert 'linux-image-unsigned-6.11.0-061100-generic' in removing
+    assert '6.13.0-061300' not in removing
+
+def test_required_kernels():
+    installed = [kmods.InstalledPackage('linux-image-generic', '1', 'installed', 0, 'linux-image-6.8.0-50-generic'),
+                 kmods.InstalledPackage('linux-headers-6.8.0-50-generic', '1', 'installed', 0, 'linux-headers-6.8.0-50'),
+                 kmods.InstalledPackage('linux-generic', '1', 'config-files', 0, 'linux-image-6.8.0-45-generic')]
+    assert kmods.required_kernels(installed) == {'6.8.0-50': ['linux-image-generic']}
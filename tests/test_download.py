@@ -0,0 +1,21 @@
+""" Retrying downloads """
+import socket
+
+import kmods
+
+def test_refused_download_is_tried_retries_plus_one_times(tmp_path, monkeypatch):
+    # A port nothing listens on refuses every connection.
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    kops = kmods.Kops()
+    kops.kernel_url = f'http://127.0.0.1:{port}/'
+    kops.retries = 3
+    monkeypatch.setattr(kmods.time, 'sleep', lambda seconds: None)
+    attempts = []
+    request = kops.session.request
+    monkeypatch.setattr(kops.session, 'request', lambda *args, **kwargs: attempts.append(args) or request(*args, **kwargs))
+
+    url = kops.kernel_url + 'v6.12/amd64/linux-image.deb'
+    assert kops.__download_file__(url, str(tmp_path / 'linux-image.deb')) is None
+    assert len(attempts) == kops.retries + 1
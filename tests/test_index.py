@@ -0,0 +1,36 @@
+""" The version index: tail fetches and offline use """
+
+def test_offline_list_after_ttl_uses_stored_index(ppa, kmanager):
+    online = kmanager('-l', '-n', '5')
+    assert online.returncode == 0, online.stdout + online.stderr
+    ppa.shutdown()
+
+    # --cache-ttl 0 makes everything cached stale, nothing may go to the (stopped) PPA.
+    offline = kmanager('--offline', '--cache-ttl', '0', '-l', '-n', '5')
+    assert offline.returncode == 0, offline.stdout + offline.stderr
+    assert 'not cached' not in offline.stdout
+    listed = [line.split()[0] for line in offline.stdout.splitlines() if '(' in line]
+    assert listed == ppa.versions[-5:]
+
+def test_unchanged_page_is_revalidated_without_a_body(ppa, tmp_path, monkeypatch):
+    import fakeppa
+    import kmods
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    kops = kmods.Kops()
+    kops.kernel_url = ppa.url
+    kops.cache = kmods.HttpCache(tmp_path / 'http', ttl=0)
+    kops.__refresh_index__(5)
+    assert kops.index.etag
+
+    # Nothing published since: the tail request is answered with a 304.
+    ppa.reset_stats()
+    kops.__refresh_index__(5)
+    assert ppa.requests == 1 and ppa.sent == 0
+    assert kops.index.names[-5:] == ppa.versions[-5:]
+
+    # A new version changes the ETag, and the tail brings it in.
+    ppa.versions = fakeppa.versions(201)
+    ppa.known = set(ppa.versions)
+    ppa.index = fakeppa.synthetic_index(201)
+    kops.__refresh_index__(5)
+    assert kops.index.names[-5:] == ppa.versions[-5:]
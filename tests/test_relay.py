@@ -0,0 +1,32 @@
+""" The --serve relay """
+import fakeppa
+import kmods
+
+def client(relay, tmp_path):
+    kops = kmods.Kops()
+    kops.kernel_url = relay.url
+    kops.cache = kmods.HttpCache(tmp_path / 'client-cache')
+    kops.dpkg_status = str(tmp_path / 'status')
+    (tmp_path / 'status').write_text('')
+    return kops
+
+def mirrored(relay):
+    return sorted(path.name for path in relay.relay.root.rglob('*.deb*'))
+
+def test_bounded_range_is_passed_upstream(ppa, relay, tmp_path):
+    version = ppa.versions[-1]
+    name = fakeppa.packages(version, 'amd64')[1]
+    kops = client(relay, tmp_path)
+    data = kops.__read_range__(f'{relay.url}v{version}/amd64/{name}', 100, 1000)
+    assert data == ppa.body(name)[100:1100]
+    assert mirrored(relay) == []
+
+def test_preflight_does_not_mirror_packages(ppa, relay, tmp_path):
+    kops = client(relay, tmp_path)
+    kops.deb_arch = 'amd64'
+    release = kops.release(ppa.versions[-1])
+    ppa.reset_stats()
+    kops.__preflight__(release)
+    assert mirrored(relay) == []
+    # The control data only, not the packages.
+    assert ppa.sent < 4 * ppa.deb_size
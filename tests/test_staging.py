@@ -0,0 +1,35 @@
+""" The size-capped staging cache """
+import json
+import os
+
+import kmods
+
+def stage(root, key, files, manifest=True, mtime=None):
+    directory = root / key
+    directory.mkdir(parents=True)
+    for name, size in files.items():
+        (directory / name).write_bytes(b'\0' * size)
+    if manifest:
+        entries = {'https://ppa/v/amd64/': {name: {'size': size} for name, size in files.items()}}
+        (directory / kmods.VerifiedManifest.FILENAME).write_text(json.dumps(entries))
+    if mtime is not None:
+        os.utime(directory, (mtime, mtime))
+    return directory
+
+def test_downloads_without_a_manifest_are_evicted(tmp_path):
+    root = tmp_path / 'staging'
+    interrupted = stage(root, '6.10/amd64', {'linux-image.deb': 4000, 'linux-modules.deb.part': 3000},
+                        manifest=False)
+    (interrupted / 'notes.txt').write_text('not ours')
+    os.utime(interrupted, (1000, 1000))
+    stage(root, '6.11/amd64', {'linux-image.deb': 4000}, mtime=2000)
+    stranger = stage(root, 'backups/amd64', {'disk.deb': 4000}, manifest=False, mtime=500)
+
+    staging = kmods.StagingCache(root, limit=5000)
+    assert set(staging.entries) == {'6.10/amd64', '6.11/amd64'}
+    assert not staging.verified('6.10/amd64') and staging.verified('6.11/amd64')
+
+    assert staging.evict() == ['6.10/amd64']
+    assert sorted(os.listdir(interrupted)) == ['notes.txt']
+    assert (root / '6.11/amd64/linux-image.deb').exists()
+    assert (stranger / 'disk.deb').exists()